@@ -0,0 +1,25 @@
+import ale_py
+from stable_baselines3.common.atari_wrappers import EpisodicLifeEnv
+from stable_baselines3.common.env_util import make_atari_env, unwrap_wrapper
+from stable_baselines3.common.vec_env import VecFrameStack
+
+# ### the env factory of the atari domains, imported by the domain registry only when an atari domain makes its first
+# ### env. importing ale_py registers the atari envs with gym
+
+
+def make_atari_domain_env(domain, seed=None):
+    env = make_atari_env(domain.env_id, n_envs=1, seed=seed)
+    if domain.frame_stack is not None:
+        env = VecFrameStack(env, n_stack=domain.frame_stack)
+    return env
+
+
+def reseed_atari_env(env, seed):
+    # make_atari_env seeds the vec env only for its first reset. a reused env is reseeded for the next reset, and its
+    # episodic life wrapper is told that the last game really ended, so that reset restarts the game instead of
+    # stepping a noop after a lost life
+    env.seed(seed)
+    for atari_env in env.unwrapped.envs:
+        episodic_life_env = unwrap_wrapper(atari_env, EpisodicLifeEnv)
+        if episodic_life_env is not None:
+            episodic_life_env.was_real_done = True
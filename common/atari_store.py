@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from common.columns import open_column, read_column
+
+# ### an atari observation store keeps every distinct frame once. an observation of shape (1, 84, 84, n_stack) is stored
+# ### as a row of n_stack indices into the frames column, so the frames that a frame stack shares with the previous
+# ### step, and the frames that executions from the same seed share, take no extra space. both columns are flat binary
+# ### files that the reader memory maps, so any observation can be rebuilt without reading the others (or, when the
+# ### store is compressed, decompresses into memory)
+
+ATARI_STORE_FORMAT_VERSION = 1
+
+
+class AtariObservationStoreWriter:
+    def __init__(self, path, compression=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compression = compression
+        self.frames_file = open_column(os.path.join(path, 'frames.bin'), compression)
+        self.stacks_file = open_column(os.path.join(path, 'stacks.bin'), compression)
+        self.frame_indices = {}
+        self.observation_shape = None
+        self.num_observations = 0
+
+    def _frame_index(self, frame):
+        frame_bytes = frame.tobytes()
+        digest = hashlib.blake2b(frame_bytes, digest_size=16).digest()
+        if digest not in self.frame_indices:
+            self.frame_indices[digest] = len(self.frame_indices)
+            self.frames_file.write(frame_bytes)
+        return self.frame_indices[digest]
+
+    def append(self, observations):
+        # stores a list of observations and returns the (start, length) of their slice in the store
+        start = self.num_observations
+        for obs in observations:
+            obs = np.asarray(obs, dtype=np.uint8)
+            if self.observation_shape is None:
+                self.observation_shape = list(obs.shape)
+            elif list(obs.shape) != self.observation_shape:
+                raise ValueError(f'Observation of shape {obs.shape} does not fit a store of shape {self.observation_shape}.')
+            stack = np.array([self._frame_index(np.ascontiguousarray(obs[..., j])) for j in range(obs.shape[-1])], dtype='<i8')
+            self.stacks_file.write(stack.tobytes())
+            self.num_observations += 1
+        return start, self.num_observations - start
+
+    def flush(self):
+        self.frames_file.flush()
+        self.stacks_file.flush()
+        meta = {
+            'format_version': ATARI_STORE_FORMAT_VERSION,
+            'compression': self.compression,
+            'observation_shape': self.observation_shape,
+            'num_frames': len(self.frame_indices),
+            'num_observations': self.num_observations,
+        }
+        with open(os.path.join(self.path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.flush()
+        self.frames_file.close()
+        self.stacks_file.close()
+
+
+class AtariObservationStore:
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != ATARI_STORE_FORMAT_VERSION:
+            raise ValueError(f'Unsupported atari observation store format version {self.meta["format_version"]}.')
+        self.observation_shape = tuple(self.meta['observation_shape'] or [])
+        num_frames = self.meta['num_frames']
+        num_observations = self.meta['num_observations']
+        if num_observations == 0:
+            self.frames = np.empty((0,), dtype=np.uint8)
+            self.stacks = np.empty((0, 0), dtype='<i8')
+            return
+        compression = self.meta.get('compression')
+        self.frames = read_column(os.path.join(path, 'frames.bin'), compression, np.uint8,
+                                  (num_frames,) + self.observation_shape[:-1])
+        self.stacks = read_column(os.path.join(path, 'stacks.bin'), compression, '<i8',
+                                  (num_observations, self.observation_shape[-1]))
+
+    def __len__(self):
+        return len(self.stacks)
+
+    def observations(self, start, length):
+        # the observations start .. start + length as one (length, 1, 84, 84, n_stack) array
+        stacks = self.stacks[start:start + length]
+        return np.moveaxis(self.frames[stacks], 1, -1)
+
+    def __getitem__(self, i):
+        return np.moveaxis(self.frames[self.stacks[i]], 0, -1)
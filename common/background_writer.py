@@ -0,0 +1,85 @@
+import multiprocessing
+import queue
+import threading
+import traceback
+
+# ### the record writers of a run, driven by a background thread or process. the generation loop hands every record over
+# ### through a bounded queue and goes on with the next rollouts while the earlier records are formatted, compressed and
+# ### written, so the run takes about as long as the slower of the two instead of their sum. the queue holds at most
+# ### max_pending records, which blocks the generation loop when the writers fall behind instead of piling the records up
+# ### in memory. a thread shares the records with the generation loop, while a process gets a pickled copy of each one
+# ### but does not compete with the rollouts for the GIL
+
+
+def run_writers(make_writers, make_writers_args, requests, errors):
+    # the body of the background thread or process. after an error it keeps draining the queue, so that the generation
+    # loop never blocks on a full queue, and reports the error when it is closed
+    writers = []
+    failed = False
+    try:
+        writers = make_writers(*make_writers_args)
+    except Exception:
+        errors.put(traceback.format_exc())
+        failed = True
+    while True:
+        command, record = requests.get()
+        if command == 'close':
+            break
+        if failed:
+            continue
+        try:
+            for writer in writers:
+                if command == 'write':
+                    writer.write(record)
+                else:
+                    writer.flush()
+        except Exception:
+            errors.put(traceback.format_exc())
+            failed = True
+    try:
+        for writer in writers:
+            writer.close()
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+class BackgroundRecordWriter:
+    # ### has the write / flush / close interface of a record writer. make_writers(*make_writers_args) creates the actual
+    # ### writers in the background thread or process (mode "thread" or "process")
+    def __init__(self, make_writers, make_writers_args, mode='thread', max_pending=64):
+        if mode == 'thread':
+            self.requests = queue.Queue(max_pending)
+            self.errors = queue.Queue()
+            self.worker = threading.Thread(target=run_writers, args=(make_writers, make_writers_args, self.requests, self.errors), daemon=True)
+        elif mode == 'process':
+            self.requests = multiprocessing.Queue(max_pending)
+            self.errors = multiprocessing.Queue()
+            self.worker = multiprocessing.Process(target=run_writers, args=(make_writers, make_writers_args, self.requests, self.errors), daemon=True)
+        else:
+            raise ValueError(f'Unknown background writer mode {mode}.')
+        self.worker.start()
+        self.closed = False
+
+    def _raise_error(self):
+        try:
+            error = self.errors.get_nowait()
+        except queue.Empty:
+            return
+        raise RuntimeError(f'The background record writer failed:\n{error}')
+
+    def write(self, record):
+        self._raise_error()
+        self.requests.put(('write', record))
+
+    def flush(self):
+        self._raise_error()
+        self.requests.put(('flush', None))
+
+    def close(self):
+        # waits for the writers to write every pending record and close
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put(('close', None))
+        self.worker.join()
+        self._raise_error()
@@ -0,0 +1,335 @@
+import json
+import os
+
+import numpy as np
+
+from common.atari_store import AtariObservationStore, AtariObservationStoreWriter
+from common.columns import open_column, read_column
+from common.domains import ATARI_DOMAINS
+
+# ### a benchmark bundle is a directory of flat little endian binary columns, described by a meta.json file. the
+# ### observations, registered actions and faulty action indices of all the records are concatenated into one column
+# ### each, and every record row holds the start and the length of its slice in those columns. the loader memory maps
+# ### the columns, so reading the arrays of one record touches only that record's bytes. the observations of the atari
+# ### domains go to an atari observation store in the observations sub directory instead of a column. a bundle written
+# ### with compression holds its columns compressed, and the loader decompresses them into memory instead. next to the
+# ### records, the writer keeps an index row of the fault statistics of every record, which query() filters without
+# ### reading the arrays of any record. a record whose arrays repeat those of the record before it, with the same policy
+# ### type, seed, fault mode and fault probability (the instances of a cell whose execution cannot vary), points at the
+# ### slices of that record instead of a copy of them
+
+BUNDLE_FORMAT_VERSION = 1
+
+RECORD_DTYPE = np.dtype([
+    ('policy_type', '<i4'),                     # index into the policy_types constant
+    ('seed', '<i8'),
+    ('execution_fault_mode', '<i4'),            # index into the modelled_fault_modes constant
+    ('fault_probability', '<f8'),
+    ('instance', '<i8'),
+    ('observations_start', '<i8'),
+    ('observations_length', '<i8'),
+    ('registered_actions_start', '<i8'),
+    ('registered_actions_length', '<i8'),
+    ('faulty_actions_indices_start', '<i8'),
+    ('faulty_actions_indices_length', '<i8'),
+])
+
+# ### the fault statistics of a record. the fault indices are the ordinal numbers (starting at 1) of the first and the
+# ### last faulty action (0 when no action failed), and action_divergence is the fraction of the registered actions that
+# ### were replaced by a faulty one
+INDEX_DTYPE = np.dtype([
+    ('first_fault_index', '<i8'),
+    ('last_fault_index', '<i8'),
+    ('num_registered_actions', '<i8'),
+    ('num_faulty_actions', '<i8'),
+    ('num_observations', '<i8'),
+    ('action_divergence', '<f8'),
+])
+
+# ### the record fields that query() filters on, the ones that index constants hold the index into the constant
+RECORD_FIELDS = {
+    'policy_type': 'policy_types',
+    'seed': None,
+    'execution_fault_mode': 'modelled_fault_modes',
+    'fault_probability': None,
+    'instance': None,
+}
+
+CONSTANT_FIELDS = ['domain_name', 'model_name', 'policy_types', 'seeds', 'modelled_fault_modes', 'fault_probabilities', 'instances']
+
+
+class BundleWriter:
+    def __init__(self, path, constants, compression=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compression = compression
+        self.constants = {field: constants[field] for field in CONSTANT_FIELDS}
+        self.columns = {}
+        self.files = {}
+        self.lengths = {'observations': 0, 'registered_actions': 0, 'faulty_actions_indices': 0}
+        self.num_records = 0
+        self.previous = None
+        self.records_file = open_column(os.path.join(path, 'records.bin'), compression)
+        self.index_file = open_column(os.path.join(path, 'index.bin'), compression)
+        self.observation_store = None
+        if self.constants['domain_name'] in ATARI_DOMAINS:
+            self.observation_store = AtariObservationStoreWriter(os.path.join(path, 'observations'), compression)
+
+    def _append(self, name, array, dtype=None):
+        # the first record fixes the dtype and the item shape of a column, later records are cast to it
+        if name not in self.columns:
+            dtype = np.dtype(dtype if dtype is not None else array.dtype)
+            self.columns[name] = {'dtype': dtype.newbyteorder('<').str, 'shape': list(array.shape[1:])}
+            self.files[name] = open_column(os.path.join(self.path, f'{name}.bin'), self.compression)
+        column = self.columns[name]
+        if list(array.shape[1:]) != column['shape']:
+            raise ValueError(f'{name} items of shape {array.shape[1:]} do not fit a column of shape {column["shape"]}.')
+        array = np.ascontiguousarray(array, dtype=column['dtype'])
+        self.files[name].write(array.tobytes())
+        start = self.lengths[name]
+        self.lengths[name] += len(array)
+        return start, len(array)
+
+    def _repeats_previous(self, group, registered_actions, faulty_actions_indices, observations):
+        if self.previous is None:
+            return False
+        previous_group, previous_registered_actions, previous_faulty_actions_indices, previous_observations, _ = self.previous
+        return (group == previous_group and np.array_equal(registered_actions, previous_registered_actions)
+                and np.array_equal(faulty_actions_indices, previous_faulty_actions_indices)
+                and observations.shape == previous_observations.shape and np.array_equal(observations, previous_observations))
+
+    def write(self, record):
+        registered_actions = np.asarray(record['registered_actions'], dtype=np.int64)
+        faulty_actions_indices = np.asarray(record['faulty_actions_indices'], dtype=np.int64)
+        observations = np.asarray(record['observations'])
+        group = (record['policy_type'], record['seed'], record['execution_fault_mode'], float(record['fault_probability']))
+
+        row = np.zeros(1, dtype=RECORD_DTYPE)
+        row['policy_type'] = self.constants['policy_types'].index(record['policy_type'])
+        row['seed'] = record['seed']
+        row['execution_fault_mode'] = self.constants['modelled_fault_modes'].index(record['execution_fault_mode'])
+        row['fault_probability'] = record['fault_probability']
+        row['instance'] = record['instance']
+        if self._repeats_previous(group, registered_actions, faulty_actions_indices, observations):
+            previous_row = self.previous[-1]
+            for name in ['observations', 'registered_actions', 'faulty_actions_indices']:
+                row[f'{name}_start'], row[f'{name}_length'] = previous_row[f'{name}_start'], previous_row[f'{name}_length']
+        else:
+            if self.observation_store is not None:
+                row['observations_start'], row['observations_length'] = self.observation_store.append(observations)
+            else:
+                row['observations_start'], row['observations_length'] = self._append('observations', observations)
+            for name, array in [('registered_actions', registered_actions), ('faulty_actions_indices', faulty_actions_indices)]:
+                row[f'{name}_start'], row[f'{name}_length'] = self._append(name, array, np.int64)
+            self.previous = (group, registered_actions, faulty_actions_indices, observations, row)
+        self.records_file.write(row.tobytes())
+        self.index_file.write(index_row(len(registered_actions), faulty_actions_indices, row['observations_length'][0]).tobytes())
+        self.num_records += 1
+
+    def flush(self):
+        # the columns are flushed before meta.json is replaced, so the bundle on disk always holds the records that
+        # meta.json counts, even when the run dies later
+        self.records_file.flush()
+        self.index_file.flush()
+        for f in self.files.values():
+            f.flush()
+        if self.observation_store is not None:
+            self.observation_store.flush()
+        meta = {
+            'format_version': BUNDLE_FORMAT_VERSION,
+            'compression': self.compression,
+            'observation_store': 'observations' if self.observation_store is not None else None,
+            'constants': self.constants,
+            'num_records': self.num_records,
+            'index': True,
+            'columns': {name: dict(column, length=self.lengths[name]) for name, column in self.columns.items()},
+        }
+        with open(os.path.join(self.path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.flush()
+        self.records_file.close()
+        self.index_file.close()
+        for f in self.files.values():
+            f.close()
+        if self.observation_store is not None:
+            self.observation_store.close()
+
+
+def index_row(num_registered_actions, faulty_actions_indices, num_observations):
+    row = np.zeros(1, dtype=INDEX_DTYPE)
+    if len(faulty_actions_indices) > 0:
+        row['first_fault_index'] = faulty_actions_indices[0]
+        row['last_fault_index'] = faulty_actions_indices[-1]
+    row['num_registered_actions'] = num_registered_actions
+    row['num_faulty_actions'] = len(faulty_actions_indices)
+    row['num_observations'] = num_observations
+    row['action_divergence'] = len(faulty_actions_indices) / num_registered_actions if num_registered_actions > 0 else 0.0
+    return row
+
+
+def matches(values, condition):
+    # a mask of the values that meet a query condition: a (low, high) tuple is an inclusive range (None leaves its end
+    # open), a list or a set is the allowed values, and anything else is the single allowed value
+    if isinstance(condition, tuple):
+        low, high = condition
+        mask = np.ones(len(values), dtype=bool)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+        return mask
+    if isinstance(condition, (list, set, frozenset)):
+        return np.isin(values, list(condition))
+    return values == condition
+
+
+class Bundle:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f'Unsupported bundle format version {self.meta["format_version"]}.')
+        self.constants = self.meta['constants']
+        self.records = self._map('records', RECORD_DTYPE, [], self.meta['num_records'])
+        self.columns = {name: self._map(name, np.dtype(column['dtype']), column['shape'], column['length'])
+                        for name, column in self.meta['columns'].items()}
+        self.observation_store = None
+        if self.meta['observation_store'] is not None:
+            self.observation_store = AtariObservationStore(os.path.join(path, self.meta['observation_store']))
+        self._index = None
+
+    def _map(self, name, dtype, shape, length):
+        if length == 0:
+            return np.empty([0] + shape, dtype=dtype)
+        return read_column(os.path.join(self.path, f'{name}.bin'), self.meta.get('compression'), dtype, tuple([length] + shape))
+
+    def __len__(self):
+        return len(self.records)
+
+    def _slice(self, name, i):
+        row = self.records[i]
+        start = int(row[f'{name}_start'])
+        length = int(row[f'{name}_length'])
+        return self.columns[name][start:start + length]
+
+    def observations(self, i):
+        if self.observation_store is not None:
+            row = self.records[i]
+            return self.observation_store.observations(int(row['observations_start']), int(row['observations_length']))
+        return self._slice('observations', i)
+
+    def registered_actions(self, i):
+        return self._slice('registered_actions', i)
+
+    def faulty_actions_indices(self, i):
+        return self._slice('faulty_actions_indices', i)
+
+    def trajectory_execution(self, i):
+        # the alternating series of observations and actions of the Excel output
+        observations = self.observations(i)
+        registered_actions = self.registered_actions(i)
+        trajectory = []
+        for obs, action in zip(observations, registered_actions):
+            trajectory.append(obs)
+            trajectory.append(int(action))
+        trajectory.append(observations[-1])
+        return trajectory
+
+    def record(self, i):
+        # the instance inputs and output sizes of record i, without loading its arrays
+        row = self.records[i]
+        return {
+            'domain_name': self.constants['domain_name'],
+            'model_name': self.constants['model_name'],
+            'policy_type': self.constants['policy_types'][int(row['policy_type'])],
+            'seed': int(row['seed']),
+            'execution_fault_mode': self.constants['modelled_fault_modes'][int(row['execution_fault_mode'])],
+            'fault_probability': float(row['fault_probability']),
+            'instance': int(row['instance']),
+            'num_registered_actions': int(row['registered_actions_length']),
+            'num_faulty_actions': int(row['faulty_actions_indices_length']),
+            'num_observations': int(row['observations_length']),
+        }
+
+    @property
+    def index(self):
+        # the index rows of the records. a bundle written before the index existed gets it rebuilt from its columns
+        if self._index is None:
+            if self.meta.get('index'):
+                self._index = self._map('index', INDEX_DTYPE, [], self.meta['num_records'])
+            else:
+                self._index = np.concatenate([np.zeros(0, dtype=INDEX_DTYPE)] + [
+                    index_row(int(row['registered_actions_length']), self.faulty_actions_indices(i).tolist(), int(row['observations_length']))
+                    for i, row in enumerate(self.records)])
+        return self._index
+
+    def field(self, name):
+        # the values of a record field or an index field over all the records, with the constants resolved
+        if name in INDEX_DTYPE.names:
+            return self.index[name]
+        if name not in RECORD_FIELDS:
+            raise ValueError(f'Unknown bundle field {name}.')
+        values = self.records[name]
+        if RECORD_FIELDS[name] is not None:
+            return np.array(self.constants[RECORD_FIELDS[name]], dtype=object)[values]
+        return values
+
+    def query(self, **conditions):
+        # the instances of the records that meet all the conditions, each a field name of the records or of the index
+        # mapped to a value, a list of values or an inclusive (low, high) range, as in
+        #
+        #       bundle.query(execution_fault_mode='[0,0,0]', num_faulty_actions=(5, None), first_fault_index=(1, 10))
+        #
+        mask = np.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            mask &= matches(self.field(name), condition)
+        return [BundleInstance(self, int(i)) for i in np.flatnonzero(mask)]
+
+
+class BundleInstance:
+    # ### a handle to one record of a bundle: its fields come from the record row and the index, and its arrays are only
+    # ### read when they are asked for
+    def __init__(self, bundle, i):
+        self.bundle = bundle
+        self.i = i
+
+    def __repr__(self):
+        record = self.record()
+        return (f"BundleInstance({record['policy_type']}_{record['seed']}_{record['execution_fault_mode']}_"
+                f"{record['fault_probability']}_{record['instance']})")
+
+    def record(self):
+        record = self.bundle.record(self.i)
+        row = self.bundle.index[self.i]
+        for name in INDEX_DTYPE.names:
+            record[name] = row[name].item()
+        return record
+
+    @property
+    def observations(self):
+        return self.bundle.observations(self.i)
+
+    @property
+    def registered_actions(self):
+        return self.bundle.registered_actions(self.i)
+
+    @property
+    def faulty_actions_indices(self):
+        return self.bundle.faulty_actions_indices(self.i)
+
+    @property
+    def trajectory_execution(self):
+        return self.bundle.trajectory_execution(self.i)
+
+
+def query_bundles(paths, **conditions):
+    # the instances of the records of several bundles (for example the bundles of all the domains) that meet the
+    # conditions of Bundle.query
+    instances = []
+    for path in paths:
+        instances.extend(Bundle(path).query(**conditions))
+    return instances
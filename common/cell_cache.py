@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import pickle
+
+# ### the source files whose content determines the generated trajectories, relative to the repository root
+CODE_FILES = [
+    'common/atari.py',
+    'common/consts.py',
+    'common/domains.py',
+    'common/envs.py',
+    'common/executor.py',
+    'common/fault_mode_generators.py',
+    'common/inference_server.py',
+    'common/numpy_policies.py',
+    'common/rl_models.py',
+    'common/state_refiners.py',
+    'common/tabular.py',
+    'common/trajectory.py',
+    'common/wrappers.py',
+    'p02_traj_factory/p02_traj_factory.py',
+]
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def code_model_hash(domain_name, model_name):
+    digest = hashlib.sha256()
+    for code_file in CODE_FILES:
+        with open(os.path.join(REPOSITORY_ROOT, code_file), 'rb') as f:
+            digest.update(f.read())
+    with open(f"trained_models/{domain_name}__{model_name}.zip", 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+class CellCache:
+    # ### an on-disk cache of finished grid cells. a cell is stored under the hash of its domain, model, grid coordinates,
+    # ### the generation settings that shape its execution (fault_sampling, branching and batch_size) and the code / model
+    # ### hash, so a rerun or an extended grid finds every cell that is still valid, and a change to the code, to the model
+    # ### or to the settings makes all of them stale
+    def __init__(self, path, code_model_hash, fault_sampling, branching, batch_size):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.code_model_hash = code_model_hash
+        self.fault_sampling = fault_sampling
+        self.branching = branching
+        self.batch_size = batch_size
+
+    def key(self, domain_name, model_name, cell):
+        policy_type, seed, execution_fault_mode, fault_probability, instance = cell
+        # batch_size stays in the key although a cell draws the same random numbers in any batch: a batched forward pass
+        # of the policy may sum in another order than a single one and round differently, which can flip a close action
+        # and change the whole execution, so a cell is only reused under the batch size it was generated with
+        fields = [domain_name, model_name, policy_type, seed, execution_fault_mode, float(fault_probability), instance,
+                  self.fault_sampling, self.branching, self.batch_size, self.code_model_hash]
+        return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+    def _cell_path(self, domain_name, model_name, cell):
+        key = self.key(domain_name, model_name, cell)
+        return os.path.join(self.path, key[:2], f'{key}.pkl')
+
+    def contains(self, domain_name, model_name, cell):
+        return os.path.exists(self._cell_path(domain_name, model_name, cell))
+
+    def store(self, domain_name, model_name, cell, result):
+        # only the trajectory is stored. the file is written aside and renamed, so a cell is either fully cached or not
+        # at all
+        trajectory, num_wasted_rollouts = result
+        cell_path = self._cell_path(domain_name, model_name, cell)
+        os.makedirs(os.path.dirname(cell_path), exist_ok=True)
+        with open(f'{cell_path}.tmp', 'wb') as f:
+            pickle.dump(trajectory, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{cell_path}.tmp', cell_path)
+
+    def load(self, domain_name, model_name, cell):
+        with open(self._cell_path(domain_name, model_name, cell), 'rb') as f:
+            trajectory = pickle.load(f)
+        # a cached cell costs no rollouts in this run
+        return trajectory, 0
@@ -0,0 +1,36 @@
+import lzma
+
+import numpy as np
+
+# ### the flat binary column files of the bundles and the atari observation stores. a column is written either raw, so
+# ### that the reader can memory map it, or compressed as it is written (in the writing thread or process), so that no
+# ### separate archiving step is needed. a compressed column gets the suffix of its compression and is decompressed
+# ### into memory by the reader. its stream is only complete (readable) once its writer is closed
+
+COMPRESSION_SUFFIXES = {
+    None: '',
+    'lzma': '.xz',
+}
+
+
+def column_path(path, compression):
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f'Unknown column compression {compression}.')
+    return f'{path}{COMPRESSION_SUFFIXES[compression]}'
+
+
+def open_column(path, compression):
+    # a binary file object that the column bytes are written to
+    if compression == 'lzma':
+        return lzma.open(column_path(path, compression), 'wb', preset=6)
+    return open(column_path(path, compression), 'wb')
+
+
+def read_column(path, compression, dtype, shape):
+    # the column as an array of the given item dtype and shape: a memory map of a raw column, or the decompressed bytes
+    # of a compressed one
+    if compression is None:
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+    with lzma.open(column_path(path, compression), 'rb') as f:
+        data = f.read()
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
@@ -1,3 +1,4 @@
 DEBUG_PRINT = False             # False, True
 RENDER_MODE = "rgb_array"       # "human", "rgb_array"
 MAX_EXEC_LEN = 200              # maximum number of actions to be executed
+INFERENCE_BACKEND = "torch"     # "torch", "numpy" (numpy forward pass for the small MLP policies)
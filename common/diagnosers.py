@@ -0,0 +1,100 @@
+import copy
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from common.domains import domains
+
+# ### the interface of a fault diagnoser, as the diagnosis evaluation harness (p02_evaluate.py) runs it. a diagnoser is
+# ### prepared once per bundle with the constants of the bundle (domain_name, model_name, policy_types, seeds,
+# ### modelled_fault_modes, fault_probabilities, instances), and then diagnoses one trajectory at a time from its
+# ### observations and its registered (planned) actions. a diagnosis is a dict with any of the keys:
+# ###
+# ###       "fault_mode"                - the diagnosed fault mode, one of the modelled_fault_modes
+# ###       "faulty_actions_indices"    - the diagnosed ordinal numbers (starting at 1) of the actions that failed
+# ###
+# ### a key that the diagnoser leaves out is not scored. the harness creates the diagnoser in every worker process, so
+# ### a diagnoser may keep envs and models of its own
+
+
+class Diagnoser(ABC):
+    def prepare(self, constants):
+        pass
+
+    @abstractmethod
+    def diagnose(self, observations, registered_actions):
+        pass
+
+
+class NullDiagnoser(Diagnoser):
+    # ### the floor of the benchmark: no faulty action, and the first modelled fault mode
+    def prepare(self, constants):
+        self.fault_mode = constants['modelled_fault_modes'][0]
+
+    def diagnose(self, observations, registered_actions):
+        return {'fault_mode': self.fault_mode, 'faulty_actions_indices': []}
+
+
+class ReplayDiagnoser(Diagnoser):
+    # ### replays every transition from its stored state with each action of the domain (with the set_state wrappers of
+    # ### the classic domains, or the transition tables of the tabular ones) to find the actions that could have been
+    # ### executed. an action whose registered action could not have been executed failed, and the diagnosed fault mode
+    # ### is the modelled one that explains the most failed actions. the atari observations are frames, not env states,
+    # ### so it does not diagnose the atari domains
+    def __init__(self, atol=1e-7):
+        self.atol = atol
+
+    def prepare(self, constants):
+        from common import executor
+        from common.fault_mode_generators import FaultModeGeneratorDiscrete
+
+        domain_name = constants['domain_name']
+        self.kind = domains[domain_name].kind
+        if self.kind == 'atari':
+            raise ValueError(f'{domain_name} has no set_state wrapper to replay.')
+        self.env = executor.make_env(domain_name, 0)
+        self.num_actions = self.env.action_space.n
+        self.engine = None
+        if self.kind == 'tabular':
+            self.engine = executor.get_tabular_engine(domain_name, constants['model_name'], self.env)
+            with np.errstate(invalid='ignore'):
+                probabilities = np.diff(self.engine.cumulative_probabilities, axis=2, prepend=0.0)
+            self.possible = np.isfinite(self.engine.cumulative_probabilities) & (probabilities > 0)
+        self.fault_modes = constants['modelled_fault_modes']
+        self.fault_mode_generator = FaultModeGeneratorDiscrete()
+
+    def executable_actions(self, observations):
+        # a (num_steps, num_actions) mask of the actions that lead from each stored state to the next one
+        num_steps = len(observations) - 1
+        if self.kind == 'tabular':
+            states = np.asarray(observations, dtype=np.int64)
+            outcomes = self.engine.next_states[states[:-1]] == states[1:, None, None]
+            return np.any(outcomes & self.possible[states[:-1]], axis=2)
+        executable = np.zeros((num_steps, self.num_actions), dtype=bool)
+        self.env.reset()
+        for t in range(num_steps):
+            for action in range(self.num_actions):
+                self.env.set_state(copy.copy(observations[t]))
+                next_state, _, _, _, _ = self.env.step(action)
+                executable[t, action] = np.allclose(next_state, observations[t + 1], rtol=0.0, atol=self.atol)
+        return executable
+
+    def diagnose(self, observations, registered_actions):
+        registered_actions = np.asarray(registered_actions, dtype=np.int64)
+        executable = self.executable_actions(np.asarray(observations))
+        steps = np.arange(len(registered_actions))
+        failed = ~executable[steps, registered_actions]
+
+        # every modelled fault mode, applied to the failed actions, scores the failed actions whose faulty action could
+        # have been executed
+        fault_modes = self.fault_mode_generator.compile_fault_modes(self.fault_modes)
+        rows = np.arange(len(self.fault_modes))
+        scores = np.zeros(len(self.fault_modes), dtype=np.int64)
+        for t, action in enumerate(registered_actions.tolist()):
+            faulty_actions = fault_modes.apply(rows, np.full(len(rows), action), np.full(len(rows), failed[t]))
+            if failed[t]:
+                scores += executable[t, np.minimum(faulty_actions, self.num_actions - 1)] & (faulty_actions < self.num_actions)
+        return {
+            'fault_mode': self.fault_modes[int(np.argmax(scores))],
+            'faulty_actions_indices': (np.flatnonzero(failed) + 1).tolist(),
+        }
@@ -0,0 +1,64 @@
+import importlib
+
+# ### the domain registry. every domain declares its kind ("classic", "tabular" or "atari"), its gym id, the model of its
+# ### published inputs, and its env factory, env wrapper and state refiner. the factories, wrappers and refiners are
+# ### "module:attribute" paths that are imported the first time the domain uses them, so a run only loads the
+# ### dependencies of its own domain (ale_py and the stable baselines atari helpers for the atari domains)
+
+
+def load_attribute(path):
+    module_name, _, attribute_name = path.partition(':')
+    return getattr(importlib.import_module(module_name), attribute_name)
+
+
+class Domain:
+    def __init__(self, kind, env_id, model_name, env_factory, wrapper=None, refiner=None, env_reseeder=None, frame_stack=None):
+        self.kind = kind
+        self.env_id = env_id
+        self.model_name = model_name
+        self.env_factory = env_factory
+        self.wrapper = wrapper
+        self.refiner = refiner
+        self.env_reseeder = env_reseeder
+        self.frame_stack = frame_stack
+        self._loaded = {}
+
+    def load(self, field):
+        # the attribute that the path in field points at (None without a path), imported on first use
+        if field not in self._loaded:
+            path = getattr(self, field)
+            self._loaded[field] = None if path is None else load_attribute(path)
+        return self._loaded[field]
+
+    def make_env(self, seed=None):
+        return self.load('env_factory')(self, seed)
+
+    def reseed_env(self, env, seed):
+        # prepares a pooled env for its next execution, for the domains whose envs are seeded on creation
+        env_reseeder = self.load('env_reseeder')
+        if env_reseeder is not None:
+            env_reseeder(env, seed)
+
+
+domains = {
+    "Acrobot_v1": Domain('classic', 'Acrobot-v1', 'PPO', 'common.envs:make_gym_env',
+                         wrapper='common.wrappers:AcrobotSetStepWrapper', refiner='common.state_refiners:acrobot_refiner'),
+    "CartPole_v1": Domain('classic', 'CartPole-v1', 'PPO', 'common.envs:make_gym_env',
+                          wrapper='common.wrappers:CartPoleSetStepWrapper', refiner='common.state_refiners:cart_pole_refiner'),
+    "MountainCar_v0": Domain('classic', 'MountainCar-v0', 'DQN', 'common.envs:make_gym_env',
+                             wrapper='common.wrappers:MountainCarSetStepWrapper', refiner='common.state_refiners:mountain_car_refiner'),
+    "Taxi_v3": Domain('tabular', 'Taxi-v3', 'PPO', 'common.envs:make_gym_env',
+                      wrapper='common.wrappers:TaxiSetStepWrapper', refiner='common.state_refiners:taxi_refiner'),
+    "FrozenLake_v1": Domain('tabular', 'FrozenLake-v1', 'PPO', 'common.envs:make_gym_env',
+                            wrapper='common.wrappers:FrozenLakeSetStepWrapper', refiner='common.state_refiners:frozen_lake_refiner'),
+    "Breakout_v4": Domain('atari', 'Breakout-v4', 'A2C', 'common.atari:make_atari_domain_env',
+                          env_reseeder='common.atari:reseed_atari_env'),
+    "PongNoFrameskip_v0": Domain('atari', 'PongNoFrameskip-v0', 'A2C', 'common.atari:make_atari_domain_env',
+                                 env_reseeder='common.atari:reseed_atari_env', frame_stack=4),
+}
+
+# ### the small MLP policy domains over a flat float observation, the domains whose state is a single integer and whose
+# ### env exposes its full transition table P, and the domains of image observations
+CLASSIC_DOMAINS = [domain_name for domain_name, domain in domains.items() if domain.kind == 'classic']
+TABULAR_DOMAINS = [domain_name for domain_name, domain in domains.items() if domain.kind == 'tabular']
+ATARI_DOMAINS = [domain_name for domain_name, domain in domains.items() if domain.kind == 'atari']
@@ -0,0 +1,8 @@
+import gym
+
+from common.consts import RENDER_MODE
+
+
+def make_gym_env(domain, seed=None):
+    # the wrapped gym env of a classic or tabular domain. it is seeded by the reset of every execution
+    return domain.load('wrapper')(gym.make(domain.env_id, render_mode=RENDER_MODE))
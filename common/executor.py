@@ -1,15 +1,169 @@
+import copy
 import random
 
 import numpy as np
-import gym
-import ale_py
-from stable_baselines3.common.env_util import make_atari_env
-from stable_baselines3.common.vec_env import VecFrameStack
 
-from common.rl_models import models
-from common.state_refiners import refiners
-from common.wrappers import wrappers
-from common.consts import RENDER_MODE, MAX_EXEC_LEN, DEBUG_PRINT
+from common import profiling
+from common.domains import domains, ATARI_DOMAINS, TABULAR_DOMAINS
+from common.numpy_policies import MLP_DOMAINS, numpy_policy, check_numpy_policy, epsilon_greedy_probabilities
+from common.tabular import TabularEngine
+from common.consts import MAX_EXEC_LEN, DEBUG_PRINT, INFERENCE_BACKEND
+from common.trajectory import Trajectory
+
+
+def make_env(domain_name, seed=None):
+    return domains[domain_name].make_env(seed)
+
+
+def load_model(domain_name, model_name, env):
+    # stable baselines (and with it torch) is imported on the first model load, not with the executor
+    from common.rl_models import models
+    model_path = f"trained_models/{domain_name}__{model_name}.zip"
+    model = models[model_name].load(model_path, env=env)
+    return model
+
+
+def is_deterministic_policy(policy_type):
+    # only the "deterministic" policy type selects the greedy action, every other one ("stochastic") samples from the
+    # action distribution. together with the seeded env reset this makes a greedy fault free execution reproducible
+    return policy_type == 'deterministic'
+
+
+def is_invariant_execution(policy_type, fault_probability):
+    # a greedy policy whose every action fails draws no random number that changes the execution (the fault triggers
+    # all fire, and a conditional first fault is the first action that the fault mode changes), so all the instances of
+    # such a cell are the same execution of its seed
+    return is_deterministic_policy(policy_type) and float(fault_probability) >= 1.0
+
+
+def action_probabilities(model, observations):
+    # the action distribution of a policy for a batch of observations
+    if hasattr(model, 'action_probabilities'):
+        return model.action_probabilities(observations)
+    import torch
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(observations)
+        if hasattr(model, 'q_net'):
+            return epsilon_greedy_probabilities(model.q_net(obs_tensor).cpu().numpy(), model.exploration_rate)
+        return model.policy.get_distribution(obs_tensor).distribution.probs.cpu().numpy().astype(np.float64)
+
+
+def sample_actions(probabilities, rngs):
+    # one action per row of probabilities, drawn with the random generator of that row
+    u = np.array([rng.random() for rng in rngs])
+    return np.minimum(np.sum(np.cumsum(probabilities, axis=1) <= u[:, None], axis=1), probabilities.shape[1] - 1)
+
+
+def policy_actions(model, observations, policy_type, rngs):
+    # the actions of a batch of observations: the greedy ones, or ones drawn from the action distribution with the
+    # random generator of the execution of each observation, so that no execution depends on the others
+    with profiling.phase('predict', 'predicted_observations', len(observations)):
+        if is_deterministic_policy(policy_type):
+            actions, _ = model.predict(observations, deterministic=True)
+            return np.asarray(actions, dtype=np.int64)
+        return sample_actions(action_probabilities(model, observations), rngs)
+
+
+def bernoulli_fault_trigger(fault_probability, rng=random):
+    def fault_trigger(action_number):
+        return rng.random() < fault_probability
+
+    return fault_trigger
+
+
+def forced_fault_trigger(fault_probability, first_fault_number, rng=random):
+    # no fault before action number first_fault_number, a certain fault on it, and the usual bernoulli draws after it
+    def fault_trigger(action_number):
+        if action_number < first_fault_number:
+            return False
+        if action_number == first_fault_number:
+            return True
+        return rng.random() < fault_probability
+
+    return fault_trigger
+
+
+def checkpoint_env(env):
+    # the raw state of a set_state wrapper, along with the env random generator (FrozenLake draws its slippery moves
+    # from it), is everything that a step of the classic domains depends on
+    return copy.copy(env.get_state()), env.unwrapped.np_random.bit_generator.state
+
+
+def restore_env(env, checkpoint):
+    raw_state, np_random_state = checkpoint
+    env.set_state(copy.copy(raw_state))
+    env.unwrapped.np_random.bit_generator.state = np_random_state
+
+
+# ### per-process caches: trained models, the policies that the executors query and the lookup tables of the tabular
+# ### domains keyed by (domain_name, model_name), and a pool of idle environments keyed by domain_name. torch and ALE
+# ### are set up once per process and every rollout reuses them
+_model_cache = {}
+_policy_cache = {}
+_tabular_engine_cache = {}
+_env_pool = {}
+
+
+def get_model(domain_name, model_name, env):
+    key = (domain_name, model_name)
+    if key not in _model_cache:
+        with profiling.phase('load_model'):
+            _model_cache[key] = load_model(domain_name, model_name, env)
+    return _model_cache[key]
+
+
+def get_policy(domain_name, model_name, env):
+    # the trained model, or its numpy forward pass when INFERENCE_BACKEND is "numpy" and the policy is a small MLP. the
+    # numpy policy is checked against the model before it is used
+    key = (domain_name, model_name)
+    if key not in _policy_cache:
+        model = get_model(domain_name, model_name, env)
+        if INFERENCE_BACKEND == 'numpy' and domain_name in MLP_DOMAINS:
+            with profiling.phase('numpy_policy'):
+                policy = numpy_policy(model)
+                check_numpy_policy(model, policy)
+        else:
+            policy = model
+        _policy_cache[key] = policy
+    return _policy_cache[key]
+
+
+def set_policy(domain_name, model_name, policy):
+    # makes get_policy return policy (e.g. the client of an inference server) instead of the trained model
+    _policy_cache[(domain_name, model_name)] = policy
+
+
+def get_tabular_engine(domain_name, model_name, env):
+    key = (domain_name, model_name)
+    if key not in _tabular_engine_cache:
+        model = get_model(domain_name, model_name, env)
+        with profiling.phase('tabular_tables'):
+            _tabular_engine_cache[key] = TabularEngine(model, env)
+    return _tabular_engine_cache[key]
+
+
+def acquire_env(domain_name, seed=None):
+    idle_envs = _env_pool.setdefault(domain_name, [])
+    if not idle_envs:
+        with profiling.phase('make_env'):
+            return make_env(domain_name, seed)
+    env = idle_envs.pop()
+    domains[domain_name].reseed_env(env, seed)
+    return env
+
+
+def release_env(domain_name, env):
+    _env_pool.setdefault(domain_name, []).append(env)
+
+
+def clear_caches():
+    for idle_envs in _env_pool.values():
+        for env in idle_envs:
+            env.close()
+    _env_pool.clear()
+    _model_cache.clear()
+    _policy_cache.clear()
+    _tabular_engine_cache.clear()
 
 
 def execute(domain_name,
@@ -18,15 +172,13 @@ def execute(domain_name,
             seed,
             execution_fault_mode,
             fault_probability,
-            fault_mode_generator):
-    if domain_name == 'Breakout_v4':
-        trajectory, faulty_actions_indices = execute_breakout_v4(domain_name, model_name, policy_type, seed, execution_fault_mode, fault_probability, fault_mode_generator)
-    elif domain_name == 'PongNoFrameskip_v0':
-        trajectory, faulty_actions_indices = execute_pongnoframeskip_v0(domain_name, model_name, policy_type, seed, execution_fault_mode, fault_probability, fault_mode_generator)
-    else:
-        trajectory, faulty_actions_indices = execute_gym(domain_name, model_name, policy_type, seed, execution_fault_mode, fault_probability, fault_mode_generator)
-
-    return trajectory, faulty_actions_indices
+            fault_mode_generator,
+            fault_trigger=None,
+            rng=random):
+    # rng is the random generator of the execution: its fault draws and the actions of a stochastic policy
+    single_executor = executors[domains[domain_name].kind]
+    return single_executor(domain_name, model_name, policy_type, seed, execution_fault_mode, fault_probability, fault_mode_generator,
+                           fault_trigger=fault_trigger, rng=rng)
 
 
 def execute_gym(domain_name,
@@ -35,169 +187,336 @@ def execute_gym(domain_name,
                 seed,
                 execution_fault_mode,
                 fault_probability,
-                fault_mode_generator):
-    # initialize environment
-    env = wrappers[domain_name](gym.make(domain_name.replace('_', '-'), render_mode=RENDER_MODE))
+                fault_mode_generator,
+                fault_trigger=None,
+                checkpoints=None,
+                branch=None,
+                rng=random):
+    # checkpoints optionally collects the env checkpoint before every action. branch optionally resumes a checkpointed
+    # (trajectory, checkpoints, action_number) execution right before its action number action_number
+    # initialize environment (a pooled env is reseeded by this reset)
+    env = acquire_env(domain_name)
     initial_obs, _ = env.reset(seed=seed)
     # print(f'initial observation: {initial_obs.tolist()}')
 
     # load trained model
-    model_path = f"trained_models/{domain_name}__{model_name}.zip"
-    model = models[model_name].load(model_path, env=env)
+    model = get_policy(domain_name, model_name, env)
+    refiner = domains[domain_name].load('refiner')
 
     # initialize execution fault mode
     execution_fault_mode_function = fault_mode_generator.generate_fault_mode_function(execution_fault_mode)
+    if fault_trigger is None:
+        fault_trigger = bernoulli_fault_trigger(fault_probability, rng)
 
-    # initializing empty trajectory
-    trajectory = []
-
-    faulty_actions_indices = []
     action_number = 1
     done = False
     exec_len = 1
     obs, _ = env.reset()
+
+    # initializing empty trajectory
+    trajectory = Trajectory.for_observation(obs)
+    if branch is not None:
+        branch_trajectory, branch_checkpoints, action_number = branch
+        with profiling.phase('restore_checkpoint'):
+            restore_env(env, branch_checkpoints[action_number - 1])
+        trajectory = branch_trajectory.copy_prefix(action_number - 1)
+        # a copy, as the steps below write their raw states into obs
+        obs = np.array(branch_trajectory.observations[action_number - 1])
+        exec_len = action_number
+        # the fault mode sees the fault free prefix, as the stutter and delay families depend on the earlier actions
+        for prefix_action in trajectory.actions.tolist():
+            execution_fault_mode_function(prefix_action, False)
+    # every step writes its raw state into the buffer of obs, which the trajectory copies, and the policy observation
+    # into the buffer of refined
+    state_buffer = obs if isinstance(obs, np.ndarray) else None
+    refined = np.asarray(refiner(np.asarray(obs)[None]))
     while not done and exec_len < MAX_EXEC_LEN:
-        trajectory.append(obs)
+        if checkpoints is not None:
+            with profiling.phase('checkpoint'):
+                checkpoints.append(checkpoint_env(env))
+        trajectory.append_observation(obs)
         if DEBUG_PRINT:
             print(f'a#:{action_number} [PREVOBS]: {obs.tolist() if not isinstance(obs, int) else obs}')
-        action, _ = model.predict(refiners[domain_name](obs), deterministic=policy_type)
-        action = int(action)
-        trajectory.append(action)
-        if random.random() < fault_probability:
-            faulty_action = execution_fault_mode_function(action)
-        else:
-            faulty_action = action
-        if faulty_action != action:
-            faulty_actions_indices.append(action_number)
+        refiner(np.asarray(obs)[None], out=refined)
+        action = int(policy_actions(model, refined, policy_type, [rng])[0])
+        faulty_action = execution_fault_mode_function(action, fault_trigger(action_number))
+        trajectory.append_action(action, faulty_action != action)
         if DEBUG_PRINT:
             if action != faulty_action:
                 print(f'a#:{action_number} [FAILURE] - planned: {action}, actual: {faulty_action}')
             else:
                 print(f'a#:{action_number} [SUCCESS] - planned: {action}, actual: {faulty_action}')
-        obs, reward, done, trunc, info = env.step(faulty_action)
+        with profiling.phase('env_step', 'env_steps'):
+            obs, reward, done, trunc, info = env.step(faulty_action, out=state_buffer)
         if DEBUG_PRINT:
             print(f'a#:{action_number} [NEXTOBS]: {obs.tolist() if not isinstance(obs, int) else obs}\n')
         action_number += 1
         exec_len += 1
 
-    trajectory.append(obs)
-    env.close()
+    trajectory.append_observation(obs)
+    release_env(domain_name, env)
+
+    return trajectory, trajectory.faulty_actions_indices
+
+
+def execute_nominal(domain_name,
+                    model_name,
+                    policy_type,
+                    seed,
+                    execution_fault_mode,
+                    fault_mode_generator):
+    # the fault free execution of a seed, together with the env checkpoint before each of its actions
+    if domain_name in ATARI_DOMAINS:
+        raise ValueError(f'{domain_name} has no set_state wrapper to checkpoint.')
+    checkpoints = []
+    trajectory, _ = execute_gym(domain_name, model_name, policy_type, seed, execution_fault_mode, 0.0, fault_mode_generator,
+                                checkpoints=checkpoints)
+    return trajectory, checkpoints
 
-    return trajectory, faulty_actions_indices
 
+def execute_branch(domain_name,
+                   model_name,
+                   policy_type,
+                   seed,
+                   execution_fault_mode,
+                   fault_probability,
+                   fault_mode_generator,
+                   nominal_trajectory,
+                   nominal_checkpoints,
+                   first_fault_number,
+                   rng=random):
+    # the execution that follows the nominal one up to its first faulty action first_fault_number. it resumes from the
+    # checkpoint before that action instead of simulating the shared fault free prefix again
+    fault_trigger = forced_fault_trigger(fault_probability, first_fault_number, rng)
+    return execute_gym(domain_name, model_name, policy_type, seed, execution_fault_mode, fault_probability, fault_mode_generator, fault_trigger,
+                       branch=(nominal_trajectory, nominal_checkpoints, first_fault_number), rng=rng)
 
-def execute_breakout_v4(domain_name,
-                        model_name,
-                        policy_type,
-                        seed,
-                        execution_fault_mode,
-                        fault_probability,
-                        fault_mode_generator):
+
+def execute_atari(domain_name,
+                  model_name,
+                  policy_type,
+                  seed,
+                  execution_fault_mode,
+                  fault_probability,
+                  fault_mode_generator,
+                  fault_trigger=None,
+                  rng=random):
     # initialize environment
-    env = make_atari_env(domain_name.replace('_', '-'), n_envs=1, seed=seed)
+    env = acquire_env(domain_name, seed)
     initial_obs = env.reset()
     # print(f'initial observation: {initial_obs.tolist()}')
 
     # load trained model
-    model_path = f"trained_models/{domain_name}__{model_name}.zip"
-    model = models[model_name].load(model_path, env=env)
+    model = get_policy(domain_name, model_name, env)
 
     # initialize execution fault mode
     execution_fault_mode_function = fault_mode_generator.generate_fault_mode_function(execution_fault_mode)
+    if fault_trigger is None:
+        fault_trigger = bernoulli_fault_trigger(fault_probability, rng)
 
-    # initializing empty trajectory
-    trajectory = []
-
-    faulty_actions_indices = []
     action_number = 1
     done = False
     exec_len = 1
     obs = env.reset()
+
+    # initializing empty trajectory
+    trajectory = Trajectory.for_observation(obs)
     while not done and exec_len < MAX_EXEC_LEN:
-        trajectory.append(obs)
+        trajectory.append_observation(obs)
         if DEBUG_PRINT:
             print(f'a#:{action_number} [PREVOBS]: {obs.tolist() if not isinstance(obs, int) else obs}')
-        action, _ = model.predict(obs, deterministic=policy_type)
-        action = int(action[0])
-        trajectory.append(action)
-        if random.random() < fault_probability:
-            faulty_action = execution_fault_mode_function(action)
-        else:
-            faulty_action = action
-        if faulty_action != action:
-            faulty_actions_indices.append(action_number)
+        action = int(policy_actions(model, obs, policy_type, [rng])[0])
+        faulty_action = execution_fault_mode_function(action, fault_trigger(action_number))
+        trajectory.append_action(action, faulty_action != action)
         if DEBUG_PRINT:
             if action != faulty_action:
                 print(f'a#:{action_number} [FAILURE] - planned: {action}, actual: {faulty_action}')
             else:
                 print(f'a#:{action_number} [SUCCESS] - planned: {action}, actual: {faulty_action}')
         faulty_action = np.array([faulty_action])
-        obs, reward, done, info = env.step(faulty_action)
+        with profiling.phase('env_step', 'env_steps'):
+            obs, reward, done, info = env.step(faulty_action)
         if DEBUG_PRINT:
             print(f'a#:{action_number} [NEXTOBS]: {obs.tolist() if not isinstance(obs, int) else obs}\n')
         action_number += 1
         exec_len += 1
 
-    trajectory.append(obs)
-    env.close()
+    trajectory.append_observation(obs)
+    release_env(domain_name, env)
 
-    return trajectory, faulty_actions_indices
+    return trajectory, trajectory.faulty_actions_indices
 
 
-def execute_pongnoframeskip_v0(domain_name,
-                               model_name,
-                               policy_type,
-                               seed,
-                               execution_fault_mode,
-                               fault_probability,
-                               fault_mode_generator):
-    # initialize environment
-    env = make_atari_env(domain_name.replace('_', '-'), n_envs=1, seed=seed)
-    env = VecFrameStack(env, n_stack=4)
-    initial_obs = env.reset()
-    # print(f'initial observation: {initial_obs.tolist()}')
+def execute_batch(domain_name,
+                  model_name,
+                  policy_type,
+                  cells,
+                  fault_mode_generator,
+                  fault_triggers=None,
+                  rngs=None):
+    # lockstep counterpart of execute. every cell is a (seed, execution_fault_mode, fault_probability) triple that
+    # gets its own pooled env. all the live cells are stepped together, with a single batched model.predict per step,
+    # and a cell retires when its env is done or when MAX_EXEC_LEN is reached. fault_triggers optionally replaces the
+    # bernoulli fault draws of each cell (None keeps them), and rngs holds the random generator of each cell
+    if domain_name in TABULAR_DOMAINS:
+        return execute_tabular(domain_name, model_name, policy_type, cells, fault_mode_generator, fault_triggers, rngs)
+    atari = domain_name in ATARI_DOMAINS
+
+    # initialize environments
+    envs = []
+    observations = []
+    for seed, execution_fault_mode, fault_probability in cells:
+        if atari:
+            env = acquire_env(domain_name, seed)
+            env.reset()
+            obs = env.reset()
+        else:
+            env = acquire_env(domain_name)
+            env.reset(seed=seed)
+            obs, _ = env.reset()
+        envs.append(env)
+        observations.append(obs)
 
     # load trained model
-    model_path = f"trained_models/{domain_name}__{model_name}.zip"
-    model = models[model_name].load(model_path, env=env)
+    model = get_policy(domain_name, model_name, envs[0])
+    refiner = domains[domain_name].load('refiner')
 
-    # initialize execution fault mode
-    execution_fault_mode_function = fault_mode_generator.generate_fault_mode_function(execution_fault_mode)
+    # initialize execution fault modes
+    execution_fault_modes = fault_mode_generator.compile_fault_modes([execution_fault_mode for _, execution_fault_mode, _ in cells])
+    if rngs is None:
+        rngs = [random] * len(cells)
+    if fault_triggers is None:
+        fault_triggers = [None] * len(cells)
+    fault_triggers = [bernoulli_fault_trigger(fault_probability, rng) if fault_trigger is None else fault_trigger
+                      for fault_trigger, rng, (_, _, fault_probability) in zip(fault_triggers, rngs, cells)]
 
-    # initializing empty trajectory
-    trajectory = []
+    # initializing empty trajectories
+    trajectories = [Trajectory.for_observation(obs) for obs in observations]
+
+    # the raw states of the classic domains are rows of one buffer, which every step writes into and which is refined
+    # into the policy observations of all the live cells at once
+    if not atari:
+        observations = np.array(observations, dtype=np.float64)
+        refined = np.asarray(refiner(observations))
 
-    faulty_actions_indices = []
+    active = list(range(len(cells)))
     action_number = 1
-    done = False
     exec_len = 1
-    obs = env.reset()
-    while not done and exec_len < MAX_EXEC_LEN:
-        trajectory.append(obs)
-        if DEBUG_PRINT:
-            print(f'a#:{action_number} [PREVOBS]: {obs.tolist() if not isinstance(obs, int) else obs}')
-        action, _ = model.predict(obs, deterministic=policy_type)
-        action = int(action[0])
-        trajectory.append(action)
-        if random.random() < fault_probability:
-            faulty_action = execution_fault_mode_function(action)
+    while active and exec_len < MAX_EXEC_LEN:
+        if atari:
+            batch = np.concatenate([observations[i] for i in active])
         else:
-            faulty_action = action
-        if faulty_action != action:
-            faulty_actions_indices.append(action_number)
-        if DEBUG_PRINT:
-            if action != faulty_action:
-                print(f'a#:{action_number} [FAILURE] - planned: {action}, actual: {faulty_action}')
+            batch = refiner(observations[active], out=refined[:len(active)])
+        actions = policy_actions(model, batch, policy_type, [rngs[i] for i in active])
+        fault_mask = [fault_triggers[i](action_number) for i in active]
+        faulty_actions = execution_fault_modes.apply(active, actions, fault_mask)
+        still_active = []
+        for i, action, faulty_action in zip(active, actions.tolist(), faulty_actions.tolist()):
+            trajectories[i].append_observation(observations[i])
+            trajectories[i].append_action(action, faulty_action != action)
+            with profiling.phase('env_step', 'env_steps'):
+                if atari:
+                    obs, reward, done, info = envs[i].step(np.array([faulty_action]))
+                    done = done[0]
+                else:
+                    obs, reward, done, trunc, info = envs[i].step(faulty_action, out=observations[i])
+            observations[i] = obs
+            if done:
+                trajectories[i].append_observation(obs)
             else:
-                print(f'a#:{action_number} [SUCCESS] - planned: {action}, actual: {faulty_action}')
-        faulty_action = np.array([faulty_action])
-        obs, reward, done, info = env.step(faulty_action)
-        if DEBUG_PRINT:
-            print(f'a#:{action_number} [NEXTOBS]: {obs.tolist() if not isinstance(obs, int) else obs}\n')
+                still_active.append(i)
+        active = still_active
         action_number += 1
         exec_len += 1
 
-    trajectory.append(obs)
-    env.close()
+    for i in active:
+        trajectories[i].append_observation(observations[i])
+    for env in envs:
+        release_env(domain_name, env)
+
+    return [(trajectory, trajectory.faulty_actions_indices) for trajectory in trajectories]
+
+
+def execute_tabular_cell(domain_name,
+                         model_name,
+                         policy_type,
+                         seed,
+                         execution_fault_mode,
+                         fault_probability,
+                         fault_mode_generator,
+                         fault_trigger=None,
+                         rng=random):
+    return execute_tabular(domain_name, model_name, policy_type, [(seed, execution_fault_mode, fault_probability)], fault_mode_generator, [fault_trigger], [rng])[0]
+
+
+def execute_tabular(domain_name,
+                    model_name,
+                    policy_type,
+                    cells,
+                    fault_mode_generator,
+                    fault_triggers=None,
+                    rngs=None):
+    # execute_batch for the tabular domains without gym steps or model.predict calls: the actions come from the policy
+    # table and the steps from the transition tables. each env is only reset, and its np_random supplies the uniform of
+    # each step, exactly as in env.step, so the executions are those of execute_gym
+    envs = []
+    states = []
+    for seed, execution_fault_mode, fault_probability in cells:
+        env = acquire_env(domain_name)
+        env.reset(seed=seed)
+        obs, _ = env.reset()
+        envs.append(env)
+        states.append(obs)
+    states = np.array(states, dtype=np.int64)
+
+    engine = get_tabular_engine(domain_name, model_name, envs[0])
+    deterministic = is_deterministic_policy(policy_type)
+
+    # initialize execution fault modes
+    execution_fault_modes = fault_mode_generator.compile_fault_modes([execution_fault_mode for _, execution_fault_mode, _ in cells])
+    if rngs is None:
+        rngs = [random] * len(cells)
+    if fault_triggers is None:
+        fault_triggers = [None] * len(cells)
+    fault_triggers = [bernoulli_fault_trigger(fault_probability, rng) if fault_trigger is None else fault_trigger
+                      for fault_trigger, rng, (_, _, fault_probability) in zip(fault_triggers, rngs, cells)]
+
+    # initializing empty trajectories
+    trajectories = [Trajectory.for_observation(state) for state in states]
+
+    active = np.arange(len(cells))
+    action_number = 1
+    exec_len = 1
+    while len(active) > 0 and exec_len < MAX_EXEC_LEN:
+        with profiling.phase('predict', 'predicted_observations', len(active)):
+            actions = engine.policy_actions(states[active], deterministic, [rngs[i] for i in active])
+        fault_mask = [fault_triggers[i](action_number) for i in active]
+        faulty_actions = execution_fault_modes.apply(active, actions, fault_mask)
+        u = np.empty(len(active))
+        for j, (i, action, faulty_action) in enumerate(zip(active, actions.tolist(), faulty_actions.tolist())):
+            trajectories[i].append_observation(states[i])
+            trajectories[i].append_action(action, faulty_action != action)
+            u[j] = envs[i].unwrapped.np_random.random()
+        with profiling.phase('env_step', 'env_steps', len(active)):
+            states[active], done = engine.step(states[active], faulty_actions, u)
+        for i in active[done]:
+            trajectories[i].append_observation(states[i])
+        active = active[~done]
+        action_number += 1
+        exec_len += 1
+
+    for i in active:
+        trajectories[i].append_observation(states[i])
+    for env, state in zip(envs, states.tolist()):
+        env.unwrapped.s = state
+        release_env(domain_name, env)
+
+    return [(trajectory, trajectory.faulty_actions_indices) for trajectory in trajectories]
+
 
-    return trajectory, faulty_actions_indices
+# ### the executor of a single execution of every kind of domain
+executors = {
+    'classic': execute_gym,
+    'tabular': execute_tabular_cell,
+    'atari': execute_atari,
+}
@@ -1,6 +1,118 @@
 import copy
+import json
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+# ### the discrete fault mode families and their string forms (as they appear in modelled_fault_modes):
+# ###
+# ###       "[0,0,2,3]"     - mapping:  a faulty action a is replaced by mapping[a]
+# ###       "stuck_at:2"    - stuck at: a faulty action is replaced by the action 2
+# ###       "stutter"       - a faulty action repeats the previously executed action
+# ###       "delay:3"       - a faulty action is replaced by the action that was planned 3 steps earlier
+# ###
+# ### stutter and delay do nothing on the first action(s), where there is no earlier action to repeat
+MAPPING = 0
+STUCK_AT = 1
+STUTTER = 2
+DELAY = 3
+
+
+def parse_fault_mode(args):
+    # (family, parameter) of a fault mode string, where the parameter is the mapping array, the stuck at action or the
+    # delay (None for stutter)
+    args = args.strip()
+    if args.startswith('['):
+        mapping = json.loads(args)
+        if not isinstance(mapping, list) or not all(isinstance(a, int) for a in mapping):
+            raise ValueError(f'Invalid fault mode mapping {args}.')
+        return MAPPING, np.array(mapping, dtype=np.int64)
+    family, _, parameter = args.partition(':')
+    if family == 'stutter' and parameter == '':
+        return STUTTER, None
+    if family in ['stuck_at', 'delay'] and parameter.strip().isdigit():
+        if family == 'delay' and int(parameter) == 0:
+            raise ValueError(f'Invalid fault mode {args}: the delay must be positive.')
+        return (STUCK_AT if family == 'stuck_at' else DELAY), int(parameter)
+    raise ValueError(f'Unknown fault mode {args}.')
+
+
+def check_mapped_actions(args, actions, mapping_length):
+    # a mapping fault mode only maps the actions that it has an entry for
+    out_of_range = (actions < 0) | (actions >= mapping_length)
+    if np.any(out_of_range):
+        raise ValueError(f'Action {actions[out_of_range][0]} is out of the range of the fault mode {args}.')
+
+
+def changed_actions(args, registered_actions):
+    # a mask of the actions of a fault free execution that the fault mode would change, were the fault to happen there
+    # first. this is the set of actions that can be the first faulty action of an execution that follows it
+    family, parameter = parse_fault_mode(args)
+    actions = np.asarray(registered_actions, dtype=np.int64)
+    if family == MAPPING:
+        check_mapped_actions(args, actions, len(parameter))
+        return parameter[actions] != actions
+    if family == STUCK_AT:
+        return actions != parameter
+    delay = 1 if family == STUTTER else parameter
+    changed = np.zeros(len(actions), dtype=bool)
+    changed[delay:] = actions[:-delay] != actions[delay:] if delay < len(actions) else False
+    return changed
+
+
+class FaultModes:
+    # ### a batch of fault modes compiled into numpy arrays, applied to one step of as many executions at a time. the
+    # ### mappings are rows of a lookup table, and every execution keeps the history of its planned actions and its
+    # ### last executed action for the stutter and delay families. the executions of a batch advance in lockstep
+    def __init__(self, fault_modes):
+        self.fault_modes = list(fault_modes)
+        parsed = [parse_fault_mode(args) for args in self.fault_modes]
+        width = max([len(parameter) for family, parameter in parsed if family == MAPPING], default=1)
+        self.families = np.array([family for family, _ in parsed], dtype=np.int64)
+        self.tables = np.zeros((len(parsed), width), dtype=np.int64)
+        self.parameters = np.zeros(len(parsed), dtype=np.int64)
+        self.mapping_lengths = np.zeros(len(parsed), dtype=np.int64)
+        for i, (family, parameter) in enumerate(parsed):
+            if family == MAPPING:
+                self.tables[i, :len(parameter)] = parameter
+                self.mapping_lengths[i] = len(parameter)
+            elif parameter is not None:
+                self.parameters[i] = parameter
+        self.max_delay = max([parameter for family, parameter in parsed if family == DELAY], default=0)
+        self.history = np.zeros((len(parsed), max(self.max_delay, 1)), dtype=np.int64)
+        self.previous = np.zeros(len(parsed), dtype=np.int64)
+        self.num_steps = 0
+
+    def apply(self, rows, actions, fault_mask):
+        # the executed actions of the executions rows, whose planned actions are actions and whose faulty ones are
+        # fault_mask. every call is one step of all of them
+        rows = np.asarray(rows, dtype=np.int64)
+        actions = np.asarray(actions, dtype=np.int64)
+        fault_mask = np.asarray(fault_mask, dtype=bool)
+        families = self.families[rows]
+        # a faulty action of a mapping fault mode must have an entry in its mapping. an action without one reads entry 0
+        # of its row instead, which the selection of the executed actions discards
+        mapping_lengths = self.mapping_lengths[rows]
+        in_range = (actions >= 0) & (actions < mapping_lengths)
+        out_of_range = (families == MAPPING) & fault_mask & ~in_range
+        if np.any(out_of_range):
+            i = np.flatnonzero(out_of_range)[0]
+            raise ValueError(f'Action {actions[i]} is out of the range of the fault mode {self.fault_modes[rows[i]]}.')
+        faulty = np.where(families == MAPPING, self.tables[rows, np.where(in_range, actions, 0)], actions)
+        faulty = np.where(families == STUCK_AT, self.parameters[rows], faulty)
+        if self.num_steps > 0:
+            faulty = np.where(families == STUTTER, self.previous[rows], faulty)
+        if self.max_delay > 0:
+            delays = self.parameters[rows]
+            delayed = (families == DELAY) & (delays <= self.num_steps)
+            faulty[delayed] = self.history[rows[delayed], -delays[delayed]]
+            self.history[rows, :-1] = self.history[rows, 1:]
+            self.history[rows, -1] = actions
+        executed = np.where(fault_mask, faulty, actions)
+        self.previous[rows] = executed
+        self.num_steps += 1
+        return executed
+
 
 class FaultModeGenerator(ABC):
     @abstractmethod
@@ -10,9 +122,17 @@ class FaultModeGenerator(ABC):
 
 class FaultModeGeneratorDiscrete(FaultModeGenerator):
     def generate_fault_mode_function(self, args):
-        mapping = eval(args)
+        # the fault mode of a single execution, called on every action with whether that action is faulty
+        fault_modes = FaultModes([args])
+        rows = np.zeros(1, dtype=np.int64)
 
-        def fault_mode(a):
-            return mapping[a]
+        def fault_mode(a, faulty=True):
+            return int(fault_modes.apply(rows, [a], [faulty])[0])
 
         return fault_mode
+
+    def compile_fault_modes(self, fault_modes):
+        return FaultModes(fault_modes)
+
+    def changed_actions(self, args, registered_actions):
+        return changed_actions(args, registered_actions)
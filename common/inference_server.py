@@ -0,0 +1,141 @@
+import multiprocessing
+import queue
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from common.executor import make_env, load_model, action_probabilities, sample_actions
+
+# ### a local inference server for the atari policies. a single server process holds the model, and every generation
+# ### worker is a client with its own slot in a shared memory block: an action row, an action probabilities row and an
+# ### observation row of slot_size entries each. a client writes its observations into its slot and posts a (client_id,
+# ### num_observations, deterministic) request. the server takes every request that is pending, runs one batched greedy
+# ### predict and one batched action distribution for them, writes the greedy actions or the action probabilities back
+# ### into the slots and wakes the clients up. the stochastic actions are sampled by the clients, with their own random
+# ### generators
+
+
+def slot_arrays(buffer, num_clients, slot_size, num_actions, observation_shape):
+    actions = np.ndarray((num_clients, slot_size), dtype=np.int64, buffer=buffer)
+    probabilities = np.ndarray((num_clients, slot_size, num_actions), dtype=np.float64, buffer=buffer,
+                               offset=actions.nbytes)
+    observations = np.ndarray((num_clients, slot_size) + tuple(observation_shape), dtype=np.uint8, buffer=buffer,
+                              offset=actions.nbytes + probabilities.nbytes)
+    return actions, probabilities, observations
+
+
+def serve(domain_name, model_name, shared_memory_name, num_clients, slot_size, num_actions, observation_shape, requests, responses):
+    env = make_env(domain_name)
+    model = load_model(domain_name, model_name, env)
+    block = shared_memory.SharedMemory(name=shared_memory_name)
+    actions, probabilities, observations = slot_arrays(block.buf, num_clients, slot_size, num_actions, observation_shape)
+    try:
+        stopped = False
+        while not stopped:
+            pending = [requests.get()]
+            while len(pending) < num_clients:
+                try:
+                    pending.append(requests.get_nowait())
+                except queue.Empty:
+                    break
+            if None in pending:
+                stopped = True
+                pending = [request for request in pending if request is not None]
+            # the greedy actions and the action probabilities are predicted separately
+            for deterministic in [True, False]:
+                group = [(client_id, n) for client_id, n, d in pending if d == deterministic]
+                if len(group) == 0:
+                    continue
+                batch = np.concatenate([observations[client_id, :n] for client_id, n in group])
+                if deterministic:
+                    predicted, _ = model.predict(batch, deterministic=True)
+                else:
+                    predicted = action_probabilities(model, batch)
+                start = 0
+                for client_id, n in group:
+                    (actions if deterministic else probabilities)[client_id, :n] = predicted[start:start + n]
+                    start += n
+                    responses[client_id].release()
+    finally:
+        del actions, probabilities, observations
+        block.close()
+        env.close()
+
+
+class RemotePolicy:
+    # ### the client side of the server, with the predict and action_probabilities interface of the executors
+    def __init__(self, client_id, block, num_clients, slot_size, num_actions, observation_shape, requests, response):
+        self.client_id = client_id
+        self.block = block
+        self.slot_size = slot_size
+        actions, probabilities, observations = slot_arrays(block.buf, num_clients, slot_size, num_actions, observation_shape)
+        self.actions = actions[client_id]
+        self.probabilities = probabilities[client_id]
+        self.observations = observations[client_id]
+        self.requests = requests
+        self.response = response
+
+    def request(self, observation, deterministic):
+        # observation is a vec env batch of shape (n, 84, 84, n_stack)
+        n = len(observation)
+        if n > self.slot_size:
+            raise ValueError(f'{n} observations do not fit an inference slot of {self.slot_size}.')
+        self.observations[:n] = observation
+        self.requests.put((self.client_id, n, deterministic))
+        self.response.acquire()
+        return n
+
+    def action_probabilities(self, observation):
+        n = self.request(observation, False)
+        return self.probabilities[:n].copy()
+
+    def predict(self, observation, deterministic=False, rngs=None):
+        # the stochastic actions are drawn with rngs, the random generator of every observation (the random module when
+        # there are none), as in sample_actions
+        if not deterministic:
+            if rngs is None:
+                rngs = [random] * len(observation)
+            return sample_actions(self.action_probabilities(observation), rngs), None
+        n = self.request(observation, True)
+        return self.actions[:n].copy(), None
+
+
+class InferenceServer:
+    # ### the handle of the generation process, which starts the server and hands out the client connections
+    def __init__(self, domain_name, model_name, num_clients, slot_size):
+        env = make_env(domain_name)
+        observation_shape = env.observation_space.shape
+        num_actions = env.action_space.n
+        env.close()
+        actions_size = num_clients * slot_size * np.dtype(np.int64).itemsize
+        probabilities_size = num_clients * slot_size * num_actions * np.dtype(np.float64).itemsize
+        observations_size = num_clients * slot_size * int(np.prod(observation_shape))
+        self.block = shared_memory.SharedMemory(create=True, size=actions_size + probabilities_size + observations_size)
+        self.requests = multiprocessing.Queue()
+        self.responses = [multiprocessing.Semaphore(0) for _ in range(num_clients)]
+        self.client_ids = multiprocessing.Queue()
+        for client_id in range(num_clients):
+            self.client_ids.put(client_id)
+        self.client_args = (self.block.name, num_clients, slot_size, num_actions, observation_shape, self.requests, self.responses, self.client_ids)
+        self.process = multiprocessing.Process(target=serve, daemon=True,
+                                               args=(domain_name, model_name, self.block.name, num_clients, slot_size,
+                                                     num_actions, observation_shape, self.requests, self.responses))
+        self.process.start()
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.block.close()
+        self.block.unlink()
+
+
+def connect(client_args):
+    # a RemotePolicy on the next free slot of the server that client_args (InferenceServer.client_args) describes
+    shared_memory_name, num_clients, slot_size, num_actions, observation_shape, requests, responses, client_ids = client_args
+    client_id = client_ids.get()
+    block = shared_memory.SharedMemory(name=shared_memory_name)
+    return RemotePolicy(client_id, block, num_clients, slot_size, num_actions, observation_shape, requests, responses[client_id])
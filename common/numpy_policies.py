@@ -0,0 +1,127 @@
+import random
+
+import numpy as np
+
+from common.domains import CLASSIC_DOMAINS
+
+# ### the domains whose policies are small MLPs over a flat float observation
+MLP_DOMAINS = CLASSIC_DOMAINS
+
+
+def extract_layers(modules):
+    # (weight, bias, activation) for every linear layer of a sequence of torch modules, where the activation is the one
+    # that follows the layer (None for the last one). torch is imported here and not with the module, so that importing
+    # the executor does not load it
+    from torch import nn
+    activations = {
+        nn.Tanh: np.tanh,
+        nn.ReLU: lambda x: np.maximum(x, 0),
+    }
+    layers = []
+    for module in modules:
+        if isinstance(module, nn.Linear):
+            weight = module.weight.detach().cpu().numpy().T.astype(np.float32)
+            bias = module.bias.detach().cpu().numpy().astype(np.float32)
+            layers.append([weight, bias, None])
+        elif type(module) in activations and len(layers) > 0:
+            layers[-1][2] = activations[type(module)]
+        else:
+            raise ValueError(f'Unsupported module {module} in an MLP policy.')
+    return layers
+
+
+def epsilon_greedy_probabilities(q_values, exploration_rate):
+    # the action distribution of DQN.predict: a uniformly random action with probability exploration_rate, and the
+    # greedy one otherwise
+    num_actions = q_values.shape[1]
+    probabilities = np.full(q_values.shape, exploration_rate / num_actions)
+    probabilities[np.arange(len(q_values)), np.argmax(q_values, axis=1)] += 1 - exploration_rate
+    return probabilities
+
+
+class NumpyMlpPolicy:
+    # ### the forward pass of an MLP policy in numpy, with the predict interface of the stable baselines model. an actor
+    # ### critic policy samples its stochastic actions from the softmax of its logits. a q network acts epsilon greedy,
+    # ### with the exploration rate of the model, like DQN.predict
+    def __init__(self, layers, observation_shape, exploration_rate=None):
+        self.layers = layers
+        self.observation_shape = tuple(observation_shape)
+        self.exploration_rate = exploration_rate
+
+    def forward(self, observations):
+        x = np.asarray(observations, dtype=np.float32).reshape(-1, int(np.prod(self.observation_shape)))
+        for weight, bias, activation in self.layers:
+            x = x @ weight + bias
+            if activation is not None:
+                x = activation(x)
+        return x
+
+    def action_probabilities(self, observations):
+        outputs = self.forward(observations).astype(np.float64)
+        if self.exploration_rate is not None:
+            return epsilon_greedy_probabilities(outputs, self.exploration_rate)
+        probabilities = np.exp(outputs - outputs.max(axis=1, keepdims=True))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, observation, deterministic=False, rngs=None):
+        # the stochastic actions are drawn with rngs, the random generator of every observation (the random module when
+        # there are none)
+        observation = np.asarray(observation, dtype=np.float32)
+        vectorized = observation.shape != self.observation_shape
+        if deterministic:
+            actions = np.argmax(self.forward(observation), axis=1)
+        else:
+            cumulative_probabilities = np.cumsum(self.action_probabilities(observation), axis=1)
+            if rngs is None:
+                rngs = [random] * len(cumulative_probabilities)
+            u = np.array([rng.random() for rng in rngs])
+            actions = np.minimum(np.sum(cumulative_probabilities <= u[:, None], axis=1), cumulative_probabilities.shape[1] - 1)
+        if not vectorized:
+            actions = actions[0]
+        return actions, None
+
+
+def numpy_policy(model):
+    observation_shape = model.observation_space.shape
+    if hasattr(model, 'q_net'):
+        return NumpyMlpPolicy(extract_layers(model.q_net.q_net), observation_shape, model.exploration_rate)
+    policy = model.policy
+    layers = extract_layers(list(policy.mlp_extractor.policy_net) + [policy.action_net])
+    return NumpyMlpPolicy(layers, observation_shape)
+
+
+def model_outputs(model, observations):
+    # the torch counterpart of NumpyMlpPolicy.forward: the q values of a q network, the action logits of an actor critic
+    import torch
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(observations)
+        if hasattr(model, 'q_net'):
+            return model.q_net(obs_tensor).cpu().numpy()
+        return model.policy.get_distribution(obs_tensor).distribution.logits.cpu().numpy()
+
+
+def check_numpy_policy(model, policy, num_observations=1000, margin=1e-4):
+    # compares the numpy policy with model.predict on observations drawn from the observation space, with its infinite
+    # bounds clipped. the greedy actions must match wherever the best output leads the second one by more than margin,
+    # and the outputs must agree up to float32 rounding
+    space = model.observation_space
+    rng = np.random.default_rng(0)
+    observations = rng.uniform(np.maximum(space.low, -10), np.minimum(space.high, 10),
+                               size=(num_observations,) + space.shape).astype(np.float32)
+    outputs = policy.forward(observations)
+    expected_outputs = model_outputs(model, observations)
+    if hasattr(model, 'q_net'):
+        close = np.allclose(outputs, expected_outputs, rtol=1e-4, atol=1e-4)
+    else:
+        # the torch logits are normalized to log probabilities
+        shifted = outputs - outputs.max(axis=1, keepdims=True)
+        log_probabilities = shifted - np.log(np.sum(np.exp(shifted), axis=1, keepdims=True))
+        close = np.allclose(log_probabilities, expected_outputs, rtol=1e-4, atol=1e-4)
+    if not close:
+        raise ValueError('The numpy policy outputs differ from the model outputs.')
+    actions, _ = policy.predict(observations, deterministic=True)
+    expected_actions, _ = model.predict(observations, deterministic=True)
+    top_two = np.sort(outputs, axis=1)[:, -2:]
+    decided = top_two[:, 1] - top_two[:, 0] > margin
+    if np.any(actions[decided] != expected_actions[decided]):
+        raise ValueError('The numpy policy actions differ from the model actions.')
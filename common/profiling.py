@@ -0,0 +1,100 @@
+import contextlib
+import json
+import os
+import time
+
+# ### run instrumentation of the trajectory generation: the wall time and the number of calls of every phase (env
+# ### creation, model load, predict, env step, writing, ...) and named counters (env steps, predicts, retries, bytes
+# ### written). nothing is recorded until enable() is called, and a phase of a disabled run costs a single function call
+# ### that returns a shared null context. the phases nest, so the time of a phase includes the phases inside it. the
+# ### worker processes of a parallel run record their own statistics and hand them over with take(), and the main
+# ### process adds them up with merge(), so the phase times of such a run are summed over the processes
+
+_enabled = False
+_phases = {}
+_counters = {}
+
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class _Phase:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        seconds, calls = _phases.get(self.name, (0.0, 0))
+        _phases[self.name] = (seconds + elapsed, calls + 1)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def phase(name, counter=None, n=1):
+    # the context of a phase, which also adds n to counter (if given) so that a hot path needs a single call
+    if not _enabled:
+        return _NULL_PHASE
+    if counter is not None:
+        _counters[counter] = _counters.get(counter, 0) + n
+    return _Phase(name)
+
+
+def count(name, n=1):
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def take():
+    # the statistics recorded since the last take, which are then cleared
+    stats = {'phases': dict(_phases), 'counters': dict(_counters)}
+    _phases.clear()
+    _counters.clear()
+    return stats
+
+
+def merge(stats):
+    for name, (seconds, calls) in stats['phases'].items():
+        total_seconds, total_calls = _phases.get(name, (0.0, 0))
+        _phases[name] = (total_seconds + seconds, total_calls + calls)
+    for name, n in stats['counters'].items():
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def path_bytes(path):
+    # the size of a file, or of all the files under a directory (0 when the path does not exist)
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+    return total
+
+
+def write_report(path, run_info, wall_seconds):
+    # the structured report of a run: its parameters (run_info), its wall time, and the phases and counters recorded so
+    # far, the phases sorted by their time
+    stats = take()
+    phases = sorted(stats['phases'].items(), key=lambda item: -item[1][0])
+    report = dict(run_info)
+    report['wall_seconds'] = wall_seconds
+    report['phases'] = {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in phases}
+    report['counters'] = dict(sorted(stats['counters'].items()))
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
@@ -0,0 +1,358 @@
+import lzma
+import struct
+import zlib
+
+# ### a streaming reader of the 7z archives of the published Breakout and Pong outputs, on the lzma module of the
+# ### standard library. it reads the archive header (plain or lzma encoded), and decompresses the folders (the solid
+# ### blocks of the archive) chunk by chunk, cutting them into the files they hold, so that no file and no folder is
+# ### ever held in memory whole. it supports the coders that 7z uses for text (LZMA, LZMA2 and copy, optionally behind
+# ### a BCJ x86 filter), and neither encryption nor multi volume archives
+
+SIGNATURE = b"7z\xbc\xaf'\x1c"
+
+K_END = 0x00
+K_HEADER = 0x01
+K_MAIN_STREAMS_INFO = 0x04
+K_FILES_INFO = 0x05
+K_PACK_INFO = 0x06
+K_UNPACK_INFO = 0x07
+K_SUBSTREAMS_INFO = 0x08
+K_SIZE = 0x09
+K_CRC = 0x0A
+K_FOLDER = 0x0B
+K_CODERS_UNPACK_SIZE = 0x0C
+K_NUM_UNPACK_STREAM = 0x0D
+K_EMPTY_STREAM = 0x0E
+K_NAME = 0x11
+K_ENCODED_HEADER = 0x17
+
+CODER_COPY = b'\x00'
+CODER_LZMA = b'\x03\x01\x01'
+CODER_LZMA2 = b'\x21'
+CODER_BCJ = b'\x03\x03\x01\x03'
+
+# ### the size of the packed chunks that are read from the archive, and the most bytes that one decompress call returns
+READ_SIZE = 1 << 20
+MAX_CHUNK_SIZE = 1 << 22
+
+
+class HeaderReader:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def byte(self):
+        value = self.data[self.position]
+        self.position += 1
+        return value
+
+    def bytes(self, n):
+        value = self.data[self.position:self.position + n]
+        self.position += n
+        return value
+
+    def number(self):
+        # the variable length UINT64 of 7z: the leading one bits of the first byte count the bytes that follow
+        first = self.byte()
+        mask = 0x80
+        value = 0
+        for i in range(8):
+            if first & mask == 0:
+                return value | ((first & (mask - 1)) << (8 * i))
+            value |= self.byte() << (8 * i)
+            mask >>= 1
+        return value
+
+    def bits(self, n):
+        # a bit vector of n items, most significant bit first
+        values = []
+        byte = 0
+        for i in range(n):
+            if i % 8 == 0:
+                byte = self.byte()
+            values.append(bool(byte & (0x80 >> (i % 8))))
+        return values
+
+    def digests(self, n):
+        all_defined = self.byte()
+        defined = [True] * n if all_defined else self.bits(n)
+        return [struct.unpack('<I', self.bytes(4))[0] if d else None for d in defined]
+
+
+class Folder:
+    # ### a solid block of the archive: its coders, from the last one (which reads the packed stream) to the first one
+    # ### (which yields the files), and its unpacked size
+    def __init__(self):
+        self.coders = []
+        self.unpack_sizes = []
+        self.num_pack_streams = 1
+        self.bind_pairs = []
+
+    def unpack_size(self):
+        # the size of the only coder output that is not bound to the input of another coder
+        bound_outputs = set(out_index for _, out_index in self.bind_pairs)
+        for i, size in enumerate(self.unpack_sizes):
+            if i not in bound_outputs:
+                return size
+        raise ValueError('A 7z folder without an unbound output.')
+
+    def filters(self):
+        # the lzma module filter chain of the folder, from the first filter to the compressor
+        filters = []
+        for codec_id, properties in self.coders:
+            if codec_id == CODER_LZMA:
+                d = properties[0]
+                filters.append({'id': lzma.FILTER_LZMA1, 'dict_size': struct.unpack('<I', properties[1:5])[0],
+                                'lc': d % 9, 'lp': (d // 9) % 5, 'pb': d // 45})
+            elif codec_id == CODER_LZMA2:
+                p = properties[0]
+                dict_size = 0xFFFFFFFF if p == 40 else (2 | (p & 1)) << (p // 2 + 11)
+                filters.append({'id': lzma.FILTER_LZMA2, 'dict_size': dict_size})
+            elif codec_id == CODER_BCJ:
+                filters.append({'id': lzma.FILTER_X86})
+            elif codec_id != CODER_COPY:
+                raise ValueError(f'Unsupported 7z coder {codec_id.hex()}.')
+        if len(self.coders) > 2 or (len(self.coders) == 2 and self.coders[0][0] != CODER_BCJ):
+            raise ValueError('Unsupported 7z coder chain.')
+        return filters
+
+
+def read_folder(reader):
+    folder = Folder()
+    num_in_streams = 0
+    num_out_streams = 0
+    for _ in range(reader.number()):
+        flags = reader.byte()
+        codec_id = reader.bytes(flags & 0x0F)
+        coder_in_streams, coder_out_streams = 1, 1
+        if flags & 0x10:
+            coder_in_streams, coder_out_streams = reader.number(), reader.number()
+        properties = b''
+        if flags & 0x20:
+            properties = reader.bytes(reader.number())
+        if flags & 0x80:
+            raise ValueError('Unsupported 7z coder with alternative methods.')
+        folder.coders.append((codec_id, properties))
+        num_in_streams += coder_in_streams
+        num_out_streams += coder_out_streams
+    for _ in range(num_out_streams - 1):
+        folder.bind_pairs.append((reader.number(), reader.number()))
+    folder.num_pack_streams = num_in_streams - len(folder.bind_pairs)
+    if folder.num_pack_streams > 1:
+        raise ValueError('Unsupported 7z folder with several packed streams.')
+    return folder
+
+
+class StreamsInfo:
+    # ### where the packed streams of an archive (or of its encoded header) are, the folders that unpack them, and the
+    # ### sizes and the CRC32s (None when not stored) of the files of every folder
+    def __init__(self):
+        self.pack_position = 0
+        self.pack_sizes = []
+        self.folders = []
+        self.folder_crcs = []
+        self.file_sizes = []
+        self.file_crcs = []
+
+
+def read_streams_info(reader):
+    info = StreamsInfo()
+    files_per_folder = None
+    substream_sizes = None
+    substream_crcs = None
+    while True:
+        property_id = reader.byte()
+        if property_id == K_END:
+            break
+        if property_id == K_PACK_INFO:
+            info.pack_position = reader.number()
+            num_pack_streams = reader.number()
+            while True:
+                pack_property = reader.byte()
+                if pack_property == K_END:
+                    break
+                if pack_property == K_SIZE:
+                    info.pack_sizes = [reader.number() for _ in range(num_pack_streams)]
+                elif pack_property == K_CRC:
+                    reader.digests(num_pack_streams)
+        elif property_id == K_UNPACK_INFO:
+            if reader.byte() != K_FOLDER:
+                raise ValueError('A 7z unpack info without folders.')
+            num_folders = reader.number()
+            if reader.byte() != 0:
+                raise ValueError('Unsupported external 7z folders.')
+            info.folders = [read_folder(reader) for _ in range(num_folders)]
+            info.folder_crcs = [None] * num_folders
+            if reader.byte() != K_CODERS_UNPACK_SIZE:
+                raise ValueError('A 7z unpack info without unpack sizes.')
+            for folder in info.folders:
+                folder.unpack_sizes = [reader.number() for _ in range(len(folder.bind_pairs) + 1)]
+            while True:
+                unpack_property = reader.byte()
+                if unpack_property == K_END:
+                    break
+                if unpack_property == K_CRC:
+                    info.folder_crcs = reader.digests(num_folders)
+        elif property_id == K_SUBSTREAMS_INFO:
+            files_per_folder = [1] * len(info.folders)
+            while True:
+                substreams_property = reader.byte()
+                if substreams_property == K_END:
+                    break
+                if substreams_property == K_NUM_UNPACK_STREAM:
+                    files_per_folder = [reader.number() for _ in info.folders]
+                elif substreams_property == K_SIZE:
+                    # the size of the last file of a folder is what the others leave of the folder
+                    substream_sizes = []
+                    for folder, num_files in zip(info.folders, files_per_folder):
+                        sizes = [reader.number() for _ in range(num_files - 1)] if num_files > 0 else []
+                        substream_sizes.append(sizes + [folder.unpack_size() - sum(sizes)] if num_files > 0 else [])
+                elif substreams_property == K_CRC:
+                    # only the files whose CRC32 is not the CRC32 of their whole folder have one here
+                    num_digests = sum(num_files for num_files, crc in zip(files_per_folder, info.folder_crcs)
+                                      if not (num_files == 1 and crc is not None))
+                    substream_crcs = iter(reader.digests(num_digests))
+        else:
+            raise ValueError(f'Unexpected 7z streams property {property_id}.')
+
+    if files_per_folder is None:
+        files_per_folder = [1] * len(info.folders)
+    for j, (folder, num_files) in enumerate(zip(info.folders, files_per_folder)):
+        if substream_sizes is not None:
+            info.file_sizes.append(substream_sizes[j])
+        else:
+            info.file_sizes.append([folder.unpack_size()] if num_files == 1 else [])
+        if num_files == 1 and info.folder_crcs[j] is not None:
+            info.file_crcs.append([info.folder_crcs[j]])
+        elif substream_crcs is not None:
+            info.file_crcs.append([next(substream_crcs) for _ in range(num_files)])
+        else:
+            info.file_crcs.append([None] * num_files)
+    return info
+
+
+def read_files_info(reader):
+    # the names of the files, and which of them have no data (directories and empty files)
+    num_files = reader.number()
+    names = [''] * num_files
+    empty = [False] * num_files
+    while True:
+        property_id = reader.byte()
+        if property_id == K_END:
+            break
+        size = reader.number()
+        end = reader.position + size
+        if property_id == K_EMPTY_STREAM:
+            empty = reader.bits(num_files)
+        elif property_id == K_NAME:
+            if reader.byte() != 0:
+                raise ValueError('Unsupported external 7z file names.')
+            names = reader.bytes(size - 1).decode('utf-16-le').split('\x00')[:num_files]
+        reader.position = end
+    return names, empty
+
+
+class SevenZipArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            start_header = f.read(32)
+            if start_header[:6] != SIGNATURE:
+                raise ValueError(f'{path} is not a 7z archive.')
+            next_header_offset, next_header_size, _ = struct.unpack('<QQI', start_header[12:32])
+            f.seek(32 + next_header_offset)
+            header = f.read(next_header_size)
+        reader = HeaderReader(header)
+        property_id = reader.byte()
+        # an encoded header is itself a packed stream, which holds the header (or another encoded header)
+        while property_id == K_ENCODED_HEADER:
+            info = read_streams_info(reader)
+            header = b''.join(self._unpack(info.folders[0], 32 + info.pack_position, info.pack_sizes[0]))
+            reader = HeaderReader(header)
+            property_id = reader.byte()
+        if property_id != K_HEADER:
+            raise ValueError(f'Unexpected 7z header property {property_id}.')
+
+        self.streams = StreamsInfo()
+        names, empty = [], []
+        while True:
+            property_id = reader.byte()
+            if property_id == K_END:
+                break
+            if property_id == K_MAIN_STREAMS_INFO:
+                self.streams = read_streams_info(reader)
+            elif property_id == K_FILES_INFO:
+                names, empty = read_files_info(reader)
+            else:
+                raise ValueError(f'Unsupported 7z header property {property_id}.')
+        # the names of the files with data, in the order of the folders that hold them, and of the empty ones
+        self.names = [name for name, is_empty in zip(names, empty) if not is_empty]
+        self.empty_names = [name for name, is_empty in zip(names, empty) if is_empty]
+
+    def _unpack(self, folder, pack_start, pack_size):
+        # the unpacked bytes of a folder, in chunks of at most MAX_CHUNK_SIZE bytes
+        filters = folder.filters()
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters) if len(filters) > 0 else None
+        remaining_output = folder.unpack_size()
+        remaining_input = pack_size
+        with open(self.path, 'rb') as f:
+            f.seek(pack_start)
+            while remaining_output > 0:
+                data = b''
+                if decompressor is None or decompressor.needs_input:
+                    data = f.read(min(READ_SIZE, remaining_input))
+                    remaining_input -= len(data)
+                    if len(data) == 0:
+                        raise ValueError(f'{self.path} ends inside a packed stream.')
+                if decompressor is not None:
+                    data = decompressor.decompress(data, min(MAX_CHUNK_SIZE, remaining_output))
+                chunk = data[:remaining_output]
+                remaining_output -= len(chunk)
+                if len(chunk) > 0:
+                    yield chunk
+                elif decompressor is not None and decompressor.eof:
+                    raise ValueError(f'A packed stream of {self.path} ends before its unpacked size.')
+
+    def files(self):
+        # (name, chunks) for every file with data, in archive order, where chunks yields the bytes of the file (as
+        # memoryviews) and checks its CRC32 at the end. the chunks of a file must be consumed before the next file is
+        # asked for, and a file that is not needed is skipped by asking for the next one
+        pack_start = 32 + self.streams.pack_position
+        names = iter(self.names)
+        for folder, pack_size, sizes, crcs in zip(self.streams.folders, self.streams.pack_sizes, self.streams.file_sizes, self.streams.file_crcs):
+            folder_chunks = self._unpack(folder, pack_start, pack_size)
+            pending = [memoryview(b'')]
+            for size, crc in zip(sizes, crcs):
+                chunks = FileChunks(self.path, next(names), size, crc, folder_chunks, pending)
+                yield chunks.name, chunks
+                chunks.skip()
+            pack_start += pack_size
+
+
+class FileChunks:
+    # ### the bytes of one file of a folder, cut from the unpacked chunks of the folder. pending holds the bytes that the
+    # ### previous file left of its last chunk
+    def __init__(self, path, name, size, crc, folder_chunks, pending):
+        self.path = path
+        self.name = name
+        self.remaining = size
+        self.crc = crc
+        self.running_crc = 0
+        self.folder_chunks = folder_chunks
+        self.pending = pending
+
+    def __iter__(self):
+        while self.remaining > 0:
+            if len(self.pending[0]) == 0:
+                self.pending[0] = memoryview(next(self.folder_chunks))
+            chunk = self.pending[0][:self.remaining]
+            self.pending[0] = self.pending[0][len(chunk):]
+            self.remaining -= len(chunk)
+            self.running_crc = zlib.crc32(chunk, self.running_crc)
+            if self.remaining == 0 and self.crc is not None and self.running_crc != self.crc:
+                raise ValueError(f'{self.name} in {self.path} fails its CRC check.')
+            yield chunk
+
+    def skip(self):
+        for _ in self:
+            pass
@@ -1,33 +1,53 @@
 import numpy
-from numpy import cos, sin
 
-def acrobot_refiner(raw_state):
-    refined_state = numpy.array(
-        [cos(raw_state[0]), sin(raw_state[0]), cos(raw_state[1]), sin(raw_state[1]), raw_state[2], raw_state[3]], dtype=numpy.float32
-    )
+from common.domains import domains
+
+# ### every refiner takes a single raw state or an (N, d) batch of them, and writes the policy observations into out
+# ### when the caller passes a buffer of the right shape (a new array otherwise). the refiners of the tabular domains
+# ### return an int for a single raw state
+
+
+def refiner_output(raw_state, width, dtype, out):
+    if out is not None:
+        return out
+    return numpy.empty(raw_state.shape[:-1] + (width,), dtype=dtype)
+
+
+def acrobot_refiner(raw_state, out=None):
+    raw_state = numpy.asarray(raw_state)
+    refined_state = refiner_output(raw_state, 6, numpy.float32, out)
+    # cos and sin of both angles, interleaved
+    numpy.cos(raw_state[..., :2], out=refined_state[..., 0:4:2])
+    numpy.sin(raw_state[..., :2], out=refined_state[..., 1:4:2])
+    refined_state[..., 4:] = raw_state[..., 2:]
     return refined_state
 
-def cart_pole_refiner(raw_state):
-    refined_state = numpy.array(raw_state, dtype=numpy.float32)
+def cart_pole_refiner(raw_state, out=None):
+    raw_state = numpy.asarray(raw_state)
+    refined_state = refiner_output(raw_state, 4, numpy.float32, out)
+    refined_state[...] = raw_state
     return refined_state
 
-def mountain_car_refiner(raw_state):
-    refined_state = numpy.array(raw_state, dtype=numpy.float32)
+def mountain_car_refiner(raw_state, out=None):
+    raw_state = numpy.asarray(raw_state)
+    refined_state = refiner_output(raw_state, 2, numpy.float32, out)
+    refined_state[...] = raw_state
     return refined_state
 
-def taxi_refiner(raw_state):
-    refined_state = int(raw_state)
+def taxi_refiner(raw_state, out=None):
+    if out is None and numpy.ndim(raw_state) == 0:
+        return int(raw_state)
+    refined_state = out if out is not None else numpy.empty(numpy.shape(raw_state), dtype=numpy.int64)
+    refined_state[...] = raw_state
     return refined_state
 
-def frozen_lake_refiner(raw_state):
-    refined_state = int(raw_state)
+def frozen_lake_refiner(raw_state, out=None):
+    if out is None and numpy.ndim(raw_state) == 0:
+        return int(raw_state)
+    refined_state = out if out is not None else numpy.empty(numpy.shape(raw_state), dtype=numpy.int64)
+    refined_state[...] = raw_state
     return refined_state
 
 
-refiners = {
-    "Acrobot_v1": acrobot_refiner,
-    "CartPole_v1": cart_pole_refiner,
-    "MountainCar_v0": mountain_car_refiner,
-    "Taxi_v3": taxi_refiner,
-    "FrozenLake_v1": frozen_lake_refiner
-}
+# ### the refiner of every domain that has one, by domain name, as the domain registry declares it
+refiners = {domain_name: domain.load('refiner') for domain_name, domain in domains.items() if domain.refiner is not None}
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def policy_tables(model, num_states):
+    # the greedy action of every state, and the cumulative action distribution of every state for the stochastic policy
+    states = np.arange(num_states)
+    greedy_actions, _ = model.predict(states, deterministic=True)
+    import torch
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(states)
+        probabilities = model.policy.get_distribution(obs_tensor).distribution.probs.cpu().numpy()
+    return greedy_actions.astype(np.int64), np.cumsum(probabilities.astype(np.float64), axis=1)
+
+
+def transition_tables(P, num_states, num_actions):
+    # P[s][a] is a list of (probability, next_state, reward, terminated) transitions. the env picks one of them as
+    # argmax(cumsum(probabilities) > u) for a uniform u from its np_random, so the tables hold that same cumsum. the
+    # padding never compares greater than u, which keeps the argmax of a short transition list where the env has it
+    num_outcomes = max(len(P[s][a]) for s in range(num_states) for a in range(num_actions))
+    cumulative_probabilities = np.full((num_states, num_actions, num_outcomes), -np.inf)
+    next_states = np.zeros((num_states, num_actions, num_outcomes), dtype=np.int64)
+    terminated = np.zeros((num_states, num_actions, num_outcomes), dtype=bool)
+    for s in range(num_states):
+        for a in range(num_actions):
+            transitions = P[s][a]
+            cumulative_probabilities[s, a, :len(transitions)] = np.cumsum(np.asarray([t[0] for t in transitions]))
+            next_states[s, a, :len(transitions)] = [t[1] for t in transitions]
+            terminated[s, a, :len(transitions)] = [t[3] for t in transitions]
+    return cumulative_probabilities, next_states, terminated
+
+
+class TabularEngine:
+    # ### the policy and the dynamics of a tabular domain as lookup tables, built once per (domain, model)
+    def __init__(self, model, env):
+        unwrapped = env.unwrapped
+        num_states = unwrapped.observation_space.n
+        num_actions = unwrapped.action_space.n
+        self.greedy_actions, self.action_cumulative_probabilities = policy_tables(model, num_states)
+        self.cumulative_probabilities, self.next_states, self.terminated = transition_tables(unwrapped.P, num_states, num_actions)
+
+    def policy_actions(self, states, deterministic, rngs):
+        if deterministic:
+            return self.greedy_actions[states]
+        u = np.array([rng.random() for rng in rngs])
+        return np.minimum(np.sum(self.action_cumulative_probabilities[states] <= u[:, None], axis=1), self.action_cumulative_probabilities.shape[1] - 1)
+
+    def step(self, states, actions, u):
+        # the next states and terminated flags of the env steps that drew the uniforms u
+        outcomes = np.argmax(self.cumulative_probabilities[states, actions] > u[:, None], axis=1)
+        return self.next_states[states, actions, outcomes], self.terminated[states, actions, outcomes]
@@ -0,0 +1,104 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+from common.consts import MAX_EXEC_LEN
+
+
+class Trajectory:
+    # ### an execution kept in buffers that are preallocated for MAX_EXEC_LEN steps: the observations, the registered
+    # ### actions and a mask of the actions that failed. the executors write into the buffers directly, and every view
+    # ### (observations, actions, fault mask, and the interleaved observation / action series) is a slice of them
+    def __init__(self, observation_shape, observation_dtype, max_len=MAX_EXEC_LEN):
+        self._observations = np.empty((max_len,) + tuple(observation_shape), dtype=observation_dtype)
+        self._actions = np.empty(max_len, dtype=np.int64)
+        self._fault_mask = np.zeros(max_len, dtype=bool)
+        self.num_observations = 0
+        self.num_actions = 0
+
+    @classmethod
+    def for_observation(cls, obs, max_len=MAX_EXEC_LEN):
+        # float observations get a float64 buffer, as the first (reset) observation may be of lower precision than the
+        # ones that follow it
+        obs = np.asarray(obs)
+        dtype = np.float64 if obs.dtype.kind == 'f' else obs.dtype
+        return cls(obs.shape, dtype, max_len)
+
+    @classmethod
+    def from_arrays(cls, observations, actions, faulty_actions_indices):
+        # the trajectory of a finished execution, as it is read back from its output arrays
+        trajectory = cls(np.shape(observations)[1:], np.asarray(observations).dtype, len(observations))
+        trajectory._observations[:] = observations
+        trajectory._actions[:len(actions)] = actions
+        trajectory._fault_mask[np.asarray(faulty_actions_indices, dtype=np.int64) - 1] = True
+        trajectory.num_observations = len(observations)
+        trajectory.num_actions = len(actions)
+        return trajectory
+
+    def append_observation(self, obs):
+        self._observations[self.num_observations] = obs
+        self.num_observations += 1
+
+    def append_action(self, action, faulty):
+        self._actions[self.num_actions] = action
+        self._fault_mask[self.num_actions] = faulty
+        self.num_actions += 1
+
+    def copy_prefix(self, num_steps):
+        # a new trajectory that holds the first num_steps observations and actions of this one
+        prefix = Trajectory(self._observations.shape[1:], self._observations.dtype, len(self._observations))
+        prefix._observations[:num_steps] = self._observations[:num_steps]
+        prefix._actions[:num_steps] = self._actions[:num_steps]
+        prefix._fault_mask[:num_steps] = self._fault_mask[:num_steps]
+        prefix.num_observations = num_steps
+        prefix.num_actions = num_steps
+        return prefix
+
+    @property
+    def observations(self):
+        return self._observations[:self.num_observations]
+
+    @property
+    def actions(self):
+        return self._actions[:self.num_actions]
+
+    @property
+    def fault_mask(self):
+        return self._fault_mask[:self.num_actions]
+
+    @property
+    def faulty_actions_indices(self):
+        # the ordinal numbers (starting at 1) of the actions that failed
+        return (np.flatnonzero(self.fault_mask) + 1).tolist()
+
+    @property
+    def interleaved(self):
+        return InterleavedTrajectoryView(self)
+
+    def __getstate__(self):
+        # a finished trajectory is pickled without the unused part of its buffers
+        state = dict(self.__dict__)
+        state['_observations'] = self.observations
+        state['_actions'] = self.actions
+        state['_fault_mask'] = self.fault_mask
+        return state
+
+
+class InterleavedTrajectoryView(Sequence):
+    # ### the alternating series of observations and actions (trajectory_execution), read from the trajectory buffers
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+
+    def __len__(self):
+        return self.trajectory.num_observations + self.trajectory.num_actions
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('trajectory index out of range')
+        if i % 2 == 0:
+            return self.trajectory.observations[i // 2]
+        return int(self.trajectory.actions[i // 2])
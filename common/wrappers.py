@@ -1,131 +1,96 @@
 import gym
+import numpy as np
 
+from common.domains import domains
 
-class AcrobotSetStepWrapper(gym.Wrapper):
-    def __init__(self, env):
-        super().__init__(env)
-
-    def reset(self, seed=None):
-        state, info = self.env.reset(seed=seed)
-
-        raw_state = self.unwrapped.state
-        return raw_state, info
-
-    def set_state(self, raw_state):
-        self.unwrapped.state = raw_state
-
-    def step(self, action):
-        state, reward, done, trunc, info = self.env.step(action)
-
-        raw_state = self.unwrapped.state
-        return raw_state, reward, done, trunc, info
-
-
-class CartPoleSetStepWrapper(gym.Wrapper):
-    def __init__(self, env):
-        super().__init__(env)
-
-    def reset(self, seed=None):
-        state, info = self.env.reset(seed=seed)
-
-        raw_state = self.unwrapped.state
-        return raw_state, info
-
-    def set_state(self, raw_state):
-        self.unwrapped.state = raw_state
-
-    def step(self, action):
-        state, reward, done, trunc, info = self.env.step(action)
 
-        raw_state = self.unwrapped.state
-        return raw_state, reward, done, trunc, info
+class SetStepWrapper(gym.Wrapper):
+    # ### returns the raw state of the env (the attribute state_attribute of the unwrapped env) instead of its
+    # ### observation, and can put the env into any raw state. reset and step copy the raw state into the buffer out
+    # ### when the caller passes one (a float array of shape (state_size,)), and into a new array otherwise, so the
+    # ### returned state never aliases the mutable state of the env. the raw state of a tabular env (state_size None) is
+    # ### a single int
+    state_attribute = 'state'
+    state_size = None
+    # ### the raw state, as the unwrapped env holds it, is an array of reset_dtype after a reset, and a tuple of floats
+    # ### after a step of the envs whose step stores a tuple (step_tuple). state_text prints a raw state the way the
+    # ### outputs always have, the str() of that array or tuple
+    reset_dtype = np.float64
+    step_tuple = False
 
-
-class MountainCarSetStepWrapper(gym.Wrapper):
     def __init__(self, env):
         super().__init__(env)
 
-    def reset(self, seed=None):
+    def raw_state(self, out=None):
+        state = getattr(self.unwrapped, self.state_attribute)
+        if self.state_size is None:
+            if out is None:
+                return int(state)
+            out[...] = state
+            return out
+        if out is None:
+            out = np.empty(self.state_size, dtype=np.float64)
+        out[:] = state
+        return out
+
+    @classmethod
+    def state_text(cls, raw_state, after_reset):
+        if cls.state_size is None:
+            return str(int(raw_state))
+        if after_reset:
+            return str(np.asarray(raw_state, dtype=cls.reset_dtype))
+        if cls.step_tuple:
+            return repr(tuple(np.asarray(raw_state).tolist()))
+        return str(np.asarray(raw_state))
+
+    def reset(self, seed=None, out=None):
         state, info = self.env.reset(seed=seed)
 
-        raw_state = self.unwrapped.state
+        raw_state = self.raw_state(out)
         return raw_state, info
 
-    def set_state(self, raw_state):
-        self.unwrapped.state = raw_state
-
-    def step(self, action):
-        state, reward, done, trunc, info = self.env.step(action)
-
-        raw_state = self.unwrapped.state
-        return raw_state, reward, done, trunc, info
-
-
-class TaxiSetStepWrapper(gym.Wrapper):
-    def __init__(self, env):
-        super().__init__(env)
-
-    def reset(self, seed=None):
-        state, info = self.env.reset(seed=seed)
-
-        raw_state = self.unwrapped.s
-        return raw_state, info
+    def get_state(self):
+        return getattr(self.unwrapped, self.state_attribute)
 
     def set_state(self, raw_state):
-        self.unwrapped.s = raw_state
+        setattr(self.unwrapped, self.state_attribute, raw_state)
 
-    def step(self, action):
+    def step(self, action, out=None):
         state, reward, done, trunc, info = self.env.step(action)
 
-        raw_state = self.unwrapped.s
+        raw_state = self.raw_state(out)
         return raw_state, reward, done, trunc, info
 
 
-class FrozenLakeSetStepWrapper(gym.Wrapper):
-    def __init__(self, env):
-        super().__init__(env)
-
-    def reset(self, seed=None):
-        state, info = self.env.reset(seed=seed)
-
-        raw_state = self.unwrapped.s
-        return raw_state, info
+class AcrobotSetStepWrapper(SetStepWrapper):
+    state_size = 4
+    reset_dtype = np.float32
 
-    def set_state(self, raw_state):
-        self.unwrapped.s = raw_state
 
-    def step(self, action):
-        state, reward, done, trunc, info = self.env.step(action)
-
-        raw_state = self.unwrapped.s
-        return raw_state, reward, done, trunc, info
+class CartPoleSetStepWrapper(SetStepWrapper):
+    state_size = 4
+    step_tuple = True
 
 
-class BreakoutSetStepWrapper(gym.Wrapper):
-    def __init__(self, env):
-        super().__init__(env)
+class MountainCarSetStepWrapper(SetStepWrapper):
+    state_size = 2
+    step_tuple = True
 
-    def reset(self, seed=None):
-        state, info = self.env.reset(seed=seed)
+    @classmethod
+    def state_text(cls, raw_state, after_reset):
+        # the step of the env sets the velocity to the int 0 when the car hits the left edge
+        if not after_reset and raw_state[1] == 0:
+            return repr((float(raw_state[0]), 0))
+        return super().state_text(raw_state, after_reset)
 
-        raw_state = self.unwrapped.s
-        return raw_state, info
 
-    def set_state(self, raw_state):
-        self.unwrapped.s = raw_state
+class TaxiSetStepWrapper(SetStepWrapper):
+    state_attribute = 's'
 
-    def step(self, action):
-        state, reward, done, trunc, info = self.env.step(action)
 
-        raw_state = self.unwrapped.s
-        return raw_state, reward, done, trunc, info
+class FrozenLakeSetStepWrapper(SetStepWrapper):
+    state_attribute = 's'
 
 
-wrappers = {
-    "Acrobot_v1": AcrobotSetStepWrapper,
-    "CartPole_v1": CartPoleSetStepWrapper,
-    "MountainCar_v0": MountainCarSetStepWrapper,
-    "Taxi_v3": TaxiSetStepWrapper,
-    "FrozenLake_v1": FrozenLakeSetStepWrapper,
-    "Breakout_v4": BreakoutSetStepWrapper
-}
+# ### the wrapper of every domain that has one, by domain name, as the domain registry declares it
+wrappers = {domain_name: domain.load('wrapper') for domain_name, domain in domains.items() if domain.wrapper is not None}
@@ -0,0 +1,334 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+from common import executor, profiling
+from common.consts import INFERENCE_BACKEND, MAX_EXEC_LEN
+from common.domains import ATARI_DOMAINS, TABULAR_DOMAINS
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from common.rl_models import models
+from p02_traj_factory import read_json_data, cell_rng, prepare_record, record_writers
+
+# ### a throughput benchmark of the trajectory generation. every case of a domain runs in a fresh process on a small
+# ### fixed grid of its input file (the first seeds and fault modes, the middle fault probability and the deterministic
+# ### policy), and reports its env steps and trajectories per second, the peak RSS of its process, the growth of that
+# ### peak during the timed part of the case and, for the writer, the bytes it wrote. the cases of a domain are:
+# ###
+# ###       "execute"           - every cell on its own, with the single executor of the domain (execute_gym or
+# ###                             execute_atari)
+# ###       "execute_batch"     - all the cells in lockstep with execute_batch (execute_tabular for Taxi and FrozenLake)
+# ###       "write"             - the trajectories of "execute" through the Excel and bundle writers
+# ###
+# ### the results go to outputs/benchmarks/benchmark_<time>.json, and --compare reports the cases of a run that got
+# ### slower than in a base run. an atari domain without its trained model is benchmarked with an untrained policy of
+# ### the same architecture, and without the atari ROMs on a stub env with the observation and action spaces of the
+# ### game. the results tell which ones they used, and runs that differ there are not compared
+
+DOMAIN_INPUTS = {
+    'Acrobot_v1': 'i1000_Acrobot.json',
+    'CartPole_v1': 'i2000_CartPole.json',
+    'MountainCar_v0': 'i3000_MountainCar.json',
+    'Taxi_v3': 'i4000_Taxi.json',
+    'FrozenLake_v1': 'i5000_FrozenLake.json',
+    'Breakout_v4': 'i6000_Breakout.json',
+    'PongNoFrameskip_v0': 'i7000_PongNoFrameskip.json',
+}
+
+# ### the cases of every domain, in the order they are run and reported
+CASES = ['execute', 'execute_batch', 'write']
+
+# ### the number of seeds and fault modes of the benchmark grid of a domain
+GRID_SIZES = {
+    'classic': (4, 2),
+    'atari': (2, 1),
+}
+
+# ### the observation shape and the number of actions of the atari games, for the stub env
+STUB_ATARI_SPACES = {
+    'Breakout_v4': ((84, 84, 1), 4),
+    'PongNoFrameskip_v0': ((84, 84, 4), 6),
+}
+
+
+class StubAtariVecEnv(VecEnv):
+    # ### a single env vec env with the spaces of an atari game, whose observations are random frames and whose
+    # ### episodes end after a random number of steps. it stands in for the game when its ROM is not installed
+    def __init__(self, domain_name, seed=None):
+        observation_shape, num_actions = STUB_ATARI_SPACES[domain_name]
+        super().__init__(1, spaces.Box(0, 255, observation_shape, dtype=np.uint8), spaces.Discrete(num_actions))
+        self.envs = []
+        self.rng = np.random.default_rng(seed)
+        self.steps_left = 0
+        self.actions = None
+
+    def reset(self):
+        if self._seeds[0] is not None:
+            self.rng = np.random.default_rng(self._seeds[0])
+            self._seeds = [None]
+        self.steps_left = int(self.rng.integers(50, 2 * MAX_EXEC_LEN))
+        return self.frame()
+
+    def frame(self):
+        return self.rng.integers(0, 256, size=(1,) + self.observation_space.shape, dtype=np.uint8)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        self.steps_left -= 1
+        done = self.steps_left <= 0
+        obs = self.reset() if done else self.frame()
+        return obs, np.zeros(1, dtype=np.float32), np.array([done]), [{}]
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name, None)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False]
+
+
+def prepare_atari_domain(domain_name, model_name):
+    # the env ("ale" or "stub") and the policy ("trained" or "untrained") that the atari domain is benchmarked with. the
+    # stub env replaces make_env in the executor of this (benchmark only) process
+    try:
+        executor.make_env(domain_name).close()
+        env_kind = 'ale'
+    except Exception:
+        executor.make_env = StubAtariVecEnv
+        env_kind = 'stub'
+    env = executor.make_env(domain_name)
+    model_path = f"trained_models/{domain_name}__{model_name}.zip"
+    if os.path.exists(model_path):
+        model = models[model_name].load(model_path)
+        model_kind = 'trained'
+    else:
+        model = models[model_name]('CnnPolicy', env, seed=0)
+        model_kind = 'untrained'
+    env.close()
+    executor.set_policy(domain_name, model_name, model)
+    return env_kind, model_kind
+
+
+def benchmark_grid(param_dict, domain_name):
+    num_seeds, num_fault_modes = GRID_SIZES['atari' if domain_name in ATARI_DOMAINS else 'classic']
+    fault_probabilities = param_dict['fault_probabilities']
+    fault_probability = fault_probabilities[len(fault_probabilities) // 2]
+    return [('deterministic', seed, execution_fault_mode, fault_probability, 1)
+            for seed in param_dict['seeds'][:num_seeds]
+            for execution_fault_mode in param_dict['modelled_fault_modes'][:num_fault_modes]]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def case_result(case, executor_name, num_cells, trajectories, seconds, stats):
+    steps = stats['counters'].get('env_steps', 0)
+    return {
+        'case': case,
+        'executor': executor_name,
+        'cells': num_cells,
+        'trajectories': len(trajectories),
+        'steps': steps,
+        'seconds': seconds,
+        'steps_per_sec': steps / seconds if seconds > 0 else None,
+        'trajectories_per_sec': len(trajectories) / seconds if seconds > 0 else None,
+        'predicted_observations': stats['counters'].get('predicted_observations', 0),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def single_executor(domain_name):
+    return executor.execute_atari if domain_name in ATARI_DOMAINS else executor.execute_gym
+
+
+def execute_cells(domain_name, model_name, cells, fault_mode_generator):
+    # ### the trajectories of the cells, each executed on its own with the single executor of the domain
+    execute_single = single_executor(domain_name)
+    trajectories = []
+    for cell in cells:
+        policy_type, seed, execution_fault_mode, fault_probability, _ = cell
+        trajectory, _ = execute_single(domain_name, model_name, policy_type, seed, execution_fault_mode, fault_probability, fault_mode_generator,
+                                       rng=cell_rng(domain_name, model_name, cell))
+        trajectories.append(trajectory)
+    return trajectories
+
+
+def benchmark_case(domain_name, case):
+    # ### a single case of a domain, run in a process of its own (see run_benchmarks), so that the peak RSS is the one of
+    # ### this case. the peak RSS before the timed part (the env and model, plus the input trajectories of the writer)
+    # ### is reported too, so that the growth during the case is known
+    param_dict = read_json_data(f"inputs/{DOMAIN_INPUTS[domain_name]}")
+    model_name = param_dict['model_name']
+    cells = benchmark_grid(param_dict, domain_name)
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    profiling.enable()
+
+    # ### the env and model loading is timed apart from the case
+    env_kind, model_kind = 'gym', 'trained'
+    start = time.perf_counter()
+    if domain_name in ATARI_DOMAINS:
+        env_kind, model_kind = prepare_atari_domain(domain_name, model_name)
+    env = executor.acquire_env(domain_name)
+    executor.get_policy(domain_name, model_name, env)
+    if domain_name in TABULAR_DOMAINS:
+        executor.get_tabular_engine(domain_name, model_name, env)
+    executor.release_env(domain_name, env)
+    setup_seconds = time.perf_counter() - start
+    profiling.take()
+
+    # ### the writer gets the trajectories of the single executions, which are not part of its time
+    if case == 'write':
+        trajectories = execute_cells(domain_name, model_name, cells, fault_mode_generator)
+        profiling.take()
+    start_peak_rss_mb = peak_rss_mb()
+
+    if case == 'execute':
+        # ### every cell on its own
+        start = time.perf_counter()
+        trajectories = execute_cells(domain_name, model_name, cells, fault_mode_generator)
+        result = case_result('execute', single_executor(domain_name).__name__, len(cells), trajectories, time.perf_counter() - start, profiling.take())
+    elif case == 'execute_batch':
+        # ### all the cells in lockstep
+        start = time.perf_counter()
+        batch = executor.execute_batch(domain_name, model_name, 'deterministic', [cell[1:4] for cell in cells], fault_mode_generator,
+                                       rngs=[cell_rng(domain_name, model_name, cell) for cell in cells])
+        batch_executor_name = 'execute_tabular' if domain_name in TABULAR_DOMAINS else 'execute_batch'
+        result = case_result('execute_batch', batch_executor_name, len(cells), [trajectory for trajectory, _ in batch], time.perf_counter() - start, profiling.take())
+    elif case == 'write':
+        # ### the trajectories of the single executions through the writers, into outputs/benchmarks
+        name = f"benchmarks/writer_{domain_name}"
+        start = time.perf_counter()
+        writers = record_writers(name, param_dict, ['excel', 'bundle'])
+        for (policy_type, seed, execution_fault_mode, fault_probability, instance), trajectory in zip(cells, trajectories):
+            record = prepare_record(domain_name, model_name, param_dict['policy_types'], param_dict['seeds'], param_dict['modelled_fault_modes'], param_dict['fault_probabilities'], param_dict['instances'],
+                                    policy_type, seed, execution_fault_mode, fault_probability, instance,
+                                    trajectory)
+            for writer in writers:
+                writer.write(record)
+        for writer in writers:
+            writer.close()
+        write_seconds = time.perf_counter() - start
+        output_paths = [f"outputs/{name}.xlsx", f"outputs/{name}_observations", f"outputs/{name}_bundle"]
+        result = case_result('write', 'ExcelRecordWriter+BundleWriter', len(cells), trajectories, write_seconds, profiling.take())
+        result['steps'] = sum(trajectory.num_actions for trajectory in trajectories)
+        result['steps_per_sec'] = result['steps'] / write_seconds
+        result['output_bytes'] = sum(profiling.path_bytes(path) for path in output_paths)
+        for path in output_paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+    else:
+        raise ValueError(f'Unknown benchmark case {case}.')
+
+    result.update({'domain_name': domain_name, 'model_name': model_name, 'env': env_kind, 'model': model_kind, 'setup_seconds': setup_seconds,
+                   'start_peak_rss_mb': start_peak_rss_mb, 'case_rss_growth_mb': result['peak_rss_mb'] - start_peak_rss_mb})
+    return result
+
+
+def library_versions():
+    versions = {}
+    for module_name in ['numpy', 'torch', 'gym', 'gymnasium', 'stable_baselines3', 'ale_py', 'xlsxwriter']:
+        try:
+            versions[module_name] = __import__(module_name).__version__
+        except (ImportError, AttributeError):
+            versions[module_name] = None
+    return versions
+
+
+def run_benchmarks(domain_names, output_path=None):
+    # ### every case of every domain in a fresh (spawned) process, since the peak RSS of a process only ever grows: the
+    # ### peak of a case run after another one would be the larger of the two
+    started = datetime.now()
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for domain_name in domain_names:
+        print(f"benchmarking {domain_name}")
+        for case in CASES:
+            with context.Pool(1) as pool:
+                result = pool.apply(benchmark_case, (domain_name, case))
+            print(f"    {result['case']:>14}: {result['steps_per_sec']:10.1f} steps/s {result['trajectories_per_sec']:8.2f} trajectories/s {result['peak_rss_mb']:8.1f} MB peak {result['case_rss_growth_mb']:+8.1f} MB in the case")
+            results.append(result)
+
+    report = {
+        'started': started.strftime("%d/%m/%Y %H:%M:%S"),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': library_versions(),
+        'inference_backend': INFERENCE_BACKEND,
+        'max_exec_len': MAX_EXEC_LEN,
+        'results': results,
+    }
+    if output_path is None:
+        output_path = f"outputs/benchmarks/benchmark_{started.strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"benchmark results: {output_path}")
+    return report
+
+
+def compare_benchmarks(base_path, new_path, threshold=0.1):
+    # ### the steps per second of every case of the new run against the base run. a case is a regression when it got
+    # ### slower by more than threshold (as a fraction). returns the regressed cases
+    base = read_json_data(base_path)
+    new = read_json_data(new_path)
+    base_results = {(result['domain_name'], result['case']): result for result in base['results']}
+    regressions = []
+    print(f"{'domain':>20} {'case':>14} {'base steps/s':>14} {'new steps/s':>14} {'ratio':>7}")
+    for result in new['results']:
+        key = (result['domain_name'], result['case'])
+        base_result = base_results.get(key)
+        if base_result is None:
+            print(f"{key[0]:>20} {key[1]:>14} {'-':>14} {result['steps_per_sec']:14.1f}")
+            continue
+        if (base_result['env'], base_result['model']) != (result['env'], result['model']):
+            print(f"{key[0]:>20} {key[1]:>14} not comparable: {base_result['env']}/{base_result['model']} vs {result['env']}/{result['model']}")
+            continue
+        ratio = result['steps_per_sec'] / base_result['steps_per_sec']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = ' REGRESSION'
+            regressions.append(key)
+        print(f"{key[0]:>20} {key[1]:>14} {base_result['steps_per_sec']:14.1f} {result['steps_per_sec']:14.1f} {ratio:7.2f}{flag}")
+    for version_name, version in new['versions'].items():
+        if base['versions'].get(version_name) != version:
+            print(f"{version_name}: {base['versions'].get(version_name)} -> {version}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domains', nargs='+', default=list(DOMAIN_INPUTS), help='the domains to benchmark (all of them by default)')
+    parser.add_argument('--output', help='the results file (outputs/benchmarks/benchmark_<time>.json by default)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two results files instead of benchmarking')
+    parser.add_argument('--threshold', type=float, default=0.1, help='the slowdown (as a fraction) that --compare reports as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        regressions = compare_benchmarks(*args.compare, threshold=args.threshold)
+        sys.exit(1 if len(regressions) > 0 else 0)
+    run_benchmarks(args.domains, args.output)
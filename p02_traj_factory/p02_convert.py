@@ -0,0 +1,283 @@
+import argparse
+import ast
+import itertools
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import openpyxl
+
+from common.bundles import BundleWriter
+from common.domains import domains
+from common.sevenzip import SevenZipArchive
+
+# ### a converter of the published outputs (the Excel files, and the 7z archives of the Breakout and Pong observations)
+# ### into bundles, so that the published benchmarks can be read with common.bundles.Bundle without generating them
+# ### again. everything is streamed: the Excel rows are read one at a time, and the text files of an archive are
+# ### decompressed chunk by chunk and parsed into frames as they come, so no archive and no observation file is ever
+# ### held in memory whole. the files are converted in parallel, one worker process per Excel file (e.g. per seed file
+# ### of Breakout). the outputs hold the observations as text:
+# ###
+# ###       classic and tabular - the 15_O_observations cell, the str() of a list of the str() of every observation
+# ###       atari               - <archive prefix>_<policy_type>_<seed>_<fault mode>_<fault probability>_<instance>_obs.txt
+# ###                             files in <excel file>_obs_trajs.7z, each '[' + ',\n'.join(np.array2string(obs)) + ']'
+# ###
+# ### the _traj.txt files of the archives, and the 16_O_trajectory_execution cells, are the observations interleaved
+# ### with the registered actions, so they are skipped. the first observation of a classic record was printed by
+# ### np.array2string, so it keeps only the 8 decimals that the output holds. the atari records go to the bundle in the
+# ### order of their archive, the others in the order of their Excel file
+
+OPEN = ord('[')
+CLOSE = ord(']')
+DIGIT_0 = ord('0')
+DIGIT_9 = ord('9')
+
+# ### the most brackets that an array text nests to
+MAX_DEPTH = 16
+
+# ### the columns of the list constants of a bundle, which the outputs hold as their str()
+LIST_CONSTANT_COLUMNS = {
+    'policy_types': '03_f_policy_types',
+    'seeds': '04_f_seeds',
+    'modelled_fault_modes': '05_f_modelled_fault_modes',
+    'fault_probabilities': '06_f_fault_probabilities',
+    'instances': '07_f_instances',
+}
+
+
+class ArrayListTextParser:
+    # ### parses the text of a list of np.array2string arrays of non negative integers, as it streams in, into the
+    # ### arrays of the list (of the shape that their brackets nest to). a bare number of the list is an int item. a chunk
+    # ### is cut after its last non digit byte, and the digits after it wait for the next chunk, so no number is split
+    def __init__(self, dtype=np.uint8):
+        self.dtype = dtype
+        self.carry = b''
+        self.depth = 0
+        # the values of the unfinished array, one array per chunk, and the number of its brackets at every depth
+        self.values = []
+        self.opens = np.zeros(MAX_DEPTH, dtype=np.int64)
+
+    def feed(self, chunk):
+        # the items that the chunk completes
+        text = self.carry + chunk
+        a = np.frombuffer(text, dtype=np.uint8)
+        non_digits = np.flatnonzero((a < DIGIT_0) | (a > DIGIT_9))
+        cut = non_digits[-1] + 1 if len(non_digits) > 0 else 0
+        self.carry = text[cut:]
+        return self._parse(a[:cut])
+
+    def close(self):
+        items = self._parse(np.frombuffer(self.carry + b' ', dtype=np.uint8))
+        self.carry = b''
+        if self.depth != 0 or len(self.values) > 0:
+            raise ValueError('The array list text ends inside a list.')
+        return items
+
+    def _parse(self, a):
+        # the depth after every bracket, and at any other byte the depth after the last bracket before it
+        bracket_positions = np.flatnonzero((a == OPEN) | (a == CLOSE))
+        is_open = a[bracket_positions] == OPEN
+        bracket_depths = self.depth + np.cumsum(np.where(is_open, 1, -1))
+
+        levels = np.concatenate(([self.depth], bracket_depths))
+
+        def depth_at(positions):
+            return levels[np.searchsorted(bracket_positions, positions, side='right')]
+
+        # the numbers: the runs of digits, with the depth they are at
+        edges = np.diff(((a >= DIGIT_0) & (a <= DIGIT_9)).view(np.int8), prepend=np.int8(0), append=np.int8(0))
+        starts = np.flatnonzero(edges == 1)
+        lengths = np.flatnonzero(edges == -1) - starts
+        values = np.zeros(len(starts), dtype=np.int64)
+        for j in range(int(lengths.max()) if len(lengths) > 0 else 0):
+            inside = lengths > j
+            values[inside] = values[inside] * 10 + (a[starts[inside] + j] - DIGIT_0)
+        scalar = depth_at(starts) == 1
+        array_starts = starts[~scalar]
+        array_values = values[~scalar]
+
+        # an array item ends where a bracket closes back to the list, and a bare number is an item of its own
+        open_positions = bracket_positions[is_open]
+        open_depths = bracket_depths[is_open]
+        if len(open_depths) > 0 and open_depths.max() >= MAX_DEPTH:
+            raise ValueError(f'The array list text nests deeper than {MAX_DEPTH} brackets.')
+        events = [(int(p), None) for p in bracket_positions[~is_open & (bracket_depths == 1)]]
+        events += [(int(p), int(v)) for p, v in zip(starts[scalar], values[scalar])]
+        items = []
+        consumed_values = 0
+        consumed_opens = 0
+        for position, scalar_value in sorted(events):
+            if scalar_value is not None:
+                items.append(scalar_value)
+                continue
+            k = int(np.searchsorted(array_starts, position))
+            m = int(np.searchsorted(open_positions, position))
+            self.values.append(array_values[consumed_values:k])
+            self.opens += np.bincount(open_depths[consumed_opens:m], minlength=MAX_DEPTH)
+            consumed_values, consumed_opens = k, m
+            items.append(self._finish_array())
+        if consumed_values < len(array_values):
+            self.values.append(array_values[consumed_values:])
+        self.opens += np.bincount(open_depths[consumed_opens:], minlength=MAX_DEPTH)
+        if len(bracket_depths) > 0:
+            self.depth = int(bracket_depths[-1])
+        return items
+
+    def _finish_array(self):
+        # the shape of an array is the ratio of its brackets at every depth to the ones a depth above, and its values
+        # over the innermost brackets
+        values = np.concatenate(self.values)
+        depths = np.flatnonzero(self.opens[2:]) + 2
+        shape = [int(self.opens[d + 1] // self.opens[d]) for d in depths[:-1]] + [len(values) // int(self.opens[depths[-1]])]
+        if int(np.prod(shape)) != len(values):
+            raise ValueError(f'An array of {len(values)} values does not fill the shape {shape}.')
+        self.values = []
+        self.opens[:] = 0
+        return values.astype(self.dtype).reshape(shape)
+
+
+def literal(value):
+    # a cell of the outputs holds either the value itself or its str()
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+
+def excel_rows(path):
+    # the data rows of the Excel file, one dict (header to value) at a time
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = next(rows)
+        for values in rows:
+            if values[0] is not None:
+                yield dict(zip(headers, values))
+    finally:
+        workbook.close()
+
+
+def constants_of(row):
+    constants = {name: literal(row[column]) for name, column in LIST_CONSTANT_COLUMNS.items()}
+    constants['domain_name'] = row['01_f_domain_name']
+    constants['model_name'] = row['02_f_model_name']
+    return constants
+
+
+def policy_type_of(row):
+    # an empty policy type (a stochastic policy) is written as an empty cell, which reads back as None
+    return row['08_policy_type'] or ''
+
+
+def record_of(row, observations):
+    return {
+        'policy_type': policy_type_of(row),
+        'seed': int(literal(row['09_i_seed'])),
+        'execution_fault_mode': row['10_i_execution_fault_mode'],
+        'fault_probability': float(literal(row['11_i_fault_probability'])),
+        'instance': int(literal(row['12_i_instance'])),
+        'registered_actions': literal(row['13_O_registered_actions']),
+        'faulty_actions_indices': literal(row['14_O_faulty_actions_indices']),
+        'observations': observations,
+    }
+
+
+def cell_observations(cell, kind):
+    # the observations of a classic or tabular record, parsed from the str() of every observation, whether it is an
+    # np.array2string, a tuple or an int
+    strings = ast.literal_eval(cell)
+    text = ' '.join(strings).translate(str.maketrans('[](),', '     '))
+    if kind == 'tabular':
+        return np.array(text.split(), dtype=np.int64)
+    values = np.array(text.split(), dtype=np.float64)
+    if len(values) % len(strings) != 0:
+        raise ValueError(f'{len(values)} values do not split into {len(strings)} observations.')
+    return values.reshape(len(strings), -1)
+
+
+def archive_name_suffix(row):
+    return (f"_{policy_type_of(row)}_{int(literal(row['09_i_seed']))}_{row['10_i_execution_fault_mode']}_"
+            f"{float(literal(row['11_i_fault_probability']))}_{int(literal(row['12_i_instance']))}_obs.txt")
+
+
+def convert_atari_records(writer, rows, archive_path):
+    # writes the records of the rows, with the frames of their observation files, in archive order
+    rows_by_suffix = {archive_name_suffix(row): row for row in rows}
+    archive = SevenZipArchive(archive_path)
+    obs_names = [name for name in archive.names if name.endswith('_obs.txt')]
+    prefix = None
+    for suffix in rows_by_suffix:
+        if len(obs_names) > 0 and obs_names[0].endswith(suffix):
+            prefix = obs_names[0][:-len(suffix)]
+            break
+    for name, chunks in archive.files():
+        if not name.endswith('_obs.txt'):
+            continue
+        row = rows_by_suffix.pop(name[len(prefix):], None) if prefix is not None and name.startswith(prefix) else None
+        if row is None:
+            raise ValueError(f'{name} in {archive_path} has no row in its Excel file.')
+        parser = ArrayListTextParser()
+        observations = []
+        for chunk in chunks:
+            observations.extend(parser.feed(chunk))
+        observations.extend(parser.close())
+        if len(observations) != int(literal(row['19_O_num_observations_ie_exec_length'])):
+            raise ValueError(f'{name} in {archive_path} holds {len(observations)} observations instead of {row["19_O_num_observations_ie_exec_length"]}.')
+        writer.write(record_of(row, np.stack(observations)))
+    if len(rows_by_suffix) > 0:
+        raise ValueError(f'{len(rows_by_suffix)} rows have no observation file in {archive_path}.')
+
+
+def convert_file(task):
+    # converts one Excel file (and its archive) into a bundle
+    excel_path, bundle_path, compression = task
+    start_time = time.perf_counter()
+    rows = excel_rows(excel_path)
+    first_row = next(rows)
+    constants = constants_of(first_row)
+    kind = domains[constants['domain_name']].kind
+    archive_path = f"{excel_path[:-len('.xlsx')]}_obs_trajs.7z"
+    if kind == 'atari' and not os.path.exists(archive_path):
+        raise FileNotFoundError(f'The observations of {excel_path} are in {archive_path}, which does not exist.')
+
+    writer = BundleWriter(bundle_path, constants, compression)
+    try:
+        if kind == 'atari':
+            # the atari rows are small, as their observations are in the archive
+            convert_atari_records(writer, list(itertools.chain([first_row], rows)), archive_path)
+        else:
+            for row in itertools.chain([first_row], rows):
+                writer.write(record_of(row, cell_observations(row['15_O_observations'], kind)))
+    finally:
+        writer.close()
+    return excel_path, bundle_path, writer.num_records, time.perf_counter() - start_time
+
+
+def convert_outputs(excel_paths, num_workers=1, output_dir='outputs', compression=None):
+    # converts every Excel file into <output_dir>/<excel file name>_bundle, on num_workers worker processes
+    tasks = [(path, os.path.join(output_dir, f"{os.path.basename(path)[:-len('.xlsx')]}_bundle"), compression)
+             for path in excel_paths]
+    start_time = time.perf_counter()
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            results = []
+            for result in pool.imap(convert_file, tasks):
+                print(f"{result[0]}: {result[2]} records converted into {result[1]} in {result[3]:.1f}s")
+                results.append(result)
+    else:
+        results = []
+        for task in tasks:
+            result = convert_file(task)
+            print(f"{result[0]}: {result[2]} records converted into {result[1]} in {result[3]:.1f}s")
+            results.append(result)
+    print(f"{len(results)} files converted in {time.perf_counter() - start_time:.1f}s")
+    return [bundle_path for _, bundle_path, _, _ in results]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('excel_files', nargs='+', help='the published Excel files, e.g. outputs/i6000_Breakout-*.xlsx')
+    parser.add_argument('--workers', type=int, default=1, help='the number of worker processes (one Excel file each)')
+    parser.add_argument('--output-dir', default='outputs', help='the directory of the bundles (outputs by default)')
+    parser.add_argument('--compression', choices=['lzma'], help='compress the bundle columns')
+    args = parser.parse_args()
+
+    convert_outputs(args.excel_files, args.workers, args.output_dir, args.compression)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+
+from common.bundles import Bundle
+from common.consts import MAX_EXEC_LEN
+from common.domains import load_attribute
+
+# ### an evaluation harness of fault diagnosers (see common/diagnosers.py) over bundles. the records of every bundle are
+# ### diagnosed in chunks on a pool of worker processes, each of which creates its own diagnoser and reads only the
+# ### arrays of the chunk it diagnoses, and the results stream back in order. every record is scored against its
+# ### ground truth (its execution_fault_mode and faulty_actions_indices) and timed, and the report holds, overall, per
+# ### domain and per trajectory length bucket:
+# ###
+# ###       "fault_mode_accuracy"       - the fraction of the records whose fault mode is diagnosed correctly
+# ###       "precision", "recall", "f1" - of the diagnosed faulty actions, over all the records
+# ###       "exact_match"               - the fraction of the records whose faulty actions are all diagnosed exactly
+# ###       "first_fault_error"         - the mean distance between the diagnosed and the true first faulty action
+# ###       "latency"                   - the mean, median, 95th percentile and max seconds of a diagnosis
+# ###       "trajectories_per_sec"      - diagnoses per second of diagnosis time, and "steps_per_sec" likewise
+# ###
+# ### a diagnoser is named by its "module:class" path, e.g. common.diagnosers:ReplayDiagnoser
+
+# ### the width (in registered actions) of the trajectory length buckets of the report
+LENGTH_BUCKET_WIDTH = 50
+
+# ### the per-process state of the harness: the diagnoser factory and the prepared diagnoser and the open bundle of
+# ### every bundle path
+_diagnoser_path = None
+_diagnoser_kwargs = None
+_prepared = {}
+
+
+def init_worker(diagnoser_path, diagnoser_kwargs):
+    global _diagnoser_path, _diagnoser_kwargs
+    _diagnoser_path = diagnoser_path
+    _diagnoser_kwargs = diagnoser_kwargs
+    _prepared.clear()
+
+
+def prepared_bundle(path):
+    if path not in _prepared:
+        bundle = Bundle(path)
+        diagnoser = load_attribute(_diagnoser_path)(**_diagnoser_kwargs)
+        diagnoser.prepare(bundle.constants)
+        _prepared[path] = (bundle, diagnoser)
+    return _prepared[path]
+
+
+def score(diagnosis, fault_mode, faulty_actions_indices):
+    # the scores of a diagnosis against the ground truth, None for the keys that the diagnosis leaves out
+    result = {'fault_mode_correct': None, 'true_positives': None, 'false_positives': None, 'false_negatives': None,
+              'exact_match': None, 'first_fault_error': None}
+    if 'fault_mode' in diagnosis:
+        result['fault_mode_correct'] = diagnosis['fault_mode'] == fault_mode
+    if 'faulty_actions_indices' in diagnosis:
+        diagnosed = set(int(i) for i in diagnosis['faulty_actions_indices'])
+        true = set(int(i) for i in faulty_actions_indices)
+        result['true_positives'] = len(diagnosed & true)
+        result['false_positives'] = len(diagnosed - true)
+        result['false_negatives'] = len(true - diagnosed)
+        result['exact_match'] = diagnosed == true
+        if len(diagnosed) > 0 and len(true) > 0:
+            result['first_fault_error'] = abs(min(diagnosed) - min(true))
+    return result
+
+
+def diagnose_chunk(task):
+    # the scored and timed diagnoses of the records indices of the bundle at path
+    path, indices = task
+    bundle, diagnoser = prepared_bundle(path)
+    results = []
+    for i in indices:
+        record = bundle.record(i)
+        observations = bundle.observations(i)
+        registered_actions = bundle.registered_actions(i)
+        start = time.perf_counter()
+        diagnosis = diagnoser.diagnose(observations, registered_actions)
+        latency = time.perf_counter() - start
+        result = score(diagnosis, record['execution_fault_mode'], bundle.faulty_actions_indices(i).tolist())
+        result.update({
+            'bundle': path,
+            'record': i,
+            'domain_name': record['domain_name'],
+            'execution_fault_mode': record['execution_fault_mode'],
+            'num_registered_actions': record['num_registered_actions'],
+            'latency': latency,
+        })
+        results.append(result)
+    return results
+
+
+def summarize(results):
+    summary = {'num_records': len(results)}
+    if len(results) == 0:
+        return summary
+    fault_mode_scores = [r['fault_mode_correct'] for r in results if r['fault_mode_correct'] is not None]
+    if len(fault_mode_scores) > 0:
+        summary['fault_mode_accuracy'] = float(np.mean(fault_mode_scores))
+    scored = [r for r in results if r['true_positives'] is not None]
+    if len(scored) > 0:
+        true_positives = sum(r['true_positives'] for r in scored)
+        false_positives = sum(r['false_positives'] for r in scored)
+        false_negatives = sum(r['false_negatives'] for r in scored)
+        precision = true_positives / (true_positives + false_positives) if true_positives + false_positives > 0 else 0.0
+        recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives > 0 else 0.0
+        summary['precision'] = precision
+        summary['recall'] = recall
+        summary['f1'] = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+        summary['exact_match'] = float(np.mean([r['exact_match'] for r in scored]))
+        first_fault_errors = [r['first_fault_error'] for r in scored if r['first_fault_error'] is not None]
+        if len(first_fault_errors) > 0:
+            summary['first_fault_error'] = float(np.mean(first_fault_errors))
+    latencies = np.array([r['latency'] for r in results])
+    steps = sum(r['num_registered_actions'] for r in results)
+    summary['latency'] = {
+        'mean': float(latencies.mean()),
+        'median': float(np.median(latencies)),
+        'p95': float(np.percentile(latencies, 95)),
+        'max': float(latencies.max()),
+    }
+    summary['trajectories_per_sec'] = len(results) / latencies.sum() if latencies.sum() > 0 else None
+    summary['steps_per_sec'] = steps / latencies.sum() if latencies.sum() > 0 else None
+    return summary
+
+
+def length_bucket(num_registered_actions):
+    # the first trajectory length of the bucket of num_registered_actions
+    return (num_registered_actions - 1) // LENGTH_BUCKET_WIDTH * LENGTH_BUCKET_WIDTH + 1
+
+
+def length_bucket_name(low):
+    return f'{low}-{min(low + LENGTH_BUCKET_WIDTH - 1, MAX_EXEC_LEN - 1)}'
+
+
+def grouped_summaries(results, key, name=str):
+    # the summaries of the groups of the results with the same key, in the order of the keys
+    groups = {}
+    for r in results:
+        groups.setdefault(key(r), []).append(r)
+    return {name(group_key): summarize(groups[group_key]) for group_key in sorted(groups)}
+
+
+def evaluate_diagnoser(diagnoser_path, bundle_paths, num_workers=1, chunk_size=64, diagnoser_kwargs=None, conditions=None, output_path=None):
+    # diagnoses the records of the bundles that meet the conditions of Bundle.query (all of them without conditions)
+    # and writes the report, with the results of every record, to output_path (outputs/evaluation_<time>.json by
+    # default)
+    diagnoser_kwargs = diagnoser_kwargs if diagnoser_kwargs is not None else {}
+    tasks = []
+    for path in bundle_paths:
+        bundle = Bundle(path)
+        indices = [instance.i for instance in bundle.query(**(conditions or {}))]
+        tasks.extend((path, indices[start:start + chunk_size]) for start in range(0, len(indices), chunk_size))
+
+    start_time = time.perf_counter()
+    results = []
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers, initializer=init_worker, initargs=(diagnoser_path, diagnoser_kwargs)) as pool:
+            for chunk_results in pool.imap(diagnose_chunk, tasks):
+                results.extend(chunk_results)
+    else:
+        init_worker(diagnoser_path, diagnoser_kwargs)
+        for task in tasks:
+            results.extend(diagnose_chunk(task))
+    wall_seconds = time.perf_counter() - start_time
+
+    report = {
+        'diagnoser': diagnoser_path,
+        'diagnoser_kwargs': diagnoser_kwargs,
+        'bundles': list(bundle_paths),
+        'conditions': conditions,
+        'num_workers': num_workers,
+        'wall_seconds': wall_seconds,
+        'wall_trajectories_per_sec': len(results) / wall_seconds if wall_seconds > 0 else None,
+        'summary': summarize(results),
+        'domains': grouped_summaries(results, lambda r: r['domain_name']),
+        'lengths': grouped_summaries(results, lambda r: length_bucket(r['num_registered_actions']), length_bucket_name),
+        'results': results,
+    }
+    if output_path is None:
+        output_path = f"outputs/evaluation_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    summary = report['summary']
+    print(f"{summary['num_records']} records diagnosed by {diagnoser_path} in {wall_seconds:.1f}s, report in {output_path}")
+    print(json.dumps(summary, indent=1))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bundles', nargs='+', help='the bundle directories, e.g. outputs/i2000_CartPole_bundle')
+    parser.add_argument('--diagnoser', default='common.diagnosers:ReplayDiagnoser', help='the "module:class" path of the diagnoser')
+    parser.add_argument('--diagnoser-kwargs', default='{}', help='the keyword arguments of the diagnoser, as a json object')
+    parser.add_argument('--where', default='{}', help='the conditions of Bundle.query that select the records, as a json object, e.g. {"num_faulty_actions": {"low": 5}}')
+    parser.add_argument('--workers', type=int, default=1, help='the number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=64, help='the number of records that a worker diagnoses at a time')
+    parser.add_argument('--output', help='the report file (outputs/evaluation_<time>.json by default)')
+    args = parser.parse_args()
+
+    # a {"low": ..., "high": ...} object is a range condition
+    conditions = {name: (value.get('low'), value.get('high')) if isinstance(value, dict) else value
+                  for name, value in json.loads(args.where).items()}
+    evaluate_diagnoser(args.diagnoser, args.bundles, args.workers, args.chunk_size, json.loads(args.diagnoser_kwargs), conditions, args.output)
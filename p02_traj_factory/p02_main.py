@@ -1,9 +1,8 @@
+import argparse
 import sys
 import time
 
-from pygame import mixer  # Load the popular external library
-
-from p02_traj_factory import generate_trajectories
+from p02_traj_factory import generate_trajectories, merge_shards
 
 if __name__ == '__main__':
     # ================== default arguments ===================
@@ -20,8 +19,81 @@ if __name__ == '__main__':
 
     filename = "i1000_Acrobot.json"
 
+    # number of worker processes that execute the grid cells (1 runs them serially in this process)
+    num_workers = 1
+
+    # number of grid cells that are executed in lockstep with one batched policy call per step (1 executes every
+    # cell on its own)
+    batch_size = 1
+
+    # how an execution with at least one faulty action is obtained:
+    #
+    #           "retry"         - rerun the execution until a fault happens
+    #           "conditional"   - draw the first fault conditioned on there being one, so the first or second
+    #                             execution is kept (falls back to "retry" for non-reproducible policies)
+    #
+    fault_sampling = "retry"
+
+    # simulate the fault free execution of every seed once, and branch each grid cell off it at its first faulty
+    # action (classic domains with a deterministic policy; takes the place of batch_size)
+    branching = False
+
+    # output formats to write the records to:
+    #
+    #           "excel"         - the xlsx table (plus an atari observation store for Breakout and Pong)
+    #           "bundle"        - a directory of memory mappable binary columns, loaded with common.bundles.Bundle
+    #
+    output_formats = ["excel"]
+
+    # write the records in the background while the next ones are generated:
+    #
+    #           None            - write each record in the generation loop
+    #           "thread"        - a writer thread, which shares the records with the generation loop
+    #           "process"       - a writer process, which gets a copy of every record but does not compete for the GIL
+    #
+    background_writer = None
+
+    # compress the bundle columns and the atari observation stores as they are written ("lzma", or None for raw files
+    # that are memory mapped when they are read)
+    compression = None
+
+    # directory of the finished grid cells, so that an interrupted or extended run only generates the missing cells
+    # (None disables the cache, e.g. "outputs/cell_cache")
+    cache_dir = None
+
+    # run the Breakout and Pong policy in one inference server process that batches the observations of all the
+    # workers, instead of loading it in every worker (only with num_workers > 1)
+    inference_server = False
+
+    # instrumentation of the run:
+    #
+    #           None            - no instrumentation
+    #           "timers"        - the time of every phase (env creation, model load, predict, env step, writing, ...)
+    #                             and counters (env steps, predicts, retries, bytes written) in outputs/*_profile.json
+    #           "cprofile"      - "timers", plus a cProfile of the main process in outputs/*_profile.prof
+    #
+    profile = None
+
+    # split the grid over several machines: every machine runs this script with --shard i/N (i = 1..N) and the same
+    # batch_size and branching, and writes the bundle of its share of the cells. --merge N then puts the N shard bundles
+    # together into the outputs of the whole grid, the same ones as a single run over it, in the formats of
+    # merge_output_formats (a single bundle; add "excel" for the xlsx table too)
+    merge_output_formats = ["bundle"]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard', help='generate only shard i of N of the grid cells, given as i/N')
+    parser.add_argument('--merge', type=int, help='merge the bundles of N shards into the outputs of the grid')
+    args = parser.parse_args()
+
     # ================== experimental setup ==================
 
-    generate_trajectories(filename=filename)
+    if args.merge is not None:
+        merge_shards(filename=filename, num_shards=args.merge, output_formats=merge_output_formats, compression=compression, background_writer=background_writer)
+    else:
+        shard = None
+        if args.shard is not None:
+            shard = tuple(int(part) for part in args.shard.split('/'))
+            if len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+                parser.error(f'--shard takes i/N with 1 <= i <= N, not {args.shard}')
+        generate_trajectories(filename=filename, num_workers=num_workers, batch_size=batch_size, fault_sampling=fault_sampling, branching=branching, output_formats=output_formats, cache_dir=cache_dir, inference_server=inference_server, shard=shard, profile=profile, background_writer=background_writer, compression=compression)
 
     print("End of trajectory generation.")
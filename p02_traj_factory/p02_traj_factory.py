@@ -1,12 +1,27 @@
 import json
+import collections
+import cProfile
+import hashlib
+import itertools
+import multiprocessing
+import random
+import time
 from datetime import datetime
 import numpy as np
 import xlsxwriter
 import base64
 import pickle
 
+from common import profiling
+from common.atari_store import AtariObservationStoreWriter
+from common.background_writer import BackgroundRecordWriter
+from common.bundles import Bundle, BundleWriter
+from common.cell_cache import CellCache, code_model_hash
 from common.fault_mode_generators import FaultModeGeneratorDiscrete
-from common.executor import execute
+from common.inference_server import InferenceServer, connect
+from common.domains import domains, ATARI_DOMAINS, TABULAR_DOMAINS
+from common.trajectory import Trajectory
+from common.executor import execute, execute_batch, execute_nominal, execute_branch, acquire_env, get_policy, set_policy, release_env, is_deterministic_policy, is_invariant_execution, forced_fault_trigger
 
 
 def read_json_data(params_file):
@@ -15,18 +30,44 @@ def read_json_data(params_file):
     return json_data
 
 
-# separating trajectory to actions and states
-def separate_trajectory(trajectory_execution):
-    registered_actions = []
-    observations = []
-    for i in range(len(trajectory_execution)):
-        if i % 2 == 1:
-            registered_actions.append(trajectory_execution[i])
-        else:
-            observations.append(trajectory_execution[i])
-    if len(registered_actions) == len(observations):
-        registered_actions = registered_actions[:-1]
-    return registered_actions, observations
+def cell_rng(domain_name, model_name, cell):
+    # ### the random generator of a grid cell, seeded from its grid coordinates alone. every random draw of the cell (its
+    # ### fault triggers, its stochastic actions and its conditional first fault) comes from it, so the cell has the same
+    # ### execution whatever other cells run before it, next to it or on another machine
+    policy_type, seed, execution_fault_mode, fault_probability, instance = cell
+    fields = [domain_name, model_name, policy_type, seed, execution_fault_mode, float(fault_probability), instance]
+    return random.Random(int(hashlib.sha256(json.dumps(fields).encode()).hexdigest()[:16], 16))
+
+
+def sample_first_fault_number(changed_actions, fault_probability, rng=random):
+    # ### the first faulty action of an execution that follows a fault free one up to it. only the actions of the fault
+    # ### free execution that the fault mode changes (changed_actions) can fail, and the j-th of them is the first failure
+    # ### with probability p * (1 - p) ** j. normalizing these weights conditions the execution on having a faulty action.
+    # ### the candidates are action numbers of the fault free execution, so the drawn action is never past its length
+    # ### and the execution that follows it always fails there
+    candidates = (np.flatnonzero(changed_actions) + 1).tolist()
+    if len(candidates) == 0 or fault_probability <= 0:
+        raise ValueError('The fault mode cannot fail any action of the fault free execution.')
+    weights = [fault_probability * (1 - fault_probability) ** j for j in range(len(candidates))]
+    return rng.choices(candidates, weights=weights)[0]
+
+
+def draw_first_fault_number(changed_actions, fault_probability, rng=random):
+    # ### the first faulty action of a single execution that follows a fault free one up to it, drawn without simulating
+    # ### it. None when the whole execution stays fault free
+    for i, changed in enumerate(changed_actions.tolist()):
+        if rng.random() < fault_probability and changed:
+            return i + 1
+    return None
+
+
+def conditional_fault_trigger(trajectory, execution_fault_mode, fault_probability, fault_mode_generator, rng=random):
+    # ### an execution without faulty actions is the fault free execution of its seed, which a deterministic policy
+    # ### reproduces exactly. the next execution follows it up to a first faulty action that is drawn conditioned on
+    # ### there being one, so it is distributed like the first faulty execution of the retry loop
+    changed_actions = fault_mode_generator.changed_actions(execution_fault_mode, trajectory.actions)
+    first_fault_number = sample_first_fault_number(changed_actions, fault_probability, rng)
+    return forced_fault_trigger(fault_probability, first_fault_number, rng)
 
 
 def generate_trajectory(domain_name,
@@ -34,41 +75,211 @@ def generate_trajectory(domain_name,
                         policy_type,
                         seed,
                         execution_fault_mode,
-                        fault_probability):
+                        fault_probability,
+                        fault_sampling='retry',
+                        rng=random):
     # ### initialize fault model generator
     fault_mode_generator = FaultModeGeneratorDiscrete()
+    conditional = fault_sampling == 'conditional' and is_deterministic_policy(policy_type)
 
     # ### execute to get trajectory
     print(f'executing with fault mode: {execution_fault_mode}\n========================================================================================')
-    trajectory_execution = []
+    trajectory = None
     faulty_actions_indices = []
+    fault_trigger = None
     num_tries = 1
     while len(faulty_actions_indices) == 0:
         if num_tries > 100:
             raise ValueError('Tried too hard but didnt get a faulty traj.')
         print(f"try {num_tries}")
-        trajectory_execution, faulty_actions_indices = execute(domain_name,
-                                                               model_name,
-                                                               policy_type,
-                                                               seed,
-                                                               execution_fault_mode,
-                                                               fault_probability,
-                                                               fault_mode_generator)
+        trajectory, faulty_actions_indices = execute(domain_name,
+                                                     model_name,
+                                                     policy_type,
+                                                     seed,
+                                                     execution_fault_mode,
+                                                     fault_probability,
+                                                     fault_mode_generator,
+                                                     fault_trigger,
+                                                     rng)
+        if len(faulty_actions_indices) == 0 and conditional:
+            fault_trigger = conditional_fault_trigger(trajectory, execution_fault_mode, fault_probability, fault_mode_generator, rng)
+        num_tries += 1
+
+    # ### every execution but the last one was thrown away. with conditional sampling this is at most the fault free
+    # ### execution that the first faulty action was drawn from
+    num_wasted_rollouts = num_tries - 2
+
+    return trajectory, num_wasted_rollouts
+
+
+def generate_trajectory_batch(domain_name,
+                              model_name,
+                              cells,
+                              fault_sampling='retry'):
+    # ### lockstep counterpart of generate_trajectory for (policy_type, seed, execution_fault_mode, fault_probability,
+    # ### instance) cells that share their policy type. a cell whose execution had no faulty action is executed again
+    # ### together with the other unfinished cells in the next try
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    policy_type = cells[0][0]
+    conditional = fault_sampling == 'conditional' and is_deterministic_policy(policy_type)
+    rngs = [cell_rng(domain_name, model_name, cell) for cell in cells]
+
+    results = [None] * len(cells)
+    fault_triggers = [None] * len(cells)
+    pending = list(range(len(cells)))
+    num_tries = 1
+    while len(pending) > 0:
+        if num_tries > 100:
+            raise ValueError('Tried too hard but didnt get a faulty traj.')
+        print(f"batch try {num_tries}: {len(pending)} executions")
+        executions = execute_batch(domain_name,
+                                   model_name,
+                                   policy_type,
+                                   [cells[i][1:4] for i in pending],
+                                   fault_mode_generator,
+                                   [fault_triggers[i] for i in pending],
+                                   [rngs[i] for i in pending])
+        still_pending = []
+        for i, (trajectory, faulty_actions_indices) in zip(pending, executions):
+            if len(faulty_actions_indices) == 0:
+                if conditional:
+                    fault_triggers[i] = conditional_fault_trigger(trajectory, cells[i][2], cells[i][3], fault_mode_generator, rngs[i])
+                still_pending.append(i)
+            else:
+                results[i] = (trajectory, num_tries - 1)
+        pending = still_pending
         num_tries += 1
 
-    # ### separating trajectory to actions and states
-    registered_actions, observations = separate_trajectory(trajectory_execution)
+    return results
+
 
-    # ### make sure the last faulty action was not an action that was removed
-    if faulty_actions_indices[-1] > len(registered_actions):
-        faulty_actions_indices = faulty_actions_indices[:-1]
+def generate_trajectory_branches(domain_name,
+                                 model_name,
+                                 cells,
+                                 fault_sampling='retry'):
+    # ### branching counterpart of generate_trajectory for cells that share their policy type and seed. the fault free
+    # ### execution of the seed is simulated once with a checkpoint before every action, and each cell resumes it from
+    # ### the checkpoint before its first faulty action. a cell only shares the prefix when the policy reproduces it
+    policy_type, seed = cells[0][:2]
+    if domain_name in TABULAR_DOMAINS:
+        # ### the tabular engine simulates all the cells of the seed at once, faster than they resume from checkpoints
+        return generate_trajectory_batch(domain_name, model_name, cells, fault_sampling)
+    if domain_name in ATARI_DOMAINS or not is_deterministic_policy(policy_type):
+        return [generate_trajectory(domain_name, model_name, *cell[:4], fault_sampling, cell_rng(domain_name, model_name, cell)) for cell in cells]
 
-    return registered_actions, faulty_actions_indices, observations, trajectory_execution
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    print(f'executing the fault free execution of seed {seed}\n========================================================================================')
+    nominal_trajectory, nominal_checkpoints = execute_nominal(domain_name, model_name, policy_type, seed, cells[0][2], fault_mode_generator)
+    nominal_actions = nominal_trajectory.actions
+
+    results = []
+    for cell in cells:
+        policy_type, seed, execution_fault_mode, fault_probability, instance = cell
+        rng = cell_rng(domain_name, model_name, cell)
+        changed_actions = fault_mode_generator.changed_actions(execution_fault_mode, nominal_actions)
+        # ### the draws of the retry loop need no simulation here, as every fault free execution is the nominal one
+        if fault_sampling == 'conditional':
+            first_fault_number = sample_first_fault_number(changed_actions, fault_probability, rng)
+        else:
+            first_fault_number = None
+            num_tries = 1
+            while first_fault_number is None:
+                if num_tries > 100:
+                    raise ValueError('Tried too hard but didnt get a faulty traj.')
+                first_fault_number = draw_first_fault_number(changed_actions, fault_probability, rng)
+                num_tries += 1
+        print(f'branching with fault mode: {execution_fault_mode} at action {first_fault_number}')
+        trajectory, _ = execute_branch(domain_name,
+                                       model_name,
+                                       policy_type,
+                                       seed,
+                                       execution_fault_mode,
+                                       fault_probability,
+                                       fault_mode_generator,
+                                       nominal_trajectory,
+                                       nominal_checkpoints,
+                                       first_fault_number,
+                                       rng)
+        results.append((trajectory, 0))
+
+    return results
+
+
+def generate_cells(domain_name, model_name, cells, fault_sampling, branching):
+    with profiling.phase('generate'):
+        if branching:
+            return generate_trajectory_branches(domain_name, model_name, cells, fault_sampling)
+        if len(cells) == 1:
+            return [generate_trajectory(domain_name, model_name, *cells[0][:4], fault_sampling, cell_rng(domain_name, model_name, cells[0]))]
+        return generate_trajectory_batch(domain_name, model_name, cells, fault_sampling)
+
+
+def split_to_batches(cells, batch_size, branching):
+    # ### consecutive runs of at most batch_size cells that share their policy type, or all the cells of a seed when
+    # ### branching
+    batches = []
+    if branching:
+        for _, seed_cells in itertools.groupby(cells, key=lambda cell: cell[:2]):
+            batches.append(list(seed_cells))
+        return batches
+    for policy_type, policy_cells in itertools.groupby(cells, key=lambda cell: cell[0]):
+        policy_cells = list(policy_cells)
+        for i in range(0, len(policy_cells), batch_size):
+            batches.append(policy_cells[i:i + batch_size])
+    return batches
+
+
+# ### per-process state of the generation (of a parallel worker, or of the main process in a serial run)
+_worker_context = {}
+
+
+def init_context(domain_name, model_name, fault_sampling, branching, inference_client=None):
+    _worker_context['domain_name'] = domain_name
+    _worker_context['model_name'] = model_name
+    _worker_context['fault_sampling'] = fault_sampling
+    _worker_context['branching'] = branching
+    # with an inference server, the worker only steps its envs and the server runs the policy
+    if inference_client is not None:
+        set_policy(domain_name, model_name, connect(inference_client))
+    # warm the executor caches, so that the process creates its env and loads its model exactly once
+    env = acquire_env(domain_name)
+    get_policy(domain_name, model_name, env)
+    release_env(domain_name, env)
+
+
+def set_inference_threads(num_threads):
+    # ### sets the number of threads that run the policy network, and returns the previous number
+    import torch
+    previous_num_threads = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    return previous_num_threads
+
+
+def init_worker(domain_name, model_name, fault_sampling, branching, inference_client=None, profile=False):
+    # the pool already keeps every core busy, so each worker runs the policy network on a single thread
+    set_inference_threads(1)
+    if profile:
+        profiling.enable()
+    init_context(domain_name, model_name, fault_sampling, branching, inference_client)
+
+
+def generate_worker_cells(cells):
+    # ### the results of the cells, and the profiling statistics that the worker recorded since its last batch
+    results = generate_cells(_worker_context['domain_name'], _worker_context['model_name'], cells, _worker_context['fault_sampling'], _worker_context['branching'])
+    return results, profiling.take()
+
+
+def merge_worker_statistics(worker_results):
+    # ### the cell results of the workers, whose profiling statistics are added to those of this process
+    for results, stats in worker_results:
+        profiling.merge(stats)
+        yield results
 
 
 def prepare_record(domain_name, model_name, policy_types, seeds, modelled_fault_modes, fault_probabilities, instances,
                    policy_type, seed, execution_fault_mode, fault_probability, instance,
-                   registered_actions, faulty_actions_indices, observations, trajectory_execution):
+                   trajectory):
+    # ### the output fields are views of the trajectory buffers, not copies of them
     record = {
         "domain_name": domain_name,
         "model_name": model_name,
@@ -82,64 +293,76 @@ def prepare_record(domain_name, model_name, policy_types, seeds, modelled_fault_
         "execution_fault_mode": execution_fault_mode,
         "fault_probability": fault_probability,
         "instance": instance,
-        "registered_actions": registered_actions,
-        "faulty_actions_indices": faulty_actions_indices,
-        "observations": observations,
-        "trajectory_execution": trajectory_execution
+        "registered_actions": trajectory.actions,
+        "faulty_actions_indices": trajectory.faulty_actions_indices,
+        "observations": trajectory.observations,
+        "trajectory_execution": trajectory.interleaved
     }
     return record
 
 
-def full_ndarray_list_to_string(array_list):
-    # Set printing options to avoid clipping
-    np.set_printoptions(threshold=np.inf, linewidth=np.inf, suppress=False)
-
-    strings = []
-    for i, arr in enumerate(array_list):
-        if isinstance(arr, int):
-            strings.append(f"{arr}")
+EXCEL_COLUMNS = [
+    {'header': '01_f_domain_name'},
+    {'header': '02_f_model_name'},
+    {'header': '03_f_policy_types'},
+    {'header': '04_f_seeds'},
+    {'header': '05_f_modelled_fault_modes'},
+    {'header': '06_f_fault_probabilities'},
+    {'header': '07_f_instances'},
+    {'header': '08_policy_type'},
+    {'header': '09_i_seed'},
+    {'header': '10_i_execution_fault_mode'},
+    {'header': '11_i_fault_probability'},
+    {'header': '12_i_instance'},
+    {'header': '13_O_registered_actions'},
+    {'header': '14_O_faulty_actions_indices'},
+    {'header': '15_O_observations'},
+    {'header': '16_O_trajectory_execution'},
+    {'header': '17_O_num_registered_actions'},
+    {'header': '18_O_num_faulty_actions'},
+    {'header': '19_O_num_observations_ie_exec_length'},
+]
+
+
+def observation_texts(domain_name, observations):
+    # ### the str() of every observation of a classic or tabular record, as its env held it: the first one comes from a
+    # ### reset, the others from steps
+    wrapper = domains[domain_name].load('wrapper')
+    return [wrapper.state_text(obs, i == 0) for i, obs in enumerate(observations)]
+
+
+def trajectory_execution_texts(observation_strings, actions):
+    # ### the observation strings interleaved with the str() of the registered actions
+    texts = [observation_strings[0]]
+    for action, observation_string in zip(actions.tolist(), observation_strings[1:]):
+        texts.extend([str(action), observation_string])
+    return texts
+
+
+class ExcelRecordWriter:
+    # ### writes every record to the Excel file as soon as it is produced. the workbook runs in constant memory mode,
+    # ### which flushes each row to disk and keeps none of them in memory. the records are still an Excel table as in the
+    # ### published files: its range is only known once the last record is written, so close adds it. the Breakout and
+    # ### Pong observations, which do not fit in a cell, go to an atari observation store next to the Excel file, in
+    # ### record order, and their cells keep the "IN ZIP FILE" of the published files
+    def __init__(self, filename, compression=None):
+        self.filename = filename
+        self.compression = compression
+        self.workbook = xlsxwriter.Workbook(f"outputs/{filename}.xlsx", {'constant_memory': True})
+        self.worksheet = self.workbook.add_worksheet('results')
+        self.worksheet.write_row(0, 0, [column['header'] for column in EXCEL_COLUMNS])
+        self.observation_store = None
+        self.num_records = 0
+
+    def write(self, record_i):
+        print(f"rec {self.num_records}: {record_i['policy_type']}_{record_i['seed']}_{record_i['execution_fault_mode']}_{float(record_i['fault_probability'])}_{record_i['instance']}")
+        if record_i['domain_name'] in ATARI_DOMAINS:
+            if self.observation_store is None:
+                self.observation_store = AtariObservationStoreWriter(f"outputs/{self.filename}_observations", self.compression)
+            self.observation_store.append(record_i['observations'])
+            store_string = "IN ZIP FILE"
         else:
-            arr_str = np.array2string(arr)
-            strings.append(f"{arr_str}")
-
-    joined = ',\n'.join(strings)
-    ret = f'[{joined}]'
-    return ret
-
-def write_records_to_excel(records, filename):
-    columns = [
-        {'header': '01_f_domain_name'},
-        {'header': '02_f_model_name'},
-        {'header': '03_f_policy_types'},
-        {'header': '04_f_seeds'},
-        {'header': '05_f_modelled_fault_modes'},
-        {'header': '06_f_fault_probabilities'},
-        {'header': '07_f_instances'},
-        {'header': '08_policy_type'},
-        {'header': '09_i_seed'},
-        {'header': '10_i_execution_fault_mode'},
-        {'header': '11_i_fault_probability'},
-        {'header': '12_i_instance'},
-        {'header': '13_O_registered_actions'},
-        {'header': '14_O_faulty_actions_indices'},
-        {'header': '15_O_observations'},
-        {'header': '16_O_trajectory_execution'},
-        {'header': '17_O_num_registered_actions'},
-        {'header': '18_O_num_faulty_actions'},
-        {'header': '19_O_num_observations_ie_exec_length'},
-    ]
-    rows = []
-    for i in range(len(records)):
-        record_i = records[i]
-        print(f"rec {i}: {record_i['policy_type']}_{record_i['seed']}_{record_i['execution_fault_mode']}_{float(record_i['fault_probability'])}_{record_i['instance']}")
-        np.set_printoptions(threshold=np.inf, linewidth=np.inf, suppress=False)
-        if record_i['domain_name'] in ['Breakout_v4', 'PongNoFrameskip_v0']:
-            obs_string = full_ndarray_list_to_string(record_i['observations'])
-            with open(f"outputs/{filename}_{record_i['policy_type']}_{record_i['seed']}_{record_i['execution_fault_mode']}_{float(record_i['fault_probability'])}_{record_i['instance']}_obs.txt", "w") as f:
-                f.write(obs_string)
-            traj_string = full_ndarray_list_to_string(record_i['trajectory_execution'])
-            with open(f"outputs/{filename}_{record_i['policy_type']}_{record_i['seed']}_{record_i['execution_fault_mode']}_{float(record_i['fault_probability'])}_{record_i['instance']}_traj.txt", "w") as f:
-                f.write(traj_string)
+            observation_strings = observation_texts(record_i['domain_name'], record_i['observations'])
         row = [
             record_i['domain_name'],                                    # 01_f_domain_name
             record_i['model_name'],                                     # 02_f_model_name
@@ -153,28 +376,166 @@ def write_records_to_excel(records, filename):
             record_i['execution_fault_mode'],                           # 10_i_execution_fault_mode
             float(record_i['fault_probability']),                       # 11_i_fault_probability
             record_i['instance'],                                       # 12_i_instance
-            str(record_i['registered_actions']),                        # 13_O_registered_actions
+            str(record_i['registered_actions'].tolist()),               # 13_O_registered_actions
             str(record_i['faulty_actions_indices']),                    # 14_O_faulty_actions_indices
-            str([str(obs) for obs in record_i['observations']]) if record_i['domain_name'] not in ['Breakout_v4', 'PongNoFrameskip_v0'] else "IN ZIP FILE",        # 15_O_observations
-            str([str(m) for m in record_i['trajectory_execution']]) if record_i['domain_name'] not in ['Breakout_v4', 'PongNoFrameskip_v0'] else "IN ZIP FILE",    # 16_O_trajectory_execution
+            str(observation_strings) if record_i['domain_name'] not in ATARI_DOMAINS else store_string,        # 15_O_observations
+            str(trajectory_execution_texts(observation_strings, record_i['registered_actions'])) if record_i['domain_name'] not in ATARI_DOMAINS else store_string,    # 16_O_trajectory_execution
             len(record_i['registered_actions']),                        # 17_O_num_registered_actions
             len(record_i['faulty_actions_indices']),                    # 18_O_num_faulty_actions
             len(record_i['observations'])                               # 19_O_num_observations_ie_exec_length
         ]
-        rows.append(row)
-    workbook = xlsxwriter.Workbook(f"outputs/{filename}.xlsx")
-    worksheet = workbook.add_worksheet('results')
-    worksheet.add_table(0, 0, len(rows), len(columns) - 1, {'data': rows, 'columns': columns})
-    workbook.close()
+        self.num_records += 1
+        self.worksheet.write_row(self.num_records, 0, row)
+
+    def flush(self):
+        # rows are already on disk, the xlsx file itself is only assembled on close
+        if self.observation_store is not None:
+            self.observation_store.flush()
+
+    def close(self):
+        # xlsxwriter refuses add_table in constant memory mode, yet it only writes the table part when the workbook
+        # closes. the header row is already on disk, so the header cells that add_table writes again are dropped
+        self.worksheet.constant_memory = False
+        self.worksheet.add_table(0, 0, self.num_records, len(EXCEL_COLUMNS) - 1, {'columns': EXCEL_COLUMNS})
+        self.worksheet.constant_memory = True
+        self.workbook.close()
+        if self.observation_store is not None:
+            self.observation_store.close()
+
+
+def write_records_to_excel(records, filename):
+    writer = ExcelRecordWriter(filename)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+
+def write_records_to_bundle(records, filename):
+    # ### binary counterpart of write_records_to_excel, read back with common.bundles.Bundle
+    writer = BundleWriter(f"outputs/{filename}_bundle", records[0])
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+
+def grid_cells(param_dict):
+    # ### the grid cells in the order of the nested policy_type, seed, fault mode, probability and instance loops
+    cells = []
+    for policy_type in param_dict['policy_types']:
+        for seed in param_dict['seeds']:
+            for execution_fault_mode in param_dict['modelled_fault_modes']:
+                for fault_probability in param_dict['fault_probabilities']:
+                    for instance in param_dict['instances']:
+                        cells.append((policy_type, seed, execution_fault_mode, fault_probability, instance))
+    return cells
+
+
+def shard_name(name, shard):
+    shard_number, num_shards = shard
+    return f"{name}_shard_{shard_number}_of_{num_shards}"
+
+
+def record_writers(name, param_dict, output_formats, compression=None):
+    # ### the record writers, which get every record as soon as it is produced. compression ("lzma" or None) compresses
+    # ### the bundle columns and the atari observation stores as they are written
+    writers = []
+    if 'excel' in output_formats:
+        writers.append(ExcelRecordWriter(name, compression))
+    if 'bundle' in output_formats:
+        writers.append(BundleWriter(f"outputs/{name}_bundle", param_dict, compression))
+    return writers
+
+
+def open_record_writers(name, param_dict, output_formats, compression=None, background_writer=None):
+    # ### the record writers, or a single writer that drives them in a background thread or process (background_writer
+    # ### "thread" or "process")
+    if background_writer is None:
+        return record_writers(name, param_dict, output_formats, compression)
+    return [BackgroundRecordWriter(record_writers, (name, param_dict, output_formats, compression), background_writer)]
+
+
+def memoized_cells(cells):
+    # ### the cells that repeat the execution of an earlier cell: every instance after the first of a cell whose
+    # ### execution cannot vary between its instances (see is_invariant_execution), mapped to the first instance
+    firsts = {}
+    copies = {}
+    for cell in cells:
+        policy_type, seed, execution_fault_mode, fault_probability, instance = cell
+        if not is_invariant_execution(policy_type, fault_probability):
+            continue
+        key = (policy_type, seed, execution_fault_mode, float(fault_probability))
+        if key in firsts:
+            copies[cell] = firsts[key]
+        else:
+            firsts[key] = cell
+    return copies
+
+
+def shard_cells(cells, shard, batch_size=1, branching=False):
+    # ### the cells of shard (shard_number, num_shards): every num_shards-th batch of the cells that a single run over
+    # ### the grid simulates, starting at batch shard_number (counting from 1), along with the memoized cells that repeat
+    # ### them. a shard thus executes the same batches as the single run, which matters when a batched policy call
+    # ### rounds differently from a single one, as long as every shard runs with the batch_size and branching of that run
+    shard_number, num_shards = shard
+    copies = memoized_cells(cells)
+    simulated_cells = [cell for cell in cells if cell not in copies]
+    batches = split_to_batches(simulated_cells, batch_size, branching)[shard_number - 1::num_shards]
+    shard_simulated_cells = set(itertools.chain.from_iterable(batches))
+    return [cell for cell in cells if cell in shard_simulated_cells or copies.get(cell) in shard_simulated_cells]
+
+
+def expand_memoized_results(cells, copies, computed_results):
+    # ### the results of all the cells in their order: the simulated cells come from computed_results, which yields them
+    # ### in their order, and a memoized cell repeats the trajectory of its first instance without any wasted rollout
+    results = {}
+    remaining_copies = collections.Counter(copies.values())
+    for cell in cells:
+        if cell in copies:
+            first = copies[cell]
+            result = (results[first][0], 0)
+            remaining_copies[first] -= 1
+            if remaining_copies[first] == 0:
+                del results[first]
+            profiling.count('memoized_cells')
+        else:
+            result = next(computed_results)
+            if remaining_copies[cell] > 0:
+                results[cell] = result
+        yield result
+
+
+def merge_cached_results(domain_name, model_name, cells, missing_cells, computed_results, cell_cache):
+    # ### the results of all the cells in grid order: the missing cells come from computed_results, which yields them in
+    # ### their order, and the other cells from the cache. a freshly computed cell is cached as soon as it arrives
+    missing_cells = set(missing_cells)
+    for cell in cells:
+        if cell in missing_cells:
+            result = next(computed_results)
+            if cell_cache is not None:
+                with profiling.phase('cache_store'):
+                    cell_cache.store(domain_name, model_name, cell, result)
+        else:
+            with profiling.phase('cache_load'):
+                result = cell_cache.load(domain_name, model_name, cell)
+        yield result
+
 
+def ordered_pool_map(pool, function, tasks, window):
+    # ### like pool.imap, but with at most window tasks in flight, so that results which finish ahead of a slow task
+    # ### never pile up in memory
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
 
-def generate_trajectories(filename):
+
+def generate_trajectories(filename, num_workers=1, batch_size=1, fault_sampling='retry', branching=False, output_formats=('excel',), flush_every=100, cache_dir=None, inference_server=False, shard=None, profile=None, background_writer=None, compression=None):
     # ### parameters dictionary
     param_dict = read_json_data(f"inputs/{filename}")
 
-    # ### prepare the records database to be written to the Excel file
-    records = []
-
     # ### the domain name of this experiment (each experiment file has only one associated domain)
     domain_name = param_dict['domain_name']
 
@@ -196,45 +557,193 @@ def generate_trajectories(filename):
     # ### the experiment instance numbers
     instances = param_dict['instances']
 
-    total_instances_number = len(policy_types) * len(seeds) * len(modelled_fault_modes) * len(fault_probabilities) * len(instances)
+    # ### the grid cells, in grid order
+    cells = grid_cells(param_dict)
+
+    # ### shard (shard_number, num_shards) generates every num_shards-th batch of cells (see shard_cells) into a bundle
+    # ### of its own. merge_shards puts the shard bundles together into the outputs of the grid
+    name = filename.split(".")[0]
+    if shard is not None:
+        cells = shard_cells(cells, shard, batch_size, branching)
+        name = shard_name(name, shard)
+        output_formats = ['bundle']
+
+    # ### the cells that are not in the cache of finished cells yet (all of them when there is no cache)
+    cell_cache = None
+    missing_cells = cells
+    if cache_dir is not None:
+        cell_cache = CellCache(cache_dir, code_model_hash(domain_name, model_name), fault_sampling, branching, batch_size)
+        missing_cells = [cell for cell in cells if not cell_cache.contains(domain_name, model_name, cell)]
+        print(f"cached cells: {len(cells) - len(missing_cells)}/{len(cells)}")
+
+    total_instances_number = len(cells)
     current_instance_number = 1
+    total_wasted_rollouts = 0
+    conditioning_rollouts = 0
     start_time = datetime.now()
 
-    # ### run the trajectory generation loop
-    for policy_type_i, policy_type in enumerate(policy_types):
-        for seed_i, seed in enumerate(seeds):
-            for execution_fault_mode_i, execution_fault_mode in enumerate(modelled_fault_modes):
-                for fault_probability_i, fault_probability in enumerate(fault_probabilities):
-                    for instance_i, instance in enumerate(instances):
-                        # ### create the faulty trajectory
-                        registered_actions, faulty_actions_indices, observations, trajectory_execution = generate_trajectory(domain_name,
-                                                                                                                             model_name,
-                                                                                                                             policy_type,
-                                                                                                                             seed,
-                                                                                                                             execution_fault_mode,
-                                                                                                                             fault_probability)
-                        # ### logging
-                        now = datetime.now()
-                        dt_string = now.strftime("%d/%m/%Y %H:%M:%S")
-                        elapsed_time = now - start_time
-                        hours, remainder = divmod(elapsed_time.total_seconds(), 3600)
-                        minutes, seconds = divmod(remainder, 60)
-                        print(f"{dt_string}: {current_instance_number}/{total_instances_number}")
-                        print(f"elapsed time: {int(hours):02}:{int(minutes):02}:{int(seconds):02}")
-                        print(f"policy_type: {policy_type}, seed: {seed}, execution_fault_mode: {execution_fault_mode}, fault_probability: {fault_probability}, instance: {instance}")
-                        print(f"registered actions: {str(registered_actions)}")
-                        print(f"number of  actions: {len(registered_actions)}")
-
-                        # ### preparing record for writing to Excel file
-                        record = prepare_record(domain_name, model_name, policy_types, seeds, modelled_fault_modes, fault_probabilities, instances,
-                                                policy_type, seed, execution_fault_mode, fault_probability, instance,
-                                                registered_actions, faulty_actions_indices, observations, trajectory_execution)
-                        records.append(record)
-
-                        print(f'\n')
-                        current_instance_number += 1
-
-    # ### write records to an Excel file
-    write_records_to_excel(records, filename.split(".")[0])
+    # ### profile "timers" records the phases and counters of the run into outputs/{name}_profile.json, and "cprofile"
+    # ### also runs this process under cProfile into outputs/{name}_profile.prof
+    profiler = None
+    if profile is not None:
+        profiling.enable()
+        if profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+    run_start_time = time.perf_counter()
+
+    # ### the record writers, which get every record as soon as it is produced
+    writers = open_record_writers(name, param_dict, output_formats, compression, background_writer)
+
+    # ### a cell whose instances all repeat the same execution is simulated once, and its later instances reuse that
+    # ### trajectory (the bundle stores them as references to the first one)
+    copies = memoized_cells(missing_cells)
+    simulated_cells = [cell for cell in missing_cells if cell not in copies]
+    print(f"memoized cells: {len(copies)}/{len(missing_cells)}")
+
+    # ### run the trajectory generation loop over batches of cells (executed in lockstep when batch_size > 1, or branched
+    # ### off the fault free execution of their seed when branching), either serially or on a pool of worker processes.
+    # ### the pool yields the batches in the order of the cells, so the records come out in the same order in every mode
+    batches = split_to_batches(simulated_cells, batch_size, branching)
+    # ### with inference_server, the atari workers share one process that holds the model and batches their requests
+    pool = None
+    server = None
+    inference_threads = None
+    if num_workers > 1:
+        inference_client = None
+        if inference_server and domain_name in ATARI_DOMAINS:
+            server = InferenceServer(domain_name, model_name, num_workers, batch_size)
+            inference_client = server.client_args
+        pool = multiprocessing.Pool(num_workers, initializer=init_worker, initargs=(domain_name, model_name, fault_sampling, branching, inference_client, profile is not None))
+        batch_results = merge_worker_statistics(ordered_pool_map(pool, generate_worker_cells, batches, 2 * num_workers))
+    else:
+        # ### a serial run uses a single thread like the workers, since a multithreaded forward pass may sum in another
+        # ### order and round differently. the caller's setting is restored at the end of the run
+        inference_threads = set_inference_threads(1)
+        init_context(domain_name, model_name, fault_sampling, branching)
+        batch_results = (generate_cells(domain_name, model_name, batch, fault_sampling, branching) for batch in batches)
+    computed_results = expand_memoized_results(missing_cells, copies, itertools.chain.from_iterable(batch_results))
+    results = merge_cached_results(domain_name, model_name, cells, missing_cells, computed_results, cell_cache)
+
+    try:
+        for (policy_type, seed, execution_fault_mode, fault_probability, instance), result in zip(cells, results):
+            # ### create the faulty trajectory
+            trajectory, num_wasted_rollouts = result
+            total_wasted_rollouts += num_wasted_rollouts
+            if fault_sampling == 'conditional' and is_deterministic_policy(policy_type):
+                conditioning_rollouts += num_wasted_rollouts
+            profiling.count('cells')
+            profiling.count('retries', num_wasted_rollouts)
+            profiling.count('registered_actions', trajectory.num_actions)
+
+            # ### logging
+            now = datetime.now()
+            dt_string = now.strftime("%d/%m/%Y %H:%M:%S")
+            elapsed_time = now - start_time
+            hours, remainder = divmod(elapsed_time.total_seconds(), 3600)
+            minutes, seconds = divmod(remainder, 60)
+            print(f"{dt_string}: {current_instance_number}/{total_instances_number}")
+            print(f"elapsed time: {int(hours):02}:{int(minutes):02}:{int(seconds):02}")
+            print(f"policy_type: {policy_type}, seed: {seed}, execution_fault_mode: {execution_fault_mode}, fault_probability: {fault_probability}, instance: {instance}")
+            print(f"registered actions: {str(trajectory.actions.tolist())}")
+            print(f"number of  actions: {trajectory.num_actions}")
+            print(f"wasted rollouts: {num_wasted_rollouts}")
+
+            # ### preparing record and writing it out, flushing the writers every flush_every records
+            record = prepare_record(domain_name, model_name, policy_types, seeds, modelled_fault_modes, fault_probabilities, instances,
+                                    policy_type, seed, execution_fault_mode, fault_probability, instance,
+                                    trajectory)
+            with profiling.phase('write'):
+                for writer in writers:
+                    writer.write(record)
+                if current_instance_number % flush_every == 0:
+                    for writer in writers:
+                        writer.flush()
+
+            print(f'\n')
+            current_instance_number += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if server is not None:
+            server.close()
+        if inference_threads is not None:
+            set_inference_threads(inference_threads)
+        # ### closing the writers also keeps the records of an interrupted run
+        with profiling.phase('write'):
+            for writer in writers:
+                writer.close()
+
+    print(f"wasted rollouts ({fault_sampling} fault sampling): {total_wasted_rollouts} in {total_instances_number} instances")
+    if fault_sampling == 'conditional':
+        # ### the waste that conditional sampling leaves: the fault free executions that the first faulty actions of the
+        # ### deterministic cells were drawn from (one per such cell at most), and the retries of the other policy types
+        print(f"  fault free executions that conditioned a first fault: {conditioning_rollouts}, retries of non deterministic policies: {total_wasted_rollouts - conditioning_rollouts}")
+
+    if profile is not None:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"outputs/{name}_profile.prof")
+        output_paths = [f"outputs/{name}.xlsx", f"outputs/{name}_observations", f"outputs/{name}_bundle"]
+        profiling.count('bytes_written', sum(profiling.path_bytes(path) for path in output_paths))
+        run_info = {
+            'filename': filename,
+            'domain_name': domain_name,
+            'model_name': model_name,
+            'num_workers': num_workers,
+            'batch_size': batch_size,
+            'fault_sampling': fault_sampling,
+            'branching': branching,
+            'output_formats': list(output_formats),
+            'shard': list(shard) if shard is not None else None,
+            'started': start_time.strftime("%d/%m/%Y %H:%M:%S"),
+            'num_instances': total_instances_number,
+        }
+        report = profiling.write_report(f"outputs/{name}_profile.json", run_info, time.perf_counter() - run_start_time)
+        profiling.disable()
+        print(f"profile: {json.dumps(report['phases'])}")
 
     print(9)
+
+
+def merge_shards(filename, num_shards, output_formats=('bundle',), compression=None, background_writer=None):
+    # ### the outputs of the full grid from the bundles of its num_shards shards, a single bundle unless output_formats
+    # ### asks for the Excel file too. every cell is generated from its own random generator and in the batches of a
+    # ### single run, so the merged records are the ones that a single run over the whole grid writes
+    param_dict = read_json_data(f"inputs/{filename}")
+    domain_name = param_dict['domain_name']
+    model_name = param_dict['model_name']
+    name = filename.split(".")[0]
+
+    # ### the shard bundle and record number of every generated cell
+    locations = {}
+    bundles = []
+    for shard_number in range(1, num_shards + 1):
+        bundle = Bundle(f"outputs/{shard_name(name, (shard_number, num_shards))}_bundle")
+        for i in range(len(bundle)):
+            record = bundle.record(i)
+            cell = (record['policy_type'], record['seed'], record['execution_fault_mode'], record['fault_probability'], record['instance'])
+            locations[cell] = (bundle, i)
+        bundles.append(bundle)
+
+    cells = grid_cells(param_dict)
+    missing_cells = [cell for cell in cells if (cell[0], cell[1], cell[2], float(cell[3]), cell[4]) not in locations]
+    if len(missing_cells) > 0:
+        raise ValueError(f'{len(missing_cells)} grid cells are in none of the {num_shards} shards, the first of them is {missing_cells[0]}.')
+
+    writers = open_record_writers(name, param_dict, output_formats, compression, background_writer)
+    try:
+        for policy_type, seed, execution_fault_mode, fault_probability, instance in cells:
+            bundle, i = locations[(policy_type, seed, execution_fault_mode, float(fault_probability), instance)]
+            trajectory = Trajectory.from_arrays(bundle.observations(i), bundle.registered_actions(i), bundle.faulty_actions_indices(i))
+            record = prepare_record(domain_name, model_name, param_dict['policy_types'], param_dict['seeds'], param_dict['modelled_fault_modes'], param_dict['fault_probabilities'], param_dict['instances'],
+                                    policy_type, seed, execution_fault_mode, fault_probability, instance,
+                                    trajectory)
+            for writer in writers:
+                writer.write(record)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    print(f"merged {len(cells)} instances from {num_shards} shards")
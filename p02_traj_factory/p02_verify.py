@@ -0,0 +1,255 @@
+import argparse
+import copy
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from common import executor
+from common.bundles import Bundle
+from common.consts import MAX_EXEC_LEN
+from common.domains import domains
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from common.numpy_policies import model_outputs
+
+# ### a replay verifier of a bundle, which checks that every stored trajectory could have happened without executing any
+# ### of them again. the records are checked in chunks, in parallel on a pool of worker processes, and every chunk is
+# ### checked in three passes:
+# ###
+# ###       "fault"         - the executed actions are rebuilt from the registered (planned) actions and the faulty
+# ###                         action indices, with the fault modes of all the records of the chunk in lockstep. every
+# ###                         faulty action must be one that the fault mode changes
+# ###       "policy"        - the registered actions of the deterministic policy records must be the greedy actions of
+# ###                         their observations, which the policy evaluates in one batch per chunk. the stochastic
+# ###                         policy records are not checked
+# ###       "transition"    - every stored observation is put into the env with the set_state wrapper, the executed
+# ###                         action is applied, and the result must be the next stored observation. the episode must
+# ###                         end on the last action (or run into MAX_EXEC_LEN) and on no other one. the tabular domains
+# ###                         check the transition against the possible outcomes of the env transition table instead,
+# ###                         as FrozenLake moves at random. the atari observations are frames, not env states, so the
+# ###                         atari records skip this pass
+# ###
+# ### every mismatch names its record, its check and its action number (starting at 1)
+
+# ### the difference between a greedy action output and the output of the registered action that the policy check
+# ### puts down to float rounding (a batched forward pass rounds differently than the one of a single observation)
+POLICY_MARGIN = 1e-4
+
+# ### the per-process state of the verifier: the bundle, its env and its policy
+_bundle = None
+_env = None
+_policy = None
+_atol = 0.0
+
+
+def init_worker(path, atol):
+    global _bundle, _env, _policy, _atol
+    _bundle = Bundle(path)
+    domain_name = _bundle.constants['domain_name']
+    model_name = _bundle.constants['model_name']
+    _env = executor.make_env(domain_name, 0)
+    if domains[domain_name].kind == 'tabular':
+        _policy = executor.get_tabular_engine(domain_name, model_name, _env)
+    else:
+        _policy = executor.get_policy(domain_name, model_name, _env)
+    _atol = atol
+
+
+def instance_name(bundle, i):
+    record = bundle.record(i)
+    return f"{record['policy_type']}_{record['seed']}_{record['execution_fault_mode']}_{record['fault_probability']}_{record['instance']}"
+
+
+def mismatch(bundle, i, check, action_number, detail):
+    return {'record': int(i), 'instance': instance_name(bundle, i), 'check': check, 'action_number': int(action_number), 'detail': detail}
+
+
+def executed_actions(bundle, indices):
+    # the executed actions of the records, and the mismatches of their faulty action indices
+    registered_actions = [np.asarray(bundle.registered_actions(i), dtype=np.int64) for i in indices]
+    fault_masks = []
+    mismatches = []
+    for i, actions in zip(indices, registered_actions):
+        faulty_actions_indices = np.asarray(bundle.faulty_actions_indices(i), dtype=np.int64)
+        fault_mask = np.zeros(len(actions), dtype=bool)
+        in_range = (faulty_actions_indices >= 1) & (faulty_actions_indices <= len(actions))
+        for action_number in faulty_actions_indices[~in_range]:
+            mismatches.append(mismatch(bundle, i, 'fault', action_number, f'faulty action index out of the {len(actions)} registered actions'))
+        if np.any(np.diff(faulty_actions_indices) <= 0):
+            mismatches.append(mismatch(bundle, i, 'fault', 0, 'faulty action indices are not strictly increasing'))
+        fault_mask[faulty_actions_indices[in_range] - 1] = True
+        fault_masks.append(fault_mask)
+
+    # all the fault modes step in lockstep, each record dropping out after its last action
+    fault_modes = FaultModeGeneratorDiscrete().compile_fault_modes(
+        [bundle.constants['modelled_fault_modes'][int(bundle.records[i]['execution_fault_mode'])] for i in indices])
+    lengths = np.array([len(actions) for actions in registered_actions], dtype=np.int64)
+    executed = [np.empty(length, dtype=np.int64) for length in lengths]
+    for t in range(int(lengths.max(initial=0))):
+        rows = np.flatnonzero(lengths > t)
+        actions = np.array([registered_actions[row][t] for row in rows], dtype=np.int64)
+        fault_mask = np.array([fault_masks[row][t] for row in rows], dtype=bool)
+        step_actions = fault_modes.apply(rows, actions, fault_mask)
+        for row, action in zip(rows, step_actions):
+            executed[row][t] = action
+    for row, i in enumerate(indices):
+        for t in np.flatnonzero(fault_masks[row] & (executed[row] == registered_actions[row])):
+            mismatches.append(mismatch(bundle, i, 'fault', t + 1, f'the fault mode does not change the action {registered_actions[row][t]}'))
+    return executed, mismatches
+
+
+def policy_mismatches(bundle, indices, policy):
+    # the registered actions of the deterministic policy records against the greedy actions of one batched evaluation
+    domain_name = bundle.constants['domain_name']
+    kind = domains[domain_name].kind
+    indices = [i for i in indices if executor.is_deterministic_policy(bundle.record(i)['policy_type'])]
+    if len(indices) == 0:
+        return [], 0
+    lengths = [int(bundle.records[i]['registered_actions_length']) for i in indices]
+    observations = np.concatenate([bundle.observations(i)[:length] for i, length in zip(indices, lengths)])
+    registered_actions = np.concatenate([bundle.registered_actions(i) for i in indices]).astype(np.int64)
+    if kind == 'tabular':
+        greedy = policy.policy_actions(observations.astype(np.int64), True, None)
+        wrong = greedy != registered_actions
+    else:
+        if kind == 'atari':
+            observations = observations.reshape((-1,) + observations.shape[2:])
+        else:
+            refiner = domains[domain_name].load('refiner')
+            observations = refiner(observations)
+        outputs = policy.forward(observations) if hasattr(policy, 'forward') else model_outputs(policy, observations)
+        registered_outputs = outputs[np.arange(len(outputs)), registered_actions]
+        wrong = registered_outputs < outputs.max(axis=1) - POLICY_MARGIN
+        greedy = np.argmax(outputs, axis=1)
+    mismatches = []
+    starts = np.cumsum([0] + lengths)
+    for j in np.flatnonzero(wrong):
+        row = int(np.searchsorted(starts, j, side='right')) - 1
+        mismatches.append(mismatch(bundle, indices[row], 'policy', j - starts[row] + 1,
+                                   f'registered action {registered_actions[j]}, greedy action {greedy[j]}'))
+    return mismatches, len(indices)
+
+
+def termination_mismatch(bundle, i, t, num_actions, done):
+    # the episode ends on the last action, unless the execution ran into MAX_EXEC_LEN, and on no other one
+    if t < num_actions - 1 and done:
+        return mismatch(bundle, i, 'transition', t + 1, 'the episode ended before the last action')
+    if t == num_actions - 1 and not done and num_actions < MAX_EXEC_LEN - 1:
+        return mismatch(bundle, i, 'transition', t + 1, 'the episode did not end on the last action')
+    return None
+
+
+def classic_transition_mismatches(bundle, indices, executed, env, atol):
+    mismatches = []
+    for i, actions in zip(indices, executed):
+        observations = np.asarray(bundle.observations(i))
+        # a reset clears the end of episode bookkeeping of the previous record
+        env.reset()
+        for t, action in enumerate(actions.tolist()):
+            env.set_state(copy.copy(observations[t]))
+            next_state, _, done, _, _ = env.step(action)
+            next_state = np.asarray(next_state, dtype=np.float64)
+            if not np.allclose(next_state, observations[t + 1], rtol=0.0, atol=atol):
+                mismatches.append(mismatch(bundle, i, 'transition', t + 1,
+                                           f'stepped to {next_state.tolist()}, stored {observations[t + 1].tolist()}'))
+                break
+            result = termination_mismatch(bundle, i, t, len(actions), done)
+            if result is not None:
+                mismatches.append(result)
+                break
+    return mismatches
+
+
+def tabular_transition_mismatches(bundle, indices, executed, engine):
+    # a transition is possible when an outcome of positive probability of the stored state and the executed action
+    # leads to the next stored state, with the termination of the record
+    mismatches = []
+    cumulative_probabilities = engine.cumulative_probabilities
+    with np.errstate(invalid='ignore'):
+        probabilities = np.diff(cumulative_probabilities, axis=2, prepend=0.0)
+    possible = np.isfinite(cumulative_probabilities) & (probabilities > 0)
+    for i, actions in zip(indices, executed):
+        observations = np.asarray(bundle.observations(i), dtype=np.int64)
+        states = observations[:-1]
+        next_states = observations[1:]
+        done = np.zeros(len(actions), dtype=bool)
+        if len(actions) < MAX_EXEC_LEN - 1:
+            done[-1] = True
+        outcomes = possible[states, actions] & (engine.next_states[states, actions] == next_states[:, None])
+        reached = np.any(outcomes, axis=1)
+        ended = np.any(outcomes & (engine.terminated[states, actions] == done[:, None]), axis=1)
+        if len(actions) == MAX_EXEC_LEN - 1:
+            ended[-1] = True
+        wrong = np.flatnonzero(~reached | ~ended)
+        if len(wrong) > 0:
+            t = int(wrong[0])
+            detail = f'no outcome of state {states[t]} and action {actions[t]} leads to {next_states[t]}' if not reached[t] else \
+                ('the episode did not end on the last action' if done[t] else 'the episode ended before the last action')
+            mismatches.append(mismatch(bundle, i, 'transition', t + 1, detail))
+    return mismatches
+
+
+def verify_chunk(indices):
+    # the mismatches of the records indices, and the numbers of records that went through the policy and the
+    # transition checks
+    kind = domains[_bundle.constants['domain_name']].kind
+    executed, mismatches = executed_actions(_bundle, indices)
+    chunk_policy_mismatches, num_policy_checked = policy_mismatches(_bundle, indices, _policy)
+    mismatches += chunk_policy_mismatches
+    num_transitions_checked = 0
+    if kind == 'classic':
+        mismatches += classic_transition_mismatches(_bundle, indices, executed, _env, _atol)
+        num_transitions_checked = len(indices)
+    elif kind == 'tabular':
+        mismatches += tabular_transition_mismatches(_bundle, indices, executed, _policy)
+        num_transitions_checked = len(indices)
+    return mismatches, num_policy_checked, num_transitions_checked
+
+
+def verify_bundle(path, num_workers=1, chunk_size=256, atol=1e-7, output_path=None):
+    # checks every record of the bundle at path, and writes the report (the mismatches and the numbers of checked
+    # records) to output_path (<path>_verification.json by default)
+    start_time = time.perf_counter()
+    bundle = Bundle(path)
+    chunks = [list(range(start, min(start + chunk_size, len(bundle)))) for start in range(0, len(bundle), chunk_size)]
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers, initializer=init_worker, initargs=(path, atol)) as pool:
+            results = pool.map(verify_chunk, chunks)
+    else:
+        init_worker(path, atol)
+        results = [verify_chunk(chunk) for chunk in chunks]
+    mismatches = [m for chunk_mismatches, _, _ in results for m in chunk_mismatches]
+    report = {
+        'bundle': path,
+        'domain_name': bundle.constants['domain_name'],
+        'num_records': len(bundle),
+        'num_policy_checked': sum(num_policy_checked for _, num_policy_checked, _ in results),
+        'num_transitions_checked': sum(num_transitions_checked for _, _, num_transitions_checked in results),
+        'num_mismatched_records': len(set(m['record'] for m in mismatches)),
+        'seconds': time.perf_counter() - start_time,
+        'mismatches': mismatches,
+    }
+    if output_path is None:
+        output_path = f"{path.rstrip('/')}_verification.json"
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"{report['num_records']} records of {path} verified in {report['seconds']:.1f}s: "
+          f"{report['num_mismatched_records']} mismatched records ({len(mismatches)} mismatches), report in {output_path}")
+    for m in mismatches[:20]:
+        print(f"  rec {m['record']} ({m['instance']}) {m['check']} at action {m['action_number']}: {m['detail']}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bundle', help='the bundle directory, e.g. outputs/i2000_CartPole_bundle')
+    parser.add_argument('--workers', type=int, default=1, help='the number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=256, help='the number of records that a worker checks at a time')
+    parser.add_argument('--atol', type=float, default=1e-7, help='the tolerance of the comparison of a stepped and a stored observation')
+    parser.add_argument('--output', help='the report file (<bundle>_verification.json by default)')
+    args = parser.parse_args()
+
+    report = verify_bundle(args.bundle, args.workers, args.chunk_size, args.atol, args.output)
+    sys.exit(1 if len(report['mismatches']) > 0 else 0)
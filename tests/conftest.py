@@ -0,0 +1,68 @@
+import glob
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import openpyxl
+import pytest
+
+# ### the modules import each other as the scripts of p02_traj_factory do (common from the repository root, the p02
+# ### modules from p02_traj_factory), and they read their inputs, models and outputs relative to p02_traj_factory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FACTORY_DIR = os.path.join(ROOT, 'p02_traj_factory')
+sys.path[:0] = [ROOT, FACTORY_DIR]
+
+
+@pytest.fixture(autouse=True)
+def factory_dir(monkeypatch):
+    monkeypatch.chdir(FACTORY_DIR)
+
+
+@pytest.fixture
+def grid():
+    # writes a grid to inputs/tmp_<name>.json, and removes it and every tmp_<name> output after the test
+    names = []
+
+    def write_grid(name, **params):
+        with open(f"inputs/tmp_{name}.json", 'w') as file:
+            json.dump(params, file)
+        names.append(name)
+        return f"tmp_{name}.json"
+
+    yield write_grid
+    for name in names:
+        os.remove(os.path.join(FACTORY_DIR, 'inputs', f"tmp_{name}.json"))
+        for path in glob.glob(os.path.join(FACTORY_DIR, 'outputs', f"tmp_{name}*")):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+def excel_values(path):
+    # the rows of the first worksheet of an Excel file, the header row included
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    values = list(workbook.worksheets[0].iter_rows(values_only=True))
+    workbook.close()
+    return values
+
+
+# ### the bundle constants and a few records of different lengths, for the tests that write bundles of their own
+CONSTANTS = dict(domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic', 'stochastic'], seeds=[1, 2],
+                 modelled_fault_modes=['[1,0]', '[0,0]'], fault_probabilities=[0.5], instances=[1, 2])
+
+
+def make_record(policy_type, seed, execution_fault_mode, instance, num_actions, faulty_actions_indices):
+    observations = np.arange((num_actions + 1) * 4, dtype=np.float64).reshape(-1, 4) / (seed + instance)
+    return dict(CONSTANTS, policy_type=policy_type, seed=seed, execution_fault_mode=execution_fault_mode,
+                fault_probability=0.5, instance=instance, observations=observations,
+                registered_actions=np.arange(num_actions) % 2, faulty_actions_indices=faulty_actions_indices)
+
+
+RECORDS = [
+    make_record('deterministic', 1, '[1,0]', 1, 5, [2, 4]),
+    make_record('deterministic', 1, '[1,0]', 2, 7, [1]),
+    make_record('stochastic', 2, '[0,0]', 1, 3, [3]),
+]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from common.atari_store import AtariObservationStoreWriter, AtariObservationStore
+
+
+def frame_stacks(num_observations, n_stack=4, seed=0):
+    # frame stacks that shift by one frame per step, like the observations of a frame stacked atari env
+    frames = np.random.default_rng(seed).integers(0, 256, size=(num_observations + n_stack - 1, 84, 84), dtype=np.uint8)
+    return [np.stack(frames[i:i + n_stack], axis=-1)[np.newaxis] for i in range(num_observations)]
+
+
+@pytest.mark.parametrize('compression', [None, 'lzma'])
+def test_observations_are_read_back_as_written(tmp_path, compression):
+    first = frame_stacks(6, seed=1)
+    second = frame_stacks(3, seed=2)
+    writer = AtariObservationStoreWriter(str(tmp_path / 'obs'), compression)
+    assert writer.append(first) == (0, 6)
+    # an execution from the same seed shares every frame of the first one
+    assert writer.append(first[:4]) == (6, 4)
+    assert writer.append(second) == (10, 3)
+    writer.close()
+    store = AtariObservationStore(str(tmp_path / 'obs'))
+    assert len(store) == 13
+    assert store.meta['num_frames'] == (6 + 3) + (3 + 3)
+    assert np.array_equal(store.observations(0, 6), np.stack(first))
+    assert np.array_equal(store.observations(6, 4), np.stack(first[:4]))
+    assert np.array_equal(store.observations(10, 3), np.stack(second))
+    assert np.array_equal(store[11], second[1])
+
+
+def test_observations_of_another_shape_are_refused(tmp_path):
+    writer = AtariObservationStoreWriter(str(tmp_path / 'obs'))
+    writer.append(frame_stacks(2))
+    with pytest.raises(ValueError):
+        writer.append(frame_stacks(2, n_stack=2))
+    writer.close()
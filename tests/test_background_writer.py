@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from common.background_writer import BackgroundRecordWriter
+from common.bundles import Bundle
+from conftest import excel_values
+from p02_traj_factory import generate_trajectories
+
+
+class ListWriter:
+    def __init__(self, records):
+        self.records = records
+
+    def write(self, record):
+        self.records.append(record)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.records.append('closed')
+
+
+class FailingWriter(ListWriter):
+    def write(self, record):
+        raise OSError('disk full')
+
+
+def test_thread_writer_writes_every_record_before_it_closes():
+    records = []
+    writer = BackgroundRecordWriter(lambda: [ListWriter(records)], (), 'thread', max_pending=2)
+    for i in range(10):
+        writer.write(i)
+    writer.close()
+    assert records == list(range(10)) + ['closed']
+
+
+def test_writer_errors_are_raised_in_the_generation_loop():
+    writer = BackgroundRecordWriter(lambda: [FailingWriter([])], (), 'thread')
+    writer.write(1)
+    with pytest.raises(RuntimeError, match='disk full'):
+        writer.close()
+
+
+@pytest.mark.parametrize('background_writer, compression', [('thread', None), ('process', 'lzma')])
+def test_background_writers_write_the_outputs_of_the_generation_loop(grid, background_writer, compression):
+    filename = grid('background_writer', domain_name='FrozenLake_v1', model_name='PPO', policy_types=['deterministic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,2,3,0]'], fault_probabilities=[0.5], instances=[1, 2])
+    generate_trajectories(filename, output_formats=['excel', 'bundle'])
+    excel = excel_values('outputs/tmp_background_writer.xlsx')
+    bundle = Bundle('outputs/tmp_background_writer_bundle')
+    observations = [bundle.observations(i).copy() for i in range(len(bundle))]
+
+    generate_trajectories(filename, output_formats=['excel', 'bundle'], background_writer=background_writer,
+                          compression=compression)
+    assert excel_values('outputs/tmp_background_writer.xlsx') == excel
+    bundle = Bundle('outputs/tmp_background_writer_bundle')
+    assert bundle.meta['compression'] == compression
+    assert all(np.array_equal(bundle.observations(i), observations[i]) for i in range(len(bundle)))
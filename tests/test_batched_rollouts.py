@@ -0,0 +1,32 @@
+import random
+
+import numpy as np
+import pytest
+
+from common.executor import execute_batch, execute_gym
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from conftest import excel_values
+from p02_traj_factory import generate_trajectories
+
+
+@pytest.mark.parametrize('policy_type', ['deterministic', 'stochastic'])
+def test_lockstep_executions_are_the_single_ones(policy_type):
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    cells = [(1, '[0,1,1]', 0.5), (2, '[0,1,1]', 0.5), (3, '[1,1,2]', 0.2), (1, '[2,1,0]', 1.0)]
+    batch = execute_batch('Acrobot_v1', 'PPO', policy_type, cells, fault_mode_generator, [None] * len(cells),
+                          [random.Random(i) for i in range(len(cells))])
+    for i, (seed, execution_fault_mode, fault_probability) in enumerate(cells):
+        trajectory, faulty_actions_indices = execute_gym('Acrobot_v1', 'PPO', policy_type, seed, execution_fault_mode,
+                                                         fault_probability, fault_mode_generator, rng=random.Random(i))
+        assert batch[i][0].actions.tolist() == trajectory.actions.tolist()
+        assert batch[i][1] == faulty_actions_indices
+        assert np.array_equal(batch[i][0].observations, trajectory.observations)
+
+
+def test_batches_write_the_records_of_single_executions(grid):
+    filename = grid('batched', domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,0]'], fault_probabilities=[0.2, 0.6], instances=[1, 2])
+    generate_trajectories(filename)
+    single = excel_values('outputs/tmp_batched.xlsx')
+    generate_trajectories(filename, batch_size=3)
+    assert excel_values('outputs/tmp_batched.xlsx') == single
@@ -0,0 +1,57 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from p02_benchmark import run_benchmarks, compare_benchmarks
+
+
+@pytest.fixture
+def benchmarks_dir():
+    # the writer case writes into outputs/benchmarks, which is removed again when the test created it
+    existed = os.path.isdir('outputs/benchmarks')
+    yield
+    if not existed and os.path.isdir('outputs/benchmarks'):
+        shutil.rmtree('outputs/benchmarks')
+
+
+def test_every_case_of_a_domain_is_measured(tmp_path, benchmarks_dir):
+    report = run_benchmarks(['CartPole_v1', 'Taxi_v3'], output_path=str(tmp_path / 'benchmark.json'))
+    with open(tmp_path / 'benchmark.json') as f:
+        assert json.load(f) == report
+    cases = {(result['domain_name'], result['case']): result for result in report['results']}
+    assert sorted(cases) == [(domain_name, case) for domain_name in ['CartPole_v1', 'Taxi_v3']
+                             for case in ['execute', 'execute_batch', 'write']]
+    assert cases['Taxi_v3', 'execute_batch']['executor'] == 'execute_tabular'
+    for domain_name in ['CartPole_v1', 'Taxi_v3']:
+        # the lockstep executions and the writer go over the steps of the single executions
+        steps = cases[domain_name, 'execute']['steps']
+        assert steps > 0
+        assert cases[domain_name, 'execute_batch']['steps'] == steps
+        assert cases[domain_name, 'write']['steps'] == steps
+        assert cases[domain_name, 'write']['output_bytes'] > 0
+        assert cases[domain_name, 'execute']['trajectories'] == 8
+    # every case runs in a process of its own, whose peak RSS only covers its setup and the case itself
+    for result in report['results']:
+        assert 0 < result['start_peak_rss_mb'] <= result['peak_rss_mb']
+        assert result['case_rss_growth_mb'] == result['peak_rss_mb'] - result['start_peak_rss_mb']
+    assert not os.path.exists('outputs/benchmarks/writer_CartPole_v1.xlsx')
+
+
+def benchmark_file(path, steps_per_sec, model='trained', numpy_version='1.26.4'):
+    results = [{'domain_name': 'CartPole_v1', 'case': case, 'env': 'gym', 'model': model, 'steps_per_sec': value}
+               for case, value in steps_per_sec.items()]
+    with open(path, 'w') as f:
+        json.dump({'versions': {'numpy': numpy_version}, 'results': results}, f)
+    return str(path)
+
+
+def test_slower_cases_are_regressions(tmp_path):
+    base = benchmark_file(tmp_path / 'base.json', {'execute': 1000.0, 'execute_batch': 5000.0, 'write': 800.0})
+    new = benchmark_file(tmp_path / 'new.json', {'execute': 950.0, 'execute_batch': 4000.0, 'write': 900.0},
+                         numpy_version='2.0.0')
+    assert compare_benchmarks(base, new) == [('CartPole_v1', 'execute_batch')]
+    assert compare_benchmarks(base, new, threshold=0.01) == [('CartPole_v1', 'execute'), ('CartPole_v1', 'execute_batch')]
+    untrained = benchmark_file(tmp_path / 'untrained.json', {'execute': 10.0}, model='untrained')
+    assert compare_benchmarks(base, untrained) == []
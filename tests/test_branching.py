@@ -0,0 +1,41 @@
+import ast
+
+import openpyxl
+
+from common.executor import execute_nominal
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from p02_traj_factory import generate_trajectories
+
+GRID = dict(domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic'], seeds=[1, 2],
+            modelled_fault_modes=['[1,0]', '[0,0]'], fault_probabilities=[0.1, 1.0], instances=[1, 2])
+
+
+def excel_rows(path):
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    headers = next(rows)
+    records = [dict(zip(headers, values)) for values in rows]
+    workbook.close()
+    return records
+
+
+def test_branching_writes_the_records_of_the_full_executions(grid):
+    filename = grid('branching', **GRID)
+    generate_trajectories(filename)
+    executed = excel_rows('outputs/tmp_branching.xlsx')
+    generate_trajectories(filename, branching=True)
+    assert excel_rows('outputs/tmp_branching.xlsx') == executed
+
+
+def test_conditional_branches_follow_the_fault_free_execution_up_to_their_first_fault(grid):
+    filename = grid('conditional_branching', **GRID)
+    generate_trajectories(filename, fault_sampling='conditional', branching=True)
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    for record in excel_rows('outputs/tmp_conditional_branching.xlsx'):
+        registered_actions = ast.literal_eval(record['13_O_registered_actions'])
+        faulty_actions_indices = ast.literal_eval(record['14_O_faulty_actions_indices'])
+        assert len(faulty_actions_indices) > 0
+        nominal_trajectory, _ = execute_nominal('CartPole_v1', 'PPO', 'deterministic', record['09_i_seed'],
+                                                record['10_i_execution_fault_mode'], fault_mode_generator)
+        first_fault_number = faulty_actions_indices[0]
+        assert registered_actions[:first_fault_number] == nominal_trajectory.actions[:first_fault_number].tolist()
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from common.bundles import Bundle, BundleWriter, query_bundles
+from conftest import CONSTANTS, RECORDS, make_record
+
+
+def write_bundle(path, records):
+    writer = BundleWriter(str(path), CONSTANTS)
+    for record in records:
+        writer.write(record)
+    writer.close()
+    return Bundle(str(path))
+
+
+def instances(found):
+    return [(instance.record()['seed'], instance.record()['instance']) for instance in found]
+
+
+def test_the_index_holds_the_fault_statistics(tmp_path):
+    bundle = write_bundle(tmp_path / 'bundle', RECORDS)
+    assert bundle.index['first_fault_index'].tolist() == [2, 1, 3]
+    assert bundle.index['last_fault_index'].tolist() == [4, 1, 3]
+    assert bundle.index['num_faulty_actions'].tolist() == [2, 1, 1]
+    assert np.allclose(bundle.index['action_divergence'], [2 / 5, 1 / 7, 1 / 3])
+
+
+def test_query_filters_on_values_lists_and_ranges(tmp_path):
+    bundle = write_bundle(tmp_path / 'bundle', RECORDS)
+    assert instances(bundle.query(execution_fault_mode='[1,0]')) == [(1, 1), (1, 2)]
+    assert instances(bundle.query(policy_type=['', 'stochastic'])) == [(2, 1)]
+    assert instances(bundle.query(num_faulty_actions=(2, None))) == [(1, 1)]
+    assert instances(bundle.query(first_fault_index=(None, 2), seed=1)) == [(1, 1), (1, 2)]
+    assert instances(bundle.query(seed=3)) == []
+    found = bundle.query(num_registered_actions=7)[0]
+    assert found.record()['last_fault_index'] == 1
+    assert found.registered_actions.tolist() == RECORDS[1]['registered_actions'].tolist()
+    assert np.array_equal(found.observations, RECORDS[1]['observations'])
+    with pytest.raises(ValueError):
+        bundle.query(color='red')
+
+
+def test_the_index_of_an_older_bundle_is_rebuilt(tmp_path):
+    bundle = write_bundle(tmp_path / 'bundle', RECORDS)
+    index = bundle.index.copy()
+    with open(os.path.join(bundle.path, 'meta.json')) as f:
+        meta = json.load(f)
+    meta['index'] = False
+    with open(os.path.join(bundle.path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    assert np.array_equal(Bundle(bundle.path).index, index)
+
+
+def test_query_bundles_collects_the_instances_of_every_bundle(tmp_path):
+    write_bundle(tmp_path / 'first', RECORDS)
+    write_bundle(tmp_path / 'second', [make_record('deterministic', 2, '[1,0]', 1, 4, [1, 2, 3])])
+    found = query_bundles([str(tmp_path / 'first'), str(tmp_path / 'second')], num_faulty_actions=(2, None))
+    assert instances(found) == [(1, 1), (2, 1)]
+    assert found[1].bundle.path == str(tmp_path / 'second')
@@ -0,0 +1,66 @@
+import ast
+
+import numpy as np
+import openpyxl
+import pytest
+
+from common.bundles import Bundle, BundleWriter
+from conftest import CONSTANTS, RECORDS
+from p02_traj_factory import generate_trajectories
+
+
+@pytest.mark.parametrize('compression', [None, 'lzma'])
+def test_bundle_round_trip(tmp_path, compression):
+    writer = BundleWriter(str(tmp_path / 'bundle'), CONSTANTS, compression)
+    for record in RECORDS:
+        writer.write(record)
+    writer.close()
+
+    bundle = Bundle(str(tmp_path / 'bundle'))
+    assert len(bundle) == len(RECORDS)
+    assert bundle.constants == CONSTANTS
+    for i, record in enumerate(RECORDS):
+        assert np.array_equal(bundle.observations(i), record['observations'])
+        assert bundle.registered_actions(i).tolist() == record['registered_actions'].tolist()
+        assert bundle.faulty_actions_indices(i).tolist() == record['faulty_actions_indices']
+        assert bundle.record(i) == {
+            'domain_name': 'CartPole_v1', 'model_name': 'PPO', 'policy_type': record['policy_type'],
+            'seed': record['seed'], 'execution_fault_mode': record['execution_fault_mode'], 'fault_probability': 0.5,
+            'instance': record['instance'], 'num_registered_actions': len(record['registered_actions']),
+            'num_faulty_actions': len(record['faulty_actions_indices']),
+            'num_observations': len(record['observations'])}
+
+
+def test_a_repeated_record_points_at_the_arrays_of_the_previous_one(tmp_path):
+    writer = BundleWriter(str(tmp_path / 'bundle'), CONSTANTS)
+    writer.write(RECORDS[0])
+    writer.write(dict(RECORDS[0], instance=2))
+    writer.close()
+
+    bundle = Bundle(str(tmp_path / 'bundle'))
+    assert bundle.records['observations_start'].tolist() == [0, 0]
+    assert len(bundle.columns['observations']) == len(RECORDS[0]['observations'])
+    assert bundle.record(1)['instance'] == 2
+    assert np.array_equal(bundle.observations(1), RECORDS[0]['observations'])
+
+
+def test_bundle_holds_the_records_of_the_excel_file(grid):
+    filename = grid('bundle', domain_name='Taxi_v3', model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,0,0,0,0,0]'], fault_probabilities=[0.5], instances=[1, 2])
+    generate_trajectories(filename, output_formats=['excel', 'bundle'])
+
+    workbook = openpyxl.load_workbook('outputs/tmp_bundle.xlsx', read_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    headers = next(rows)
+    excel_records = [dict(zip(headers, values)) for values in rows]
+    workbook.close()
+    bundle = Bundle('outputs/tmp_bundle_bundle')
+    assert len(bundle) == len(excel_records) == 8
+    for i, excel_record in enumerate(excel_records):
+        record = bundle.record(i)
+        assert (record['policy_type'], record['seed'], record['execution_fault_mode'], record['instance']) == (
+            excel_record['08_policy_type'], excel_record['09_i_seed'], excel_record['10_i_execution_fault_mode'],
+            excel_record['12_i_instance'])
+        assert bundle.registered_actions(i).tolist() == ast.literal_eval(excel_record['13_O_registered_actions'])
+        assert bundle.faulty_actions_indices(i).tolist() == ast.literal_eval(excel_record['14_O_faulty_actions_indices'])
+        assert [str(obs) for obs in bundle.observations(i)] == ast.literal_eval(excel_record['15_O_observations'])
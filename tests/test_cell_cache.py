@@ -0,0 +1,39 @@
+from common.cell_cache import CellCache
+from conftest import excel_values
+from p02_traj_factory import generate_trajectories
+
+CELL = ('deterministic', 1, '[1,0,0,0,0,0]', 0.5, 1)
+
+
+def test_key_covers_the_cell_and_the_generation_settings(tmp_path):
+    cache = CellCache(str(tmp_path), 'hash', 'retry', False, 1)
+    key = cache.key('Taxi_v3', 'PPO', CELL)
+    assert CellCache(str(tmp_path), 'hash', 'retry', False, 1).key('Taxi_v3', 'PPO', CELL) == key
+    assert cache.key('Taxi_v3', 'PPO', CELL[:4] + (2,)) != key
+    assert cache.key('FrozenLake_v1', 'PPO', CELL) != key
+    assert CellCache(str(tmp_path), 'other hash', 'retry', False, 1).key('Taxi_v3', 'PPO', CELL) != key
+    assert CellCache(str(tmp_path), 'hash', 'conditional', False, 1).key('Taxi_v3', 'PPO', CELL) != key
+    assert CellCache(str(tmp_path), 'hash', 'retry', True, 1).key('Taxi_v3', 'PPO', CELL) != key
+    assert CellCache(str(tmp_path), 'hash', 'retry', False, 4).key('Taxi_v3', 'PPO', CELL) != key
+
+
+def test_store_and_load_a_cell(tmp_path):
+    cache = CellCache(str(tmp_path), 'hash', 'retry', False, 1)
+    assert not cache.contains('Taxi_v3', 'PPO', CELL)
+    cache.store('Taxi_v3', 'PPO', CELL, ([1, 2, 3], 5))
+    assert cache.contains('Taxi_v3', 'PPO', CELL)
+    assert not CellCache(str(tmp_path), 'hash', 'conditional', False, 1).contains('Taxi_v3', 'PPO', CELL)
+    # a cached cell costs no rollouts
+    assert cache.load('Taxi_v3', 'PPO', CELL) == ([1, 2, 3], 0)
+
+
+def test_a_rerun_reads_every_cell_from_the_cache(grid, tmp_path, capsys):
+    filename = grid('cell_cache', domain_name='Taxi_v3', model_name='PPO', policy_types=['deterministic'], seeds=[1, 2],
+                    modelled_fault_modes=['[1,0,0,0,0,0]'], fault_probabilities=[0.5], instances=[1, 2])
+    cache_dir = str(tmp_path / 'cell_cache')
+    generate_trajectories(filename, cache_dir=cache_dir)
+    first_run = excel_values('outputs/tmp_cell_cache.xlsx')
+    capsys.readouterr()
+    generate_trajectories(filename, cache_dir=cache_dir)
+    assert 'cached cells: 4/4' in capsys.readouterr().out
+    assert excel_values('outputs/tmp_cell_cache.xlsx') == first_run
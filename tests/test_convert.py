@@ -0,0 +1,115 @@
+import lzma
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+from common.bundles import Bundle
+from common.sevenzip import SevenZipArchive
+from p02_convert import ArrayListTextParser, cell_observations, convert_outputs
+from p02_traj_factory import generate_trajectories
+
+BREAKOUT_EXCEL = 'outputs/i6000_Breakout-1.xlsx'
+BREAKOUT_ARCHIVE = 'outputs/i6000_Breakout-1_obs_trajs.7z'
+
+
+def parsed_items(data, chunk_size):
+    parser = ArrayListTextParser()
+    items = []
+    for start in range(0, len(data), chunk_size):
+        items.extend(parser.feed(data[start:start + chunk_size]))
+    items.extend(parser.close())
+    return items
+
+
+def archive_texts(path, count):
+    # the names and the bytes of the first count files of the archive
+    texts = []
+    for name, chunks in SevenZipArchive(path).files():
+        texts.append((name, b''.join(bytes(chunk) for chunk in chunks)))
+        if len(texts) == count:
+            break
+    return texts
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_array_lists_parse_in_any_chunks(chunk_size):
+    rng = np.random.default_rng(chunk_size)
+    arrays = [rng.integers(0, 256, size=(1, 3, 4, 2), dtype=np.uint8) for _ in range(3)]
+    texts = [np.array2string(array, threshold=sys.maxsize) for array in arrays]
+    data = ('[' + ',\n'.join([texts[0], '3', texts[1], '12', texts[2]]) + ']').replace('\n', '\r\n').encode()
+    items = parsed_items(data, chunk_size)
+    assert items[1] == 3 and items[3] == 12
+    for item, array in zip(items[0::2], arrays):
+        assert item.dtype == np.uint8
+        assert np.array_equal(item, array)
+
+
+def test_an_unfinished_array_list_is_refused():
+    parser = ArrayListTextParser()
+    parser.feed(b'[[[1 2]]')
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_cell_observations_parse_every_printed_state():
+    classic = str(['[-0.04 0.02]', '(-0.5, 0.001)', '(-1.2, 0)'])
+    assert cell_observations(classic, 'classic').tolist() == [[-0.04, 0.02], [-0.5, 0.001], [-1.2, 0.0]]
+    assert cell_observations(str(['26', '126', '226']), 'tabular').tolist() == [26, 126, 226]
+
+
+def test_archive_files_hold_the_observations_of_their_trajectories():
+    archive = SevenZipArchive(BREAKOUT_ARCHIVE)
+    assert len(archive.names) == 2000 and archive.empty_names == []
+    (obs_name, obs_text), (traj_name, traj_text) = archive_texts(BREAKOUT_ARCHIVE, 2)
+    assert (obs_name, traj_name) == (archive.names[0], archive.names[1])
+    observations = parsed_items(obs_text, 4096)
+    trajectory = parsed_items(traj_text, 4096)
+    assert all(np.array_equal(a, b) for a, b in zip(observations, trajectory[0::2]))
+    assert len(trajectory) == 2 * len(observations) - 1
+
+
+def test_a_damaged_archive_fails_its_checks(tmp_path):
+    path = str(tmp_path / 'damaged.7z')
+    shutil.copy(BREAKOUT_ARCHIVE, path)
+    with open(path, 'r+b') as f:
+        f.seek(5000)
+        byte = f.read(1)
+        f.seek(5000)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises((ValueError, lzma.LZMAError)):
+        for _, chunks in SevenZipArchive(path).files():
+            chunks.skip()
+
+
+def test_atari_outputs_convert_in_archive_order(tmp_path):
+    [path] = convert_outputs([BREAKOUT_EXCEL], output_dir=str(tmp_path))
+    bundle = Bundle(path)
+    assert len(bundle) == 1000
+    assert bundle.constants['domain_name'] == 'Breakout_v4'
+    texts = archive_texts(BREAKOUT_ARCHIVE, 6)
+    for i, ((obs_name, _), (_, traj_text)) in enumerate(zip(texts[0::2], texts[1::2])):
+        record = bundle.record(i)
+        assert obs_name.endswith(f"_{record['policy_type']}_{record['seed']}_{record['execution_fault_mode']}_"
+                                 f"{record['fault_probability']}_{record['instance']}_obs.txt")
+        trajectory = parsed_items(traj_text, 1 << 16)
+        assert bundle.registered_actions(i).tolist() == trajectory[1::2]
+        assert np.array_equal(bundle.observations(i), np.stack(trajectory[0::2]))
+
+
+@pytest.mark.parametrize('domain_name, fault_mode', [('CartPole_v1', '[1,0]'), ('Taxi_v3', '[0,2,1,3,4,5]')])
+def test_excel_outputs_convert_into_the_generated_bundle(grid, tmp_path, domain_name, fault_mode):
+    filename = grid('converted', domain_name=domain_name, model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], modelled_fault_modes=[fault_mode], fault_probabilities=[0.5], instances=[1, 2])
+    generate_trajectories(filename, output_formats=['excel', 'bundle'])
+    generated = Bundle('outputs/tmp_converted_bundle')
+    converted = Bundle(convert_outputs(['outputs/tmp_converted.xlsx'], output_dir=str(tmp_path))[0])
+    assert converted.constants == generated.constants
+    assert len(converted) == len(generated) == 8
+    for i in range(len(generated)):
+        assert converted.record(i) == generated.record(i)
+        assert converted.registered_actions(i).tolist() == generated.registered_actions(i).tolist()
+        assert converted.faulty_actions_indices(i).tolist() == generated.faulty_actions_indices(i).tolist()
+        # the first observation of a classic record keeps the 8 decimals of its np.array2string
+        assert np.allclose(converted.observations(i), generated.observations(i), rtol=0.0, atol=1e-8)
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+from common.domains import domains, CLASSIC_DOMAINS, TABULAR_DOMAINS, ATARI_DOMAINS
+from common.state_refiners import refiners
+from common.wrappers import wrappers
+from conftest import ROOT, FACTORY_DIR
+
+
+def test_wrappers_and_refiners_follow_the_registry():
+    assert sorted(wrappers) == sorted(refiners) == sorted(CLASSIC_DOMAINS + TABULAR_DOMAINS)
+    for domain_name in CLASSIC_DOMAINS + TABULAR_DOMAINS:
+        assert wrappers[domain_name] is domains[domain_name].load('wrapper')
+        assert refiners[domain_name] is domains[domain_name].load('refiner')
+    assert sorted(CLASSIC_DOMAINS + TABULAR_DOMAINS + ATARI_DOMAINS) == sorted(domains)
+
+
+def test_a_classic_run_does_not_import_the_atari_dependencies():
+    code = ("import sys\n"
+            "from p02_traj_factory import generate_trajectory\n"
+            "generate_trajectory('CartPole_v1', 'PPO', 'deterministic', 1, '[1,0]', 1.0)\n"
+            "print(sorted(name for name in ['ale_py', 'pygame'] if name in sys.modules))\n")
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], cwd=FACTORY_DIR, check=True,
+                            capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=f"{ROOT}:{FACTORY_DIR}")).stdout
+    assert output.splitlines()[-1] == '[]'
+
+
+def test_importing_the_executor_does_not_load_torch():
+    code = ("import sys\n"
+            "import common.executor, common.inference_server, p02_traj_factory\n"
+            "print(sorted(name for name in ['torch', 'stable_baselines3'] if name in sys.modules))\n")
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], cwd=FACTORY_DIR, check=True,
+                            capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=f"{ROOT}:{FACTORY_DIR}")).stdout
+    assert output.splitlines()[-1] == '[]'
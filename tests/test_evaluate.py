@@ -0,0 +1,61 @@
+import pytest
+
+from common.bundles import BundleWriter
+from conftest import CONSTANTS, RECORDS
+from p02_evaluate import score, summarize, length_bucket_name, evaluate_diagnoser
+from p02_traj_factory import generate_trajectories
+
+
+def test_a_diagnosis_is_scored_against_the_ground_truth():
+    assert score({'fault_mode': '[1,0]', 'faulty_actions_indices': [2, 5]}, '[1,0]', [2, 4]) == {
+        'fault_mode_correct': True, 'true_positives': 1, 'false_positives': 1, 'false_negatives': 1,
+        'exact_match': False, 'first_fault_error': 0}
+    assert score({'fault_mode': '[0,0]'}, '[1,0]', [3]) == {
+        'fault_mode_correct': False, 'true_positives': None, 'false_positives': None, 'false_negatives': None,
+        'exact_match': None, 'first_fault_error': None}
+
+
+def test_summaries_add_up_the_scores():
+    results = [dict(score({'faulty_actions_indices': [1, 2]}, '[1,0]', [2, 3]), latency=0.5, num_registered_actions=10),
+               dict(score({'faulty_actions_indices': [4]}, '[1,0]', [4]), latency=1.5, num_registered_actions=30)]
+    summary = summarize(results)
+    assert summary['precision'] == pytest.approx(2 / 3)
+    assert summary['recall'] == pytest.approx(2 / 3)
+    assert summary['exact_match'] == 0.5
+    assert summary['first_fault_error'] == 0.5
+    assert summary['latency']['mean'] == 1.0
+    assert summary['steps_per_sec'] == 20.0
+    assert 'fault_mode_accuracy' not in summary
+    assert length_bucket_name(51) == '51-100'
+
+
+def test_the_null_diagnoser_is_the_floor(tmp_path):
+    writer = BundleWriter(str(tmp_path / 'bundle'), CONSTANTS)
+    for record in RECORDS:
+        writer.write(record)
+    writer.close()
+    report = evaluate_diagnoser('common.diagnosers:NullDiagnoser', [str(tmp_path / 'bundle')], chunk_size=2,
+                                output_path=str(tmp_path / 'report.json'))
+    assert report['summary']['num_records'] == 3
+    assert report['summary']['fault_mode_accuracy'] == pytest.approx(2 / 3)
+    assert report['summary']['recall'] == 0.0
+    assert [r['record'] for r in report['results']] == [0, 1, 2]
+    assert list(report['lengths']) == ['1-50']
+    selected = evaluate_diagnoser('common.diagnosers:NullDiagnoser', [str(tmp_path / 'bundle')],
+                                  conditions={'execution_fault_mode': '[0,0]'}, output_path=str(tmp_path / 'report.json'))
+    assert [r['record'] for r in selected['results']] == [2]
+
+
+@pytest.mark.parametrize('domain_name, fault_modes', [('CartPole_v1', ['[1,0]', '[0,0]']),
+                                                      ('Taxi_v3', ['[0,2,1,3,4,5]', '[1,0,2,3,4,5]'])])
+def test_the_replay_diagnoser_finds_the_faulty_actions(grid, tmp_path, domain_name, fault_modes):
+    filename = grid('evaluated', domain_name=domain_name, model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], modelled_fault_modes=fault_modes, fault_probabilities=[0.3], instances=[1])
+    generate_trajectories(filename, output_formats=['bundle'])
+    report = evaluate_diagnoser('common.diagnosers:ReplayDiagnoser', ['outputs/tmp_evaluated_bundle'], num_workers=2,
+                                chunk_size=3, output_path=str(tmp_path / 'report.json'))
+    assert report['summary']['num_records'] == 8
+    assert [r['record'] for r in report['results']] == list(range(8))
+    assert list(report['domains']) == [domain_name]
+    assert report['summary']['precision'] == 1.0
+    assert report['summary']['recall'] == 1.0
@@ -0,0 +1,97 @@
+import ast
+
+import gym
+import numpy as np
+import openpyxl
+import pytest
+
+from common.atari_store import AtariObservationStore
+from common.domains import domains
+from common.executor import execute_gym, make_env
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from conftest import excel_values
+from p02_traj_factory import observation_texts, trajectory_execution_texts, generate_trajectories, ExcelRecordWriter
+
+
+def published_row(path, row_number):
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    headers = next(rows)
+    for i, values in enumerate(rows, 2):
+        if i == row_number:
+            workbook.close()
+            return dict(zip(headers, values))
+
+
+def test_observation_cells_match_the_published_outputs():
+    # row 12 of the published MountainCar outputs, replayed with its faults where they were recorded
+    row = published_row('outputs/i3000_MountainCar.xlsx', 12)
+    faulty_actions_indices = ast.literal_eval(row['14_O_faulty_actions_indices'])
+    trajectory, _ = execute_gym('MountainCar_v0', 'DQN', row['08_policy_type'], row['09_i_seed'],
+                                row['10_i_execution_fault_mode'], row['11_i_fault_probability'],
+                                FaultModeGeneratorDiscrete(),
+                                fault_trigger=lambda action_number: action_number in faulty_actions_indices)
+    texts = observation_texts('MountainCar_v0', trajectory.observations)
+    assert str(texts) == row['15_O_observations']
+    assert str(trajectory_execution_texts(texts, trajectory.actions)) == row['16_O_trajectory_execution']
+
+
+def test_generated_records_are_an_excel_table_like_the_published_ones(grid):
+    filename = grid('table', domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic'], seeds=[1, 2],
+                    modelled_fault_modes=['[1,0]'], fault_probabilities=[0.3], instances=[1, 2])
+    generate_trajectories(filename)
+    worksheet = openpyxl.load_workbook('outputs/tmp_table.xlsx').worksheets[0]
+    assert dict(worksheet.tables.items()) == {'Table1': 'A1:S5'}
+    assert worksheet.tables['Table1'].tableStyleInfo.name == 'TableStyleMedium9'
+    assert [column.name for column in worksheet.tables['Table1'].tableColumns] == list(excel_values('outputs/tmp_table.xlsx')[0])
+
+
+def test_atari_cells_are_in_zip_file_and_the_store_follows_the_rows(grid):
+    params = dict(domain_name='Breakout_v4', model_name='PPO', policy_types=['deterministic'], seeds=[1],
+                  modelled_fault_modes=['[0,0,2,3]'], fault_probabilities=[0.5], instances=[1, 2])
+    grid('atari_cells', **params)
+    rng = np.random.default_rng(0)
+    observations = [rng.integers(0, 256, size=(length, 1, 84, 84, 4), dtype=np.uint8) for length in [3, 5]]
+    writer = ExcelRecordWriter('tmp_atari_cells')
+    for instance, instance_observations in zip([1, 2], observations):
+        writer.write(dict(params, policy_type='deterministic', seed=1, execution_fault_mode='[0,0,2,3]',
+                          fault_probability=0.5, instance=instance,
+                          registered_actions=np.ones(len(instance_observations) - 1, dtype=np.int64),
+                          faulty_actions_indices=[0], observations=instance_observations))
+    writer.close()
+    rows = excel_values('outputs/tmp_atari_cells.xlsx')[1:]
+    assert [row[14:16] for row in rows] == [('IN ZIP FILE', 'IN ZIP FILE')] * 2
+    store = AtariObservationStore('outputs/tmp_atari_cells_observations')
+    start = 0
+    for row, instance_observations in zip(rows, observations):
+        assert np.array_equal(store.observations(start, row[18]), instance_observations)
+        start += row[18]
+
+
+def swinging_action(domain_name, state):
+    # builds up speed, so the MountainCar car hits the left edge of its track
+    if domain_name == 'MountainCar_v0':
+        return 2 if state[1] > 0 else 0
+    return 0
+
+
+@pytest.mark.parametrize('domain_name', ['Acrobot_v1', 'CartPole_v1', 'MountainCar_v0', 'Taxi_v3', 'FrozenLake_v1'])
+def test_observation_texts_print_the_raw_states_of_the_env(domain_name):
+    # the str() of the state that the unwrapped env holds after the reset and after every step
+    unwrapped_env = gym.make(domains[domain_name].env_id)
+    env = make_env(domain_name)
+    unwrapped_env.reset(seed=3)
+    state, _ = env.reset(seed=3)
+    expected_texts = [str(getattr(unwrapped_env.unwrapped, env.state_attribute))]
+    states = [state]
+    for _ in range(150):
+        action = swinging_action(domain_name, states[-1])
+        _, _, done, _, _ = unwrapped_env.step(action)
+        state, _, _, _, _ = env.step(action)
+        expected_texts.append(str(getattr(unwrapped_env.unwrapped, env.state_attribute)))
+        states.append(state)
+        if done:
+            break
+    assert observation_texts(domain_name, np.array(states)) == expected_texts
+    if domain_name == 'MountainCar_v0':
+        assert '(-1.2, 0)' in expected_texts
@@ -0,0 +1,41 @@
+import random
+
+import numpy as np
+
+from common import executor
+from common.executor import acquire_env, release_env, get_model, clear_caches, execute_gym
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+
+
+def test_envs_and_models_are_created_once_per_process(monkeypatch):
+    clear_caches()
+    loads = []
+    load_model = executor.load_model
+
+    def counting_load_model(*args):
+        loads.append(args)
+        return load_model(*args)
+
+    monkeypatch.setattr(executor, 'load_model', counting_load_model)
+    env = acquire_env('CartPole_v1')
+    model = get_model('CartPole_v1', 'PPO', env)
+    release_env('CartPole_v1', env)
+    for _ in range(3):
+        pooled_env = acquire_env('CartPole_v1')
+        assert pooled_env is env
+        assert get_model('CartPole_v1', 'PPO', pooled_env) is model
+        release_env('CartPole_v1', pooled_env)
+    assert len(loads) == 1
+    clear_caches()
+
+
+def test_a_pooled_env_executes_like_a_new_one():
+    # the reset of every execution reseeds the env, so an env that ran other executions before gives the same one
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    clear_caches()
+    first, _ = execute_gym('Acrobot_v1', 'PPO', 'deterministic', 3, '[0,1,1]', 0.5, fault_mode_generator, rng=random.Random(1))
+    execute_gym('Acrobot_v1', 'PPO', 'deterministic', 4, '[0,1,1]', 0.5, fault_mode_generator, rng=random.Random(2))
+    again, _ = execute_gym('Acrobot_v1', 'PPO', 'deterministic', 3, '[0,1,1]', 0.5, fault_mode_generator, rng=random.Random(1))
+    assert first.actions.tolist() == again.actions.tolist()
+    assert np.array_equal(first.observations, again.observations)
+    clear_caches()
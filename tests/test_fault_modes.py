@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from common.fault_mode_generators import FaultModeGeneratorDiscrete, FaultModes, changed_actions, parse_fault_mode
+
+ACTIONS = [0, 1, 2, 2, 1, 0, 3]
+
+
+def executed_actions(args, actions, faulty):
+    fault_mode = FaultModeGeneratorDiscrete().generate_fault_mode_function(args)
+    return [fault_mode(action, is_faulty) for action, is_faulty in zip(actions, faulty)]
+
+
+@pytest.mark.parametrize('args, expected', [
+    ('[1,0,3,2]', [1, 0, 3, 3, 0, 1, 2]),
+    ('stuck_at:2', [2, 2, 2, 2, 2, 2, 2]),
+    ('stutter', [0, 0, 0, 0, 0, 0, 0]),
+    ('delay:2', [0, 1, 0, 1, 2, 2, 1]),
+])
+def test_every_action_fails(args, expected):
+    assert executed_actions(args, ACTIONS, [True] * len(ACTIONS)) == expected
+
+
+def test_only_the_faulty_actions_change():
+    faulty = [False, True, False, True, False, False, True]
+    assert executed_actions('[1,0,3,2]', ACTIONS, faulty) == [0, 0, 2, 3, 1, 0, 2]
+    # stutter repeats the previously executed action, which may be a faulty one itself
+    assert executed_actions('stutter', ACTIONS, faulty) == [0, 0, 2, 2, 1, 0, 0]
+
+
+def test_a_batch_applies_the_fault_mode_of_every_row():
+    fault_modes = ['[1,0,3,2]', 'stuck_at:2', 'stutter', 'delay:2']
+    rng = np.random.default_rng(0)
+    faulty = rng.random((len(fault_modes), len(ACTIONS))) < 0.5
+    batch = FaultModes(fault_modes)
+    rows = np.arange(len(fault_modes))
+    executed = np.array([batch.apply(rows, [action] * len(fault_modes), faulty[:, t]) for t, action in enumerate(ACTIONS)]).T
+    for i, args in enumerate(fault_modes):
+        assert executed[i].tolist() == executed_actions(args, ACTIONS, faulty[i])
+
+
+def test_a_faulty_action_out_of_the_mapping_raises():
+    fault_mode = FaultModeGeneratorDiscrete().generate_fault_mode_function('[1,0]')
+    # a mapping shorter than the widest one of its batch does not map the actions past its end to entry 0
+    batch = FaultModes(['[1,0]', '[1,0,3,2]'])
+    with pytest.raises(ValueError, match='out of the range'):
+        fault_mode(2)
+    with pytest.raises(ValueError, match='out of the range'):
+        fault_mode(-1)
+    with pytest.raises(ValueError, match=r'\[1,0\]'):
+        batch.apply([0, 1], [2, 2], [True, True])
+    # an action that does not fail is executed as it is
+    assert fault_mode(2, False) == 2
+    assert batch.apply([0, 1], [3, 3], [False, True]).tolist() == [3, 2]
+
+
+def test_changed_actions():
+    assert changed_actions('[1,1,2,3]', ACTIONS).tolist() == [True, False, False, False, False, True, False]
+    assert changed_actions('stuck_at:2', ACTIONS).tolist() == [True, True, False, False, True, True, True]
+    assert changed_actions('delay:2', ACTIONS).tolist() == [False, False, True, True, True, True, True]
+    with pytest.raises(ValueError, match='out of the range'):
+        changed_actions('[1,0]', ACTIONS)
+
+
+@pytest.mark.parametrize('args', ['[1,"a"]', 'stuck_at', 'delay:0', 'jitter:1'])
+def test_invalid_fault_modes(args):
+    with pytest.raises(ValueError):
+        parse_fault_mode(args)
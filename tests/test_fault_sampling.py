@@ -0,0 +1,67 @@
+import collections
+import random
+
+import numpy as np
+import pytest
+
+from p02_traj_factory import sample_first_fault_number, draw_first_fault_number, generate_trajectory, generate_trajectories
+
+CHANGED_ACTIONS = np.array([False, True, False, True, True, False])
+
+
+def frequencies(numbers):
+    counts = collections.Counter(numbers)
+    return {number: count / len(numbers) for number, count in counts.items()}
+
+
+def test_first_fault_weights_are_the_conditional_geometric_ones():
+    # the j-th action that the fault mode changes is the first failure with probability p * (1 - p) ** j, normalized
+    rng = random.Random(1)
+    numbers = [sample_first_fault_number(CHANGED_ACTIONS, 0.5, rng) for _ in range(20000)]
+    expected = {2: 4 / 7, 4: 2 / 7, 5: 1 / 7}
+    observed = frequencies(numbers)
+    assert observed.keys() == expected.keys()
+    for number, probability in expected.items():
+        assert observed[number] == pytest.approx(probability, abs=0.015)
+
+
+def test_conditional_first_fault_is_distributed_like_the_retry_loop():
+    # the retry loop redraws every fault free execution, so its first faults are the draws that are not None
+    rng = random.Random(2)
+    retried = [number for number in (draw_first_fault_number(CHANGED_ACTIONS, 0.3, rng) for _ in range(40000))
+               if number is not None]
+    conditional = [sample_first_fault_number(CHANGED_ACTIONS, 0.3, rng) for _ in range(len(retried))]
+    retried_frequencies = frequencies(retried)
+    conditional_frequencies = frequencies(conditional)
+    assert retried_frequencies.keys() == conditional_frequencies.keys()
+    for number in retried_frequencies:
+        assert conditional_frequencies[number] == pytest.approx(retried_frequencies[number], abs=0.015)
+
+
+def test_no_changed_action_cannot_fail():
+    with pytest.raises(ValueError):
+        sample_first_fault_number(np.zeros(4, dtype=bool), 0.5)
+    with pytest.raises(ValueError):
+        sample_first_fault_number(CHANGED_ACTIONS, 0.0)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_conditional_sampling_keeps_the_first_or_second_execution(seed):
+    # a fault probability this low almost never fails an action, which the retry loop would run many times for
+    trajectory, num_wasted_rollouts = generate_trajectory('Taxi_v3', 'PPO', 'deterministic', seed, '[1,0,0,0,0,0]', 0.01,
+                                                          'conditional', random.Random(3))
+    assert num_wasted_rollouts <= 1
+    assert len(trajectory.faulty_actions_indices) > 0
+
+
+def test_the_run_summary_reports_the_waste_of_conditional_sampling(grid, capsys):
+    filename = grid('conditional', domain_name='Taxi_v3', model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2, 3], modelled_fault_modes=['[1,0,0,0,0,0]'], fault_probabilities=[0.05], instances=[1])
+    generate_trajectories(filename, fault_sampling='conditional', output_formats=['bundle'])
+    lines = capsys.readouterr().out.splitlines()
+    wasted = [int(line.split(': ')[1]) for line in lines if line.startswith('wasted rollouts: ')]
+    summary = lines.index(f"wasted rollouts (conditional fault sampling): {sum(wasted)} in 6 instances")
+    conditioning, retries = [int(part.split(': ')[1]) for part in lines[summary + 1].strip().split(', ')]
+    assert sum(wasted) == conditioning + retries
+    # the deterministic cells come first, and each wastes its fault free execution at most
+    assert conditioning == sum(wasted[:3]) <= 3
@@ -0,0 +1,48 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from common.executor import make_env, load_model, action_probabilities, sample_actions
+from common.inference_server import InferenceServer, RemotePolicy, connect
+
+PROBABILITIES = np.array([[0.1, 0.2, 0.3, 0.4], [0.25, 0.25, 0.25, 0.25], [0.7, 0.1, 0.1, 0.1]])
+
+
+class FixedRemotePolicy(RemotePolicy):
+    # a client whose server always answers with PROBABILITIES
+    def __init__(self):
+        pass
+
+    def action_probabilities(self, observation):
+        return PROBABILITIES[:len(observation)]
+
+
+def test_stochastic_actions_are_drawn_with_the_generator_of_every_observation():
+    policy = FixedRemotePolicy()
+    observations = np.zeros((3, 1))
+    actions, _ = policy.predict(observations, rngs=[random.Random(seed) for seed in [1, 2, 3]])
+    expected = sample_actions(PROBABILITIES, [random.Random(seed) for seed in [1, 2, 3]])
+    assert actions.tolist() == expected.tolist()
+    # the action of an observation depends on its own generator only
+    first_actions, _ = policy.predict(observations[:1], rngs=[random.Random(1)])
+    assert first_actions[0] == actions[0]
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(os.path.dirname(__file__), '..', 'p02_traj_factory',
+                                                    'trained_models', 'Breakout_v4__A2C.zip')),
+                    reason='the Breakout model is not in trained_models')
+def test_the_server_answers_like_the_model():
+    env = make_env('Breakout_v4', seed=1)
+    model = load_model('Breakout_v4', 'A2C', env)
+    observations = np.concatenate([env.reset()] + [env.step(np.array([1]))[0] for _ in range(3)])
+    env.close()
+    server = InferenceServer('Breakout_v4', 'A2C', 1, len(observations))
+    try:
+        policy = connect(server.client_args)
+        assert policy.predict(observations, deterministic=True)[0].tolist() == model.predict(observations, deterministic=True)[0].tolist()
+        assert np.allclose(policy.action_probabilities(observations), action_probabilities(model, observations))
+        policy.block.close()
+    finally:
+        server.close()
@@ -0,0 +1,43 @@
+import random
+
+from common.bundles import Bundle
+from common.executor import execute_gym, is_invariant_execution
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from conftest import excel_values
+from p02_traj_factory import generate_trajectories, memoized_cells, expand_memoized_results
+
+
+def test_instances_of_an_invariant_cell_are_one_execution():
+    assert is_invariant_execution('deterministic', 1.0)
+    assert not is_invariant_execution('deterministic', 0.8)
+    assert not is_invariant_execution('stochastic', 1.0)
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    executions = [execute_gym('CartPole_v1', 'PPO', 'deterministic', 2, '[1,0]', 1.0, fault_mode_generator,
+                              rng=random.Random(instance))[0] for instance in range(3)]
+    assert all(execution.actions.tolist() == executions[0].actions.tolist() for execution in executions)
+
+
+def test_memoized_cells_repeat_the_first_instance():
+    cells = [('deterministic', 1, '[1,0]', 1.0, 1), ('deterministic', 1, '[1,0]', 1.0, 2),
+             ('deterministic', 1, '[1,0]', 0.5, 1), ('deterministic', 1, '[1,0]', 0.5, 2),
+             ('stochastic', 1, '[1,0]', 1.0, 1), ('stochastic', 1, '[1,0]', 1.0, 2), ('deterministic', 1, '[1,0]', 1.0, 3)]
+    copies = memoized_cells(cells)
+    assert copies == {cells[1]: cells[0], cells[6]: cells[0]}
+    computed = iter([('first', 2), ('a', 0), ('b', 1), ('c', 0), ('d', 3)])
+    assert list(expand_memoized_results(cells, copies, computed)) == [
+        ('first', 2), ('first', 0), ('a', 0), ('b', 1), ('c', 0), ('d', 3), ('first', 0)]
+
+
+def test_instances_of_invariant_cells_are_stored_as_references(grid):
+    filename = grid('memoized', domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,0]'], fault_probabilities=[1.0], instances=[1, 2, 3])
+    generate_trajectories(filename, output_formats=['excel', 'bundle'])
+    rows = excel_values('outputs/tmp_memoized.xlsx')[1:]
+    assert len(rows) == 6
+    bundle = Bundle('outputs/tmp_memoized_bundle')
+    starts = bundle.records['observations_start'].tolist()
+    assert starts[0] == starts[1] == starts[2] != starts[3] == starts[4] == starts[5]
+    for i in range(6):
+        first = 3 * (i // 3)
+        assert bundle.record(i)['instance'] == i % 3 + 1
+        assert bundle.registered_actions(i).tolist() == bundle.registered_actions(first).tolist()
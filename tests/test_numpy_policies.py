@@ -0,0 +1,92 @@
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from common import executor
+from common.domains import domains, CLASSIC_DOMAINS
+from common.executor import make_env, load_model, action_probabilities, sample_actions, clear_caches, policy_actions
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+from common.numpy_policies import numpy_policy, check_numpy_policy
+
+
+def classic_model(domain_name):
+    return load_model(domain_name, domains[domain_name].model_name, make_env(domain_name))
+
+
+@pytest.mark.parametrize('domain_name', CLASSIC_DOMAINS)
+def test_numpy_policy_matches_the_model(domain_name):
+    model = classic_model(domain_name)
+    policy = numpy_policy(model)
+    check_numpy_policy(model, policy)
+    observations = np.random.default_rng(1).uniform(-1, 1, size=(50,) + model.observation_space.shape).astype(np.float32)
+    assert np.allclose(policy.action_probabilities(observations), action_probabilities(model, observations), atol=1e-5)
+
+
+def sb3_action_probabilities(model, observations):
+    # the distribution that model.predict samples from: DQN takes a uniformly random action with probability
+    # exploration_rate and the argmax of its q values otherwise, an actor critic samples from the softmax of its logits
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(observations)
+        if hasattr(model, 'q_net'):
+            q_values = model.q_net(obs_tensor)
+            num_actions = q_values.shape[1]
+            greedy = torch.nn.functional.one_hot(q_values.argmax(dim=1), num_actions).double()
+            return (model.exploration_rate / num_actions + (1 - model.exploration_rate) * greedy).numpy()
+        logits = model.policy.get_distribution(obs_tensor).distribution.logits
+        return torch.softmax(logits.double(), dim=1).numpy()
+
+
+@pytest.mark.parametrize('domain_name', CLASSIC_DOMAINS)
+def test_sampling_distribution_matches_the_model(domain_name):
+    model = classic_model(domain_name)
+    policy = numpy_policy(model)
+    space = model.observation_space
+    observations = np.random.default_rng(5).uniform(np.maximum(space.low, -1), np.minimum(space.high, 1),
+                                                   size=(100,) + space.shape).astype(np.float32)
+    batched = policy.action_probabilities(observations)
+    assert batched.shape == (100, model.action_space.n)
+    assert np.allclose(batched, sb3_action_probabilities(model, observations), atol=1e-5)
+    assert np.allclose(batched.sum(axis=1), 1.0)
+    for observation in observations[:5]:
+        single = policy.action_probabilities(observation)
+        assert single.shape == (1, model.action_space.n)
+        assert np.allclose(single, sb3_action_probabilities(model, observation), atol=1e-5)
+
+
+def test_stochastic_actions_are_drawn_with_the_generator_of_every_observation():
+    policy = numpy_policy(classic_model('CartPole_v1'))
+    observations = np.random.default_rng(2).uniform(-0.2, 0.2, size=(20, 4)).astype(np.float32)
+    actions, _ = policy.predict(observations, rngs=[random.Random(seed) for seed in range(20)])
+    expected = sample_actions(policy.action_probabilities(observations), [random.Random(seed) for seed in range(20)])
+    assert actions.tolist() == expected.tolist()
+    # a single observation draws from its own generator too
+    action, _ = policy.predict(observations[5], rngs=[random.Random(5)])
+    assert action == actions[5]
+
+
+def test_only_the_deterministic_policy_type_is_greedy():
+    model = classic_model('CartPole_v1')
+    observations = np.random.default_rng(3).uniform(-0.2, 0.2, size=(200, 4)).astype(np.float32)
+    greedy, _ = model.predict(observations, deterministic=True)
+    assert policy_actions(model, observations, 'deterministic', None).tolist() == greedy.tolist()
+    sampled = policy_actions(model, observations, 'stochastic', [random.Random(seed) for seed in range(200)])
+    expected = sample_actions(action_probabilities(model, observations), [random.Random(seed) for seed in range(200)])
+    assert sampled.tolist() == expected.tolist()
+    assert sampled.tolist() != greedy.tolist()
+
+
+@pytest.mark.parametrize('policy_type', ['deterministic', 'stochastic'])
+def test_numpy_backend_executes_like_the_torch_backend(monkeypatch, policy_type):
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    trajectories = []
+    for backend in ['torch', 'numpy']:
+        monkeypatch.setattr(executor, 'INFERENCE_BACKEND', backend)
+        clear_caches()
+        trajectory, _ = executor.execute_gym('CartPole_v1', 'PPO', policy_type, 1, '[1,0]', 0.2, fault_mode_generator,
+                                             rng=random.Random(4))
+        trajectories.append(trajectory)
+    clear_caches()
+    assert trajectories[0].actions.tolist() == trajectories[1].actions.tolist()
+    assert np.array_equal(trajectories[0].observations, trajectories[1].observations)
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+import torch
+
+from conftest import excel_values
+from p02_traj_factory import generate_trajectories
+
+GRIDS = {
+    'CartPole_v1': dict(model_name='PPO', modelled_fault_modes=['[1,0]'], fault_probabilities=[0.3, 1.0]),
+    'Taxi_v3': dict(model_name='PPO', modelled_fault_modes=['[1,0,0,0,0,0]'], fault_probabilities=[0.3, 1.0]),
+}
+
+
+@pytest.mark.parametrize('domain_name', sorted(GRIDS))
+def test_a_pool_of_workers_writes_the_records_of_a_serial_run(grid, domain_name):
+    filename = grid('parallel', domain_name=domain_name, policy_types=['deterministic', 'stochastic'], seeds=[1, 2],
+                    instances=[1, 2], **GRIDS[domain_name])
+    # the serial run runs the policy on one thread like the workers, whatever the setting of the caller
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(max(4, os.cpu_count() or 1))
+    try:
+        generate_trajectories(filename)
+        assert torch.get_num_threads() == max(4, os.cpu_count() or 1)
+    finally:
+        torch.set_num_threads(num_threads)
+    serial = excel_values('outputs/tmp_parallel.xlsx')
+    generate_trajectories(filename, num_workers=2)
+    assert excel_values('outputs/tmp_parallel.xlsx') == serial
+    assert len(serial) == 1 + 2 * 2 * 2 * 2
@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from common import profiling
+from p02_traj_factory import generate_trajectories
+
+
+def test_nothing_is_recorded_until_enabled():
+    profiling.take()
+    with profiling.phase('predict', 'predicts', 3):
+        profiling.count('env_steps')
+    assert profiling.take() == {'phases': {}, 'counters': {}}
+
+
+def test_phases_and_counters_add_up_over_takes_and_merges():
+    profiling.take()
+    profiling.enable()
+    try:
+        for _ in range(2):
+            with profiling.phase('predict', 'predicts', 3):
+                profiling.count('env_steps', 2)
+        worker_stats = profiling.take()
+        assert worker_stats['counters'] == {'predicts': 6, 'env_steps': 4}
+        assert worker_stats['phases']['predict'][1] == 2
+        with profiling.phase('predict'):
+            pass
+        profiling.merge(worker_stats)
+        stats = profiling.take()
+    finally:
+        profiling.disable()
+    assert stats['counters'] == {'predicts': 6, 'env_steps': 4}
+    assert stats['phases']['predict'][1] == 3
+    assert stats['phases']['predict'][0] >= worker_stats['phases']['predict'][0]
+
+
+@pytest.mark.parametrize('profile', ['timers', 'cprofile'])
+def test_a_profiled_run_writes_its_report(grid, profile):
+    filename = grid('profiled', domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,0]'], fault_probabilities=[0.5], instances=[1])
+    generate_trajectories(filename, profile=profile)
+    with open('outputs/tmp_profiled_profile.json') as f:
+        report = json.load(f)
+    assert report['num_instances'] == 2
+    assert report['counters']['cells'] == 2
+    assert report['counters']['bytes_written'] == os.path.getsize('outputs/tmp_profiled.xlsx')
+    assert {'generate', 'predict', 'env_step', 'write'} <= set(report['phases'])
+    assert os.path.exists('outputs/tmp_profiled_profile.prof') == (profile == 'cprofile')
+    assert not profiling.is_enabled()
@@ -0,0 +1,78 @@
+import itertools
+import json
+import os
+
+import numpy as np
+import pytest
+
+from common.bundles import Bundle
+from conftest import excel_values
+from p02_traj_factory import generate_trajectories, merge_shards, grid_cells, shard_cells, split_to_batches, memoized_cells
+
+
+def assert_same_bundles(path, other_path):
+    bundle, other = Bundle(path), Bundle(other_path)
+    assert len(bundle) == len(other)
+    for i in range(len(bundle)):
+        assert bundle.record(i) == other.record(i)
+        assert bundle.registered_actions(i).tolist() == other.registered_actions(i).tolist()
+        assert bundle.faulty_actions_indices(i).tolist() == other.faulty_actions_indices(i).tolist()
+        assert np.array_equal(bundle.observations(i), other.observations(i))
+
+
+def test_merged_shards_are_a_single_run(grid):
+    filename = grid('sharded', domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,0]'], fault_probabilities=[0.3, 1.0], instances=[1, 2])
+    generate_trajectories(filename, output_formats=['excel', 'bundle'])
+    single = excel_values('outputs/tmp_sharded.xlsx')
+    os.rename('outputs/tmp_sharded_bundle', 'outputs/tmp_sharded_single_bundle')
+    os.remove('outputs/tmp_sharded.xlsx')
+    for shard_number in [1, 2, 3]:
+        generate_trajectories(filename, shard=(shard_number, 3))
+        assert os.path.isdir(f'outputs/tmp_sharded_shard_{shard_number}_of_3_bundle')
+    # the merge writes a single bundle, and the Excel file only when it is asked for
+    merge_shards(filename, 3)
+    assert not os.path.exists('outputs/tmp_sharded.xlsx')
+    assert_same_bundles('outputs/tmp_sharded_bundle', 'outputs/tmp_sharded_single_bundle')
+    merge_shards(filename, 3, output_formats=['excel'])
+    assert excel_values('outputs/tmp_sharded.xlsx') == single
+
+
+@pytest.mark.parametrize('batch_size, branching', [(3, False), (1, True)])
+def test_shards_run_the_batches_of_a_single_run(batch_size, branching):
+    params = dict(policy_types=['deterministic', 'stochastic'], seeds=[1, 2, 3], modelled_fault_modes=['[1,0]'],
+                  fault_probabilities=[0.3, 1.0], instances=[1, 2])
+    cells = grid_cells(params)
+    copies = memoized_cells(cells)
+    single_batches = split_to_batches([cell for cell in cells if cell not in copies], batch_size, branching)
+    shards = [shard_cells(cells, (shard_number, 2), batch_size, branching) for shard_number in [1, 2]]
+    assert sorted(itertools.chain.from_iterable(shards)) == sorted(cells)
+    for shard in shards:
+        shard_copies = memoized_cells(shard)
+        assert shard_copies == {cell: first for cell, first in copies.items() if cell in shard}
+        for batch in split_to_batches([cell for cell in shard if cell not in shard_copies], batch_size, branching):
+            assert batch in single_batches
+
+
+def test_merged_shards_of_batched_runs_are_a_single_batched_run(grid):
+    filename = grid('sharded', domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], modelled_fault_modes=['[1,0]'], fault_probabilities=[0.3, 0.6], instances=[1, 2])
+    generate_trajectories(filename, batch_size=3, output_formats=['bundle'])
+    os.rename('outputs/tmp_sharded_bundle', 'outputs/tmp_sharded_single_bundle')
+    for shard_number in [1, 2]:
+        generate_trajectories(filename, batch_size=3, shard=(shard_number, 2))
+    merge_shards(filename, 2)
+    assert_same_bundles('outputs/tmp_sharded_bundle', 'outputs/tmp_sharded_single_bundle')
+
+
+def test_cells_in_none_of_the_shards_are_reported(grid):
+    params = dict(domain_name='CartPole_v1', model_name='PPO', policy_types=['deterministic'], seeds=[1, 2],
+                  modelled_fault_modes=['[1,0]'], fault_probabilities=[0.5], instances=[1])
+    filename = grid('sharded', **params)
+    generate_trajectories(filename, shard=(1, 2))
+    generate_trajectories(filename, shard=(2, 2))
+    # the grid grew a seed after its shards were generated
+    with open(f'inputs/{filename}', 'w') as file:
+        json.dump(dict(params, seeds=[1, 2, 3]), file)
+    with pytest.raises(ValueError):
+        merge_shards(filename, 2)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from common.domains import CLASSIC_DOMAINS, TABULAR_DOMAINS
+from common.executor import make_env
+from common.state_refiners import refiners, acrobot_refiner, taxi_refiner
+
+
+def test_acrobot_batches_refine_like_single_states():
+    raw_states = np.random.default_rng(1).uniform(-3, 3, size=(16, 4))
+    expected = np.array([[np.cos(s[0]), np.sin(s[0]), np.cos(s[1]), np.sin(s[1]), s[2], s[3]] for s in raw_states],
+                        dtype=np.float32)
+    assert np.array_equal(acrobot_refiner(raw_states), expected)
+    assert np.array_equal(np.stack([acrobot_refiner(s) for s in raw_states]), expected)
+
+
+@pytest.mark.parametrize('domain_name', CLASSIC_DOMAINS)
+def test_refiners_write_into_the_buffer_of_the_caller(domain_name):
+    refiner = refiners[domain_name]
+    env = make_env(domain_name)
+    raw_states = np.stack([env.reset(seed=seed)[0] for seed in range(5)])
+    expected = refiner(raw_states)
+    out = np.full_like(expected, np.nan)
+    assert refiner(raw_states, out=out) is out
+    assert np.array_equal(out, expected)
+    # a slice of a larger buffer, as the lockstep executor refines its live rows
+    rows = np.zeros((8,) + expected.shape[1:], dtype=expected.dtype)
+    refiner(raw_states[1:4], out=rows[2:5])
+    assert np.array_equal(rows[2:5], expected[1:4])
+
+
+def test_tabular_refiners_return_ints_for_single_states():
+    assert taxi_refiner(np.int64(17)) == 17 and type(taxi_refiner(np.int64(17))) is int
+    assert taxi_refiner(np.array([3, 4])).tolist() == [3, 4]
+
+
+@pytest.mark.parametrize('domain_name', CLASSIC_DOMAINS + TABULAR_DOMAINS)
+def test_wrapped_states_do_not_alias_the_env(domain_name):
+    env = make_env(domain_name)
+    if domain_name in TABULAR_DOMAINS:
+        state, _ = env.reset(seed=1)
+        assert type(state) is int
+        return
+    out = np.empty(env.state_size)
+    state, _ = env.reset(seed=1, out=out)
+    assert state is out
+    stepped, _, _, _, _ = env.step(0)
+    assert stepped is not env.get_state()
+    before = stepped.copy()
+    env.step(0)
+    assert np.array_equal(stepped, before)
@@ -0,0 +1,44 @@
+from common.bundles import Bundle, BundleWriter
+from conftest import CONSTANTS, RECORDS
+from p02_traj_factory import ordered_pool_map
+
+
+class ImmediateResult:
+    def __init__(self, pool, value):
+        self.pool = pool
+        self.value = value
+
+    def get(self):
+        self.pool.in_flight -= 1
+        return self.value
+
+
+class CountingPool:
+    # runs every task on submission, and keeps track of the results that were not taken yet
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def apply_async(self, function, args):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return ImmediateResult(self, function(*args))
+
+
+def test_ordered_pool_map_keeps_the_order_and_the_window():
+    pool = CountingPool()
+    assert list(ordered_pool_map(pool, lambda x: x * x, range(10), 3)) == [x * x for x in range(10)]
+    assert pool.max_in_flight == 3
+
+
+def test_a_flushed_bundle_holds_the_records_written_so_far(tmp_path):
+    writer = BundleWriter(str(tmp_path / 'bundle'), CONSTANTS)
+    writer.write(RECORDS[0])
+    writer.write(RECORDS[1])
+    writer.flush()
+    bundle = Bundle(str(tmp_path / 'bundle'))
+    assert len(bundle) == 2
+    assert bundle.registered_actions(1).tolist() == RECORDS[1]['registered_actions'].tolist()
+    writer.write(RECORDS[2])
+    writer.close()
+    assert len(Bundle(str(tmp_path / 'bundle'))) == 3
@@ -0,0 +1,33 @@
+import random
+
+import numpy as np
+import pytest
+
+from common.executor import execute_gym, execute_tabular, execute_tabular_cell, clear_caches
+from common.fault_mode_generators import FaultModeGeneratorDiscrete
+
+FAULT_MODES = {
+    'Taxi_v3': ['[0,1,2,3,4,5]', '[0,2,1,3,4,5]', '[0,1,2,3,0,5]'],
+    'FrozenLake_v1': ['[0,1,2,3]', '[0,3,2,1]', '[2,1,0,3]'],
+}
+
+
+@pytest.mark.parametrize('domain_name', sorted(FAULT_MODES))
+@pytest.mark.parametrize('policy_type', ['deterministic', 'stochastic'])
+def test_table_executions_are_the_gym_executions(domain_name, policy_type):
+    fault_mode_generator = FaultModeGeneratorDiscrete()
+    clear_caches()
+    cells = [(seed, execution_fault_mode, fault_probability)
+             for seed in [1, 2, 3] for execution_fault_mode in FAULT_MODES[domain_name] for fault_probability in [0.4, 1.0]]
+    batch = execute_tabular(domain_name, 'PPO', policy_type, cells, fault_mode_generator, None,
+                            [random.Random(i) for i in range(len(cells))])
+    for i, (seed, execution_fault_mode, fault_probability) in enumerate(cells):
+        trajectory, faulty_actions_indices = execute_gym(domain_name, 'PPO', policy_type, seed, execution_fault_mode,
+                                                         fault_probability, fault_mode_generator, rng=random.Random(i))
+        assert batch[i][0].actions.tolist() == trajectory.actions.tolist()
+        assert batch[i][1] == faulty_actions_indices
+        assert np.array_equal(batch[i][0].observations, trajectory.observations)
+        single, _ = execute_tabular_cell(domain_name, 'PPO', policy_type, seed, execution_fault_mode, fault_probability,
+                                         fault_mode_generator, rng=random.Random(i))
+        assert single.actions.tolist() == trajectory.actions.tolist()
+    clear_caches()
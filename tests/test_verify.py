@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from common.bundles import Bundle, BundleWriter
+from p02_traj_factory import generate_trajectories
+from p02_verify import verify_bundle
+
+GRIDS = {
+    'CartPole_v1': dict(modelled_fault_modes=['[1,0]', '[0,0]'], fault_probabilities=[0.3, 1.0]),
+    'Taxi_v3': dict(modelled_fault_modes=['[0,2,1,3,4,5]', '[1,0,2,3,4,5]'], fault_probabilities=[0.3, 1.0]),
+    'FrozenLake_v1': dict(modelled_fault_modes=['[0,3,2,1]', '[2,1,0,3]'], fault_probabilities=[0.3, 1.0]),
+}
+
+
+def generated_bundle(grid, domain_name):
+    filename = grid('verified', domain_name=domain_name, model_name='PPO', policy_types=['deterministic', 'stochastic'],
+                    seeds=[1, 2], instances=[1], **GRIDS[domain_name])
+    generate_trajectories(filename, output_formats=['bundle'])
+    return 'outputs/tmp_verified_bundle'
+
+
+def rewritten_bundle(bundle, path, change):
+    # a copy of the bundle whose record arrays went through change(i, record)
+    writer = BundleWriter(path, bundle.constants)
+    for i in range(len(bundle)):
+        record = dict(bundle.constants, **bundle.record(i))
+        record.update(observations=np.array(bundle.observations(i)),
+                      registered_actions=np.array(bundle.registered_actions(i)),
+                      faulty_actions_indices=bundle.faulty_actions_indices(i).tolist())
+        change(i, record)
+        writer.write(record)
+    writer.close()
+    return path
+
+
+@pytest.mark.parametrize('domain_name', sorted(GRIDS))
+def test_generated_records_verify(grid, tmp_path, domain_name):
+    path = generated_bundle(grid, domain_name)
+    report = verify_bundle(path, chunk_size=3, output_path=str(tmp_path / 'report.json'))
+    assert report['num_records'] == 16
+    assert report['num_policy_checked'] == 8
+    assert report['num_transitions_checked'] == 16
+    assert report['mismatches'] == []
+
+
+def test_changed_records_are_reported(grid, tmp_path):
+    bundle = Bundle(generated_bundle(grid, 'CartPole_v1'))
+
+    def change(i, record):
+        if i == 0:
+            # a deterministic record whose second registered action is not the greedy one
+            record['registered_actions'][1] = 1 - record['registered_actions'][1]
+        if i == 5:
+            record['observations'][3] += 0.01
+
+    path = rewritten_bundle(bundle, str(tmp_path / 'changed'), change)
+    report = verify_bundle(path, output_path=str(tmp_path / 'report.json'))
+    assert report['num_mismatched_records'] == 2
+    checks = {(m['record'], m['check'], m['action_number']) for m in report['mismatches']}
+    assert (0, 'policy', 2) in checks
+    assert (5, 'transition', 3) in checks